@@ -3,27 +3,223 @@ import argparse
 import decond.analyze as da
 
 DEFAULT_OUTFILENAME = 'decond.d5'
+DEFAULT_RESAMPLEFILENAME = 'resample.h5'
+
+
+def memory_size(string):
+    """
+    Convert memory size such as 512M or 4G to number of bytes
+    """
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    try:
+        if string[-1].upper() in units:
+            return int(float(string[:-1]) * units[string[-1].upper()])
+        else:
+            return int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "invalid memory size: {}".format(string))
+
+
+def bin_window(string):
+    """
+    Convert window such as 3, log:10, equal:10, or 0,0.5,1,2
+    to the window of da.window_decond
+    """
+    try:
+        if ':' in string:
+            kind, num = string.split(':')
+            if kind not in ('log', 'equal'):
+                raise ValueError
+            return kind, int(num)
+        elif ',' in string:
+            return [float(edge) for edge in string.split(',')]
+        else:
+            return int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "invalid window: {}".format(string))
+
+
+def window_widths(string):
+    """
+    Convert widths such as 1:10 (inclusive) or 2,3,5 to a list of integers
+    """
+    try:
+        if ':' in string:
+            lower, upper = string.split(':')
+            return list(range(int(lower), int(upper) + 1))
+        else:
+            return [int(width) for width in string.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "invalid window widths: {}".format(string))
+
+
+def precision_profile(string):
+    """
+    Convert precision profile such as float64, float32, or scaleoffset:1e-4
+    to the precision of da.CorrFile
+    """
+    try:
+        if string in ('float64', 'float32'):
+            return string
+        kind, rel_err = string.split(':')
+        if kind != 'scaleoffset' or not 0 < float(rel_err) < 1:
+            raise ValueError
+        return float(rel_err)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "invalid precision profile: {}".format(string))
+
+
+def layout(args):
+    """
+    Return the HDF5 layout options of the output
+    """
+    return {'chunks': args.chunks,
+            'compression': args.compression,
+            'compression_opts': args.compression_level,
+            'shuffle': args.shuffle,
+            'precision': args.precision,
+            'rdcc_nbytes': args.chunk_cache}
+
+
+def add_layout_arguments(parser):
+    parser.add_argument('--chunks', nargs=2, type=int,
+                        metavar=('BIN', 'TIME'),
+                        help="chunk large datasets by one type x BIN bins "
+                             "x TIME time lags")
+    parser.add_argument('--compression', choices=['lzf', 'gzip'],
+                        help="compression filter of large datasets")
+    parser.add_argument('--compression-level', type=int, metavar='LEVEL',
+                        help="gzip compression level, 0-9")
+    parser.add_argument('--shuffle', action='store_true',
+                        help="apply the shuffle filter to large datasets")
+    parser.add_argument('--precision', type=precision_profile,
+                        metavar='PROFILE',
+                        help="storage of decCorr, decDCesaro and their "
+                             "errors: float64 (default), float32, or "
+                             "scaleoffset:R for the scale-offset filter "
+                             "within R of the largest magnitude")
+    parser.add_argument('--chunk-cache', type=memory_size, metavar='SIZE',
+                        help="HDF5 chunk cache size per dataset, "
+                             "ex. 64M")
+
+
+def max_bin(args):
+    return {da.DecType.spatial: args.max_spatial_bin,
+            da.DecType.energy: args.max_energy_bin}
+
+
+def add_limit_arguments(parser):
+    parser.add_argument('--max-lag', type=float, metavar='TIME',
+                        help="only read and keep timeLags up to TIME")
+    parser.add_argument('--max-spatial-bin', type=float, metavar='BIN',
+                        help="only read and keep spatial decBins up to BIN")
+    parser.add_argument('--max-energy-bin', type=float, metavar='BIN',
+                        help="only read and keep energy decBins within "
+                             "[-BIN, BIN]")
+
+
+def cesaro_cache(args):
+    if args.cesaro_cache is None:
+        return None
+    return da.CesaroCache(args.cesaro_cache, args.cesaro_cache_size)
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cesaro-cache', metavar='DIR',
+                        help="reuse the Cesaro data of corr files "
+                             "integrated before, cached in DIR")
+    parser.add_argument('--cesaro-cache-size', type=memory_size,
+                        metavar='SIZE',
+                        help="keep at most SIZE of cached Cesaro data, "
+                             "removing the least recently used, ex. 10G")
 
 
 def new(args):
-    da.new_decond(args.out, args.corr, args.fit)
+    da.new_decond(args.out, args.corr, args.fit,
+                  max_memory=args.max_memory, num_proc=args.jobs,
+                  max_lag=args.max_lag, max_bin=max_bin(args),
+                  cesaro_cache=cesaro_cache(args),
+                  block_average=args.block_average, **layout(args))
     print("output: " + args.out)
 
 
 def add(args):
-    da.extend_decond(args.out, args.decond, args.corr, args.fit)
+    if args.inplace:
+        if args.out is not None:
+            args.parser.error("--inplace cannot be used with -o/--out")
+        da.append_decond(args.decond, args.corr, args.fit,
+                         max_memory=args.max_memory, num_proc=args.jobs,
+                         max_lag=args.max_lag, max_bin=max_bin(args),
+                         cesaro_cache=cesaro_cache(args), **layout(args))
+        print("output: " + args.decond)
+    else:
+        out = DEFAULT_OUTFILENAME if args.out is None else args.out
+        da.extend_decond(out, args.decond, args.corr, args.fit,
+                         max_memory=args.max_memory, num_proc=args.jobs,
+                         max_lag=args.max_lag, max_bin=max_bin(args),
+                         cesaro_cache=cesaro_cache(args), **layout(args))
+        print("output: " + out)
+
+
+def merge(args):
+    da.merge_decond(args.out, args.decond, args.fit, **layout(args))
     print("output: " + args.out)
 
 
 def fit(args):
-    da.fit_decond(args.out, args.decond, args.fit)
-    print("output: " + args.out)
+    if args.inplace:
+        given = [option for option, value in
+                 (('-o/--out', args.out), ('--link', args.link or None))
+                 if value is not None]
+        if given:
+            args.parser.error("--inplace cannot be used with " +
+                              ", ".join(given))
+        da.refit_decond(args.decond, args.fit, **layout(args))
+        print("output: " + args.decond)
+    else:
+        out = DEFAULT_OUTFILENAME if args.out is None else args.out
+        da.fit_decond(out, args.decond, args.fit, link=args.link,
+                      **layout(args))
+        print("output: " + out)
+
+
+def scan(args):
+    da.scan_decond(args.decond, args.begin, args.end, args.num, args.dec,
+                   args.max_chi2, args.max_q, args.max_rel_err, args.apply,
+                   args.out)
 
 
 def window(args):
-    window = {da.DecType.spatial: args.spatial,
-              da.DecType.energy: args.energy}
-    da.window_decond(args.out, args.decond, window)
+    if args.sweep is not None:
+        given = {'-s/--spatial': args.spatial,
+                 '-e/--energy': args.energy,
+                 '--chunks': args.chunks,
+                 '--compression': args.compression,
+                 '--compression-level': args.compression_level,
+                 '--shuffle': args.shuffle or None,
+                 '--precision': args.precision,
+                 '--chunk-cache': args.chunk_cache}
+        given = [option for option, value in given.items()
+                 if value is not None]
+        if given:
+            args.parser.error("--sweep cannot be used with " +
+                              ", ".join(given))
+        da.sweep_window_decond(args.out, args.decond, args.sweep)
+        return
+    window = {da.DecType.spatial: 1 if args.spatial is None else args.spatial,
+              da.DecType.energy: 1 if args.energy is None else args.energy}
+    da.window_decond(args.out, args.decond, window, **layout(args))
+    print("output: " + args.out)
+
+
+def resample(args):
+    da.resample_decond(args.out, args.decond, args.corr or None, args.method,
+                       args.num, args.confidence, args.seed, args.slopes,
+                       num_proc=args.jobs, cesaro_cache=cesaro_cache(args))
     print("output: " + args.out)
 
 
@@ -31,6 +227,14 @@ def report(args):
     da.report_decond(args.decond)
 
 
+def compare(args):
+    da.compare_decond(args.decond, args.other)
+
+
+def inspect(args):
+    da.report_inspect(args.file, args.format, args.jobs)
+
+
 # create the top-level parser
 parser = argparse.ArgumentParser(
         description="Decond analysis tool, use subcommands to perform tasks")
@@ -38,8 +242,10 @@ parser.add_argument('-v', '--version', action='version',
                     version=da.__version__)
 subparsers = parser.add_subparsers(
         description="dec subcommand -h for more specific help. "
-                    "Note that all the subcommands will create new output "
-                    "instead of overwriting existing data")
+                    "Note that the subcommands create new output "
+                    "instead of overwriting existing data, except "
+                    "add --inplace, fit --inplace and scan --apply, "
+                    "which update <decond.d5> in place")
 
 
 # create the parser for the "new" subcommand
@@ -57,6 +263,19 @@ parser_new.add_argument('-f', '--fit', nargs=2, type=float,
 parser_new.add_argument('-o', '--out', default=DEFAULT_OUTFILENAME,
                         help="output decond file, default <{0}>".format(
                             DEFAULT_OUTFILENAME))
+parser_new.add_argument('--max-memory', type=memory_size, metavar='SIZE',
+                        help="process decomposed data in slabs using about "
+                             "SIZE of memory, ex. 512M, 4G")
+parser_new.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of processes to read corr files, "
+                             "default 1")
+parser_new.add_argument('--block-average', action='store_true',
+                        help="<corr.c5> are consecutive blocks of one "
+                             "trajectory, in order, and the errors are "
+                             "estimated by block averaging")
+add_limit_arguments(parser_new)
+add_cache_arguments(parser_new)
+add_layout_arguments(parser_new)
 
 parser_new.set_defaults(func=new)
 
@@ -75,11 +294,46 @@ parser_add.add_argument('-f', '--fit', nargs=2, type=float,
                         action='append',
                         help="fitting range in ps. Multiple ranges are allowed"
                              ", ex. -f <b1> <e1> -f <b2> <e2> ...")
+parser_add.add_argument('-o', '--out',
+                        help="output decond file, default <{0}>, "
+                             "not with --inplace".format(
+                                 DEFAULT_OUTFILENAME))
+parser_add.add_argument('--max-memory', type=memory_size, metavar='SIZE',
+                        help="process decomposed data in slabs using about "
+                             "SIZE of memory, ex. 512M, 4G")
+parser_add.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of processes to read corr files, "
+                             "default 1")
+parser_add.add_argument('--inplace', action='store_true',
+                        help="update <decond.d5> in place instead of "
+                             "writing OUT; an interrupted update is "
+                             "completed or rolled back on the next run")
+add_limit_arguments(parser_add)
+add_cache_arguments(parser_add)
+add_layout_arguments(parser_add)
+
+parser_add.set_defaults(func=add, parser=parser_add)
+
+
+# create the parser for the "merge" subcommand
+parser_add = subparsers.add_parser(
+        'merge',
+        help="merge decond.d5 files built from different corr.c5 data")
+
+parser_add.add_argument('decond', nargs='+',
+                        help="decond analysis files. <decond.d5>")
+parser_add.add_argument('-f', '--fit', nargs=2, type=float,
+                        metavar=('BEGIN', 'END'),
+                        action='append',
+                        help="fitting range in ps. Multiple ranges are allowed"
+                             ", ex. -f <b1> <e1> -f <b2> <e2> ..."
+                             " Default to those of the first decond file")
 parser_add.add_argument('-o', '--out', default=DEFAULT_OUTFILENAME,
                         help="output decond file, default <{0}>".format(
                             DEFAULT_OUTFILENAME))
+add_layout_arguments(parser_add)
 
-parser_add.set_defaults(func=add)
+parser_add.set_defaults(func=merge)
 
 
 # create the parser for the "fit" subcommand
@@ -94,11 +348,56 @@ parser_add.add_argument('-f', '--fit', nargs=2, type=float,
                         action='append', required=True,
                         help="fitting range in ps. Multiple ranges are allowed"
                              ", ex. -f <b1> <e1> -f <b2> <e2> ...")
-parser_add.add_argument('-o', '--out', default=DEFAULT_OUTFILENAME,
-                        help="output decond file, default <{0}>".format(
-                            DEFAULT_OUTFILENAME))
+parser_add.add_argument('-o', '--out',
+                        help="output decond file, default <{0}>, "
+                             "not with --inplace".format(
+                                 DEFAULT_OUTFILENAME))
+parser_add.add_argument('--inplace', action='store_true',
+                        help="update <decond.d5> in place instead of "
+                             "writing OUT")
+parser_add.add_argument('--link', action='store_true',
+                        help="link the unchanged datasets of OUT to "
+                             "<decond.d5> instead of copying them, "
+                             "not with --inplace")
+add_layout_arguments(parser_add)
+
+parser_add.set_defaults(func=fit, parser=parser_add)
+
+
+# create the parser for the "scan" subcommand
+parser_add = subparsers.add_parser(
+        'scan',
+        help="scan fit ranges of existing decond.d5 for the plateau of D")
 
-parser_add.set_defaults(func=fit)
+parser_add.add_argument('decond',
+                        help="decond analysis file. <decond.d5>")
+parser_add.add_argument('-b', '--begin', nargs=2, type=float,
+                        metavar=('LOWER', 'UPPER'),
+                        help="range of the fit begins in ps, "
+                             "default all time lags")
+parser_add.add_argument('-e', '--end', nargs=2, type=float,
+                        metavar=('LOWER', 'UPPER'),
+                        help="range of the fit ends in ps, "
+                             "default all time lags")
+parser_add.add_argument('-n', '--num', type=int, default=50, metavar='N',
+                        help="number of fit begins and ends, default 50")
+parser_add.add_argument('--dec', action='store_true',
+                        help="also scan decD")
+parser_add.add_argument('--max-chi2', type=float, metavar='CHI2',
+                        help="largest chi2 per degree of freedom "
+                             "on the plateau, for multiple samples")
+parser_add.add_argument('--max-q', type=float, metavar='Q',
+                        help="largest q on the plateau, "
+                             "for multiple samples")
+parser_add.add_argument('--max-rel-err', type=float, metavar='ERR',
+                        help="largest relative error of D on the plateau")
+parser_add.add_argument('-o', '--out',
+                        help="output file of the scanned D surfaces")
+parser_add.add_argument('--apply', action='store_true',
+                        help="refit <decond.d5> in place to the chosen "
+                             "fit range")
+
+parser_add.set_defaults(func=scan)
 
 
 # create the parser for the "window" subcommand
@@ -108,17 +407,64 @@ parser_add = subparsers.add_parser(
 
 parser_add.add_argument('decond',
                         help="decond analysis file. <decond.d5>")
-parser_add.add_argument('-s', '--spatial', type=int, metavar=('WINDOW'),
-                        default=1,
-                        help="spatial window")
-parser_add.add_argument('-e', '--energy', type=int, metavar=('WINDOW'),
-                        default=1,
-                        help="energy window")
+parser_add.add_argument('-s', '--spatial', type=bin_window,
+                        metavar=('WINDOW'),
+                        help="spatial window: number of bins merged, "
+                             "default 1, "
+                             "log:N or equal:N for N bins of log spaced "
+                             "edges or of equal pair counts, "
+                             "or comma separated bin edges")
+parser_add.add_argument('-e', '--energy', type=bin_window,
+                        metavar=('WINDOW'),
+                        help="energy window, same as the spatial window")
+parser_add.add_argument('--sweep', type=window_widths, metavar='WIDTHS',
+                        help="merge the bins by each of the integer "
+                             "windows WIDTHS, such as 1:10 or 2,3,5, "
+                             "into the groups <dectype>/<width> of OUT "
+                             "in one pass, skipping even energy windows; "
+                             "not with -s, -e or the layout options")
 parser_add.add_argument('-o', '--out', default=DEFAULT_OUTFILENAME,
                         help="output decond file, default <{0}>".format(
                             DEFAULT_OUTFILENAME))
+add_layout_arguments(parser_add)
 
-parser_add.set_defaults(func=window)
+parser_add.set_defaults(func=window, parser=parser_add)
+
+
+# create the parser for the "resample" subcommand
+parser_add = subparsers.add_parser(
+        'resample',
+        help="bootstrap or jackknife errors of existing decond.d5 "
+             "from its corr.c5 data")
+
+parser_add.add_argument('decond',
+                        help="decond analysis file. <decond.d5>")
+parser_add.add_argument('corr', nargs='*',
+                        help="correlation data files <decond.d5> is built "
+                             "from. <corr.c5>")
+parser_add.add_argument('-m', '--method', choices=['bootstrap', 'jackknife'],
+                        default='bootstrap',
+                        help="resampling method, default bootstrap")
+parser_add.add_argument('-n', '--num', type=int, default=1000, metavar='N',
+                        help="number of bootstrap resamples, default 1000")
+parser_add.add_argument('--confidence', type=float, default=0.95,
+                        metavar='LEVEL',
+                        help="level of the bootstrap percentile intervals, "
+                             "default 0.95")
+parser_add.add_argument('--seed', type=int,
+                        help="seed of the bootstrap resamples")
+parser_add.add_argument('--slopes', metavar='RESAMPLE',
+                        help="reuse the slopes of the samples in an earlier "
+                             "output RESAMPLE instead of reading <corr.c5>")
+parser_add.add_argument('-o', '--out', default=DEFAULT_RESAMPLEFILENAME,
+                        help="output file, default <{0}>".format(
+                            DEFAULT_RESAMPLEFILENAME))
+parser_add.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of processes to read corr files "
+                             "and to resample, default 1")
+add_cache_arguments(parser_add)
+
+parser_add.set_defaults(func=resample)
 
 
 # create the parser for the "report" subcommand
@@ -132,6 +478,39 @@ parser_add.add_argument('decond',
 parser_add.set_defaults(func=report)
 
 
+# create the parser for the "compare" subcommand
+parser_add = subparsers.add_parser(
+        'compare',
+        help="show the largest deviations of nD, decD and the decomposed "
+             "data between two decond.d5, such as of different precision "
+             "profiles")
+
+parser_add.add_argument('decond',
+                        help="reference decond analysis file. <decond.d5>")
+parser_add.add_argument('other',
+                        help="decond analysis file to compare. <decond.d5>")
+
+parser_add.set_defaults(func=compare)
+
+
+# create the parser for the "inspect" subcommand
+parser_add = subparsers.add_parser(
+        'inspect',
+        help="group corr.c5/decond.d5 files that can be aggregated, "
+             "reading only their headers")
+
+parser_add.add_argument('file', nargs='+',
+                        help="correlation data or decond analysis files. "
+                             "<corr.c5|decond.d5>")
+parser_add.add_argument('--format', choices=['json', 'csv'], default='json',
+                        help="output format, default json")
+parser_add.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help="number of processes to read the files, "
+                             "default 1")
+
+parser_add.set_defaults(func=inspect)
+
+
 # parse the args and call whatever function was selected
 args = parser.parse_args()
 args.func(args)
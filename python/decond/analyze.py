@@ -1,3 +1,9 @@
+import os
+import sys
+import csv
+import json
+import hashlib
+import functools
 import h5py
 import numpy as np
 import scipy.integrate as integrate
@@ -5,6 +11,7 @@ import scipy.constants as const
 from scipy.special import gammainc
 from scipy import interpolate
 from enum import Enum
+from concurrent.futures import ProcessPoolExecutor
 from ._version import __version__
 
 
@@ -57,17 +64,87 @@ class CorrFile(h5py.File):
     """
     Correlation data file output from decond.f90
 
-    Can only open eithr a new file to write or an old file to read
+    Can only open eithr a new file to write or an old file to read,
+    or an old file to update in place ('r+' mode). When updating, changed
+    datasets are written to shadow datasets first, which then replace
+    the old ones through a journal in the file attributes, so that an
+    interrupted update either leaves the old data intact or is completed
+    by the next 'r+' opening. New files keep track of their free space
+    across openings, so that the space freed by the old datasets is reused
+    by the shadows of the next update; older files can be converted by
+    h5repack -S FSM_AGGR -P 1.
+
+    If lazy is True, large datasets are not read when the file is opened.
+    Their buffer attributes are read from the file on first access instead,
+    and are kept in the buffer afterwards only if cache is True.
+    A lazy buffer is only usable while the file is open.
+
+    When writing, large datasets can be chunked and compressed:
+    chunks: (bin_block, time_block), each chunk holds one type (and fit)
+            and at most bin_block bins and time_block time lags;
+            None for h5py defaults
+    compression, compression_opts, shuffle: h5py filters, e.g.
+            compression='gzip', compression_opts=4, shuffle=True
+    precision: storage profile of decCorr, decDCesaro and their
+               *_err and *_m2, see _precision_options; they are read back
+               as float64, so all computations are still in float64
+    The h5py chunk cache size can be given by rdcc_nbytes.
+    If link is True, buffer attributes that are still datasets of another
+    file are written as external links to them instead of copies.
     """
-    def __init__(self, name, mode='r', **kwarg):
-        if mode not in ('r', 'w-', 'x'):
+    # axes of the datasets that are chunked and compressed
+    _data_axes = {'nCorr': ('type', 'time'),
+                  'nDCesaro': ('type', 'time'),
+                  'nDTotalCesaro': ('time',),
+                  'nD': ('fit', 'type'),
+                  'nDTotal': ('fit',),
+                  'decCorr': ('type', 'bin', 'time'),
+                  'decPairCount': ('type', 'bin'),
+                  'decDCesaro': ('type', 'bin', 'time'),
+                  'decD': ('fit', 'type', 'bin')}
+    # suffixes of the datasets of the same axes as their base data
+    _data_suffixes = ('_err', '_m2', '_sum')
+    # datasets that can be stored in reduced precision, with the suffixes
+    _reduced_data = ('decCorr', 'decDCesaro')
+
+    _shadow_suffix = '.shadow'
+    _journal_key = 'shadowJournal'
+
+    def __init__(self, name, mode='r', lazy=False, cache=True, chunks=None,
+                 compression=None, compression_opts=None, shuffle=False,
+                 precision=None, link=False, **kwarg):
+        if mode not in ('r', 'r+', 'w-', 'x'):
             raise Error(type(self).__name__ +
-                        " can only be opened in 'r', 'w-', 'x' mode")
+                        " can only be opened in 'r', 'r+', 'w-', 'x' mode")
+        if compression_opts is not None:
+            if compression is None:
+                raise Error("Compression options need compression='gzip'")
+            if compression != 'gzip':
+                raise Error("Compression options are only for gzip, "
+                            "not for " + compression)
+            if compression_opts not in range(10):
+                raise Error("gzip compression level must be 0-9")
+        if mode in ('w-', 'x'):
+            kwarg.setdefault('fs_strategy', 'fsm')
+            kwarg.setdefault('fs_persist', True)
         super().__init__(name, mode, **kwarg)
         self.filemode = mode
+        self.lazy = lazy
+        self.cache = cache
+        self.link = link
+        self.rdcc_nbytes = kwarg.get('rdcc_nbytes')
+        self.layout = {'chunks': chunks,
+                       'compression': compression,
+                       'compression_opts': compression_opts,
+                       'shuffle': shuffle,
+                       'precision': precision}
         self.buffer = CorrFile._Buffer()
+        self._sidecars = []  # opened by CesaroCache.load
 
-        if mode is 'r':
+        if mode == 'r+':
+            self._recover_shadows()
+
+        if mode in ('r', 'r+'):
             for type_ in DecType:
                 if type_.value in self:
                     setattr(self.buffer, type_.value, CorrFile._Buffer())
@@ -78,6 +155,10 @@ class CorrFile(h5py.File):
             self._read_corr_buffer()
 
     def _check(self):
+        if self._journal_key in self.attrs:
+            raise Error("File " + self.filename + " was interrupted while "
+                        "being updated in place. Open it in 'r+' mode "
+                        "to complete the update")
         if 'version' in self.attrs:
             self.buffer.version = self.attrs['version']
             (fmajor, fminor, fpatch) = (self.buffer.version.decode().
@@ -117,7 +198,7 @@ class CorrFile(h5py.File):
         self.buffer.timeLags_unit = self['timeLags'].attrs['unit']
         self.buffer.timeLags_width = (self.buffer.timeLags[1] -
                                       self.buffer.timeLags[0])
-        self.buffer.nCorr = self['nCorr'][...]
+        self._read_data(self.buffer, 'nCorr', self['nCorr'])
         self.buffer.nCorr_unit = self['nCorr'].attrs['unit']
 
         def do_dec(dectype):
@@ -126,14 +207,25 @@ class CorrFile(h5py.File):
             buf.decBins = dec_group['decBins'][...]
             buf.decBins_unit = dec_group['decBins'].attrs['unit']
             buf.decBins_width = buf.decBins[1] - buf.decBins[0]
-            buf.decCorr = dec_group['decCorr'][...]
+            self._read_data(buf, 'decCorr', dec_group['decCorr'])
             buf.decCorr_unit = dec_group['decCorr'].attrs['unit']
-            buf.decPairCount = dec_group['decPairCount'][...]
+            self._read_data(buf, 'decPairCount', dec_group['decPairCount'])
 
         for type_ in DecType:
             if type_.value in self:
                 do_dec(type_)
 
+    def _read_data(self, buf, name, dataset):
+        """
+        Read dataset into buf.<name>, or defer the reading if self.lazy
+        """
+        if self.lazy:
+            buf._defer(name, dataset, self.cache)
+        elif _is_reduced(dataset):
+            setattr(buf, name, _read_dataset(dataset))
+        else:
+            setattr(buf, name, dataset[...])
+
     @property
     def num_moltype(self):
         return _numtype(self.buffer.numMol)[0]
@@ -163,13 +255,7 @@ class CorrFile(h5py.File):
 
         Eg. for NaCl, ww = [1, 1, 1, 2, 1]
         """
-        ww = np.ones(self.num_alltype, dtype=np.int)
-        for i in range(self.num_moltype):
-            for j in range(i, self.num_moltype):
-                if i != j:
-                    ww[self.num_moltype +
-                       _pairtype_index(i, j, self.num_moltype)] = 2
-        return ww
+        return pair_type_index(self.num_moltype).ww
 
     @property
     def rdf(self):
@@ -181,17 +267,15 @@ class CorrFile(h5py.File):
         else:
             raise Error("No spatialDec is found, so no rdf")
 
-    def _cal_cesaro(self):
-        """
-        Calculate Cesaro data
+    def _cal_cesaro(self, dec=True):
         """
-        def cesaro_integrate(y, x):
-            cesaro = integrate.cumtrapz(y, x, initial=0)
-            cesaro = integrate.cumtrapz(cesaro, x, initial=0)
-            return cesaro
+        Calculate Cesaro data, except those loaded from a CesaroCache
 
-        self.buffer.nDCesaro = cesaro_integrate(self.buffer.nCorr,
-                                                self.buffer.timeLags)
+        dec: also calculate decDCesaro if True
+        """
+        if not self.buffer._has('nDCesaro'):
+            self.buffer.nDCesaro = _cesaro_integrate(self.buffer.nCorr,
+                                                     self.buffer.timeLags)
 
         qnttype = self.buffer.quantity.decode()
         if qnttype == Quantity.ec:
@@ -217,8 +301,9 @@ class CorrFile(h5py.File):
                     self.buffer.nCorr_unit.decode().split()[0])
 
         def do_dec(buf):
-            buf.decDCesaro = cesaro_integrate(
-                    buf.decCorr, self.buffer.timeLags)
+            if dec and not buf._has('decDCesaro'):
+                buf.decDCesaro = _cesaro_integrate(
+                        buf.decCorr, self.buffer.timeLags)
             buf.decDCesaro_unit = np.string_(
                     buf.decCorr_unit.decode().split()[0])
 
@@ -231,41 +316,240 @@ class CorrFile(h5py.File):
         self.attrs['version'] = np.string_(__version__)
         self.attrs['type'] = np.string_(type(self).__name__)
         self.attrs[Quantity.key] = self.buffer.quantity
-        self['charge'] = self.buffer.charge
-        self['charge'].attrs['unit'] = self.buffer.charge_unit
-        self['numMol'] = self.buffer.numMol
-        self['volume'] = self.buffer.volume
-        self['volume'].attrs['unit'] = self.buffer.volume_unit
-        self['temperature'] = self.buffer.temperature
-        self['temperature'].attrs['unit'] = self.buffer.temperature_unit
-        self['timeLags'] = self.buffer.timeLags
-        self['timeLags'].attrs['unit'] = self.buffer.timeLags_unit
-        self['nCorr'] = self.buffer.nCorr
-        self['nCorr'].attrs['unit'] = self.buffer.nCorr_unit
+        self._write_data(self, 'charge', self.buffer.charge)
+        self._write_unit(self, 'charge', self.buffer.charge_unit)
+        self._write_data(self, 'numMol', self.buffer.numMol)
+        self._write_data(self, 'volume', self.buffer.volume)
+        self._write_unit(self, 'volume', self.buffer.volume_unit)
+        self._write_data(self, 'temperature', self.buffer.temperature)
+        self._write_unit(self, 'temperature', self.buffer.temperature_unit)
+        self._write_data(self, 'timeLags', self.buffer.timeLags)
+        self._write_unit(self, 'timeLags', self.buffer.timeLags_unit)
+        self._write_data(self, 'nCorr', self.buffer.nCorr)
+        self._write_unit(self, 'nCorr', self.buffer.nCorr_unit)
 
         def do_dec(dectype):
             dec_group = self.require_group(dectype.value)
             buf = getattr(self.buffer, dectype.value)
-            dec_group['decBins'] = buf.decBins
-            dec_group['decCorr'] = buf.decCorr
-            dec_group['decPairCount'] = buf.decPairCount
+            self._write_data(dec_group, 'decBins', buf.decBins)
+            self._write_data(dec_group, 'decCorr', buf.decCorr)
+            self._write_data(dec_group, 'decPairCount', buf.decPairCount)
 
-            dec_group['decBins'].attrs['unit'] = buf.decBins_unit
-            dec_group['decCorr'].attrs['unit'] = buf.decCorr_unit
+            self._write_unit(dec_group, 'decBins', buf.decBins_unit)
+            self._write_unit(dec_group, 'decCorr', buf.decCorr_unit)
 
         for type_ in DecType:
             if getattr(self.buffer, type_.value) is not None:
                 do_dec(type_)
 
+    def _write_data(self, group, name, data):
+        """
+        Write data to group[name], unless data is that very dataset,
+        which is the case when it has been written slab by slab
+        """
+        if isinstance(data, h5py.Dataset) and data in (
+                group.get(name), group.get(name + self._shadow_suffix)):
+            return
+        if (self.filemode == 'r+' and name in group and
+                self._base_name(name) not in self._data_axes and
+                np.array_equal(group[name][...], data)):
+            return  # unchanged header data
+        if (self.link and isinstance(data, h5py.Dataset) and
+                data.file.filename != self.filename):
+            group[name] = h5py.ExternalLink(
+                    os.path.relpath(data.file.filename,
+                                    os.path.dirname(self.filename)),
+                    data.name)
+            return
+        self._create_dataset(group, name, data=data)
+
+    def _write_unit(self, group, name, unit):
+        """
+        Set the unit attribute of group[name], or of its shadow,
+        unless it is already set or group[name] is linked to another file
+        """
+        if isinstance(group.get(name, getlink=True), h5py.ExternalLink):
+            return
+        dataset = group.get(name + self._shadow_suffix)
+        if dataset is None:
+            dataset = group[name]
+        if dataset.attrs.get('unit') != unit:
+            dataset.attrs['unit'] = unit
+
+    def _create_dataset(self, group, name, shape=None, dtype=None,
+                        data=None):
+        """
+        Create dataset group[name] with the layout of this file
+
+        In 'r+' mode, the shadow of an existing dataset is created instead,
+        which replaces the dataset when the file is closed.
+        If no layout is given, the shadow inherits the old layout.
+        """
+        if shape is None:
+            shape = np.shape(data)
+        if isinstance(data, h5py.Dataset) and (
+                _is_reduced(data) or self._precision_options(name, None)):
+            data = _read_dataset(data)
+        options = self._dataset_options(name, shape)
+        options.update(self._precision_options(name, data))
+        if self.filemode == 'r+' and name in group:
+            old = group[name]
+            if not any(self.layout.values()):
+                options = {}
+                if old.chunks is not None:
+                    options = {'chunks': tuple(max(1, min(c, s)) for c, s in
+                                               zip(old.chunks, shape)),
+                               'compression': old.compression,
+                               'compression_opts': old.compression_opts,
+                               'shuffle': old.shuffle}
+                if old.scaleoffset is not None:
+                    options.update(scaleoffset=old.scaleoffset,
+                                   fillvalue=old.fillvalue)
+                if old.dtype == np.float32:
+                    options['dtype'] = old.dtype
+            name += self._shadow_suffix
+            if name in group:
+                del group[name]
+        dtype = options.pop('dtype', dtype)
+        if isinstance(data, h5py.Dataset) and (dtype is not None or
+                                               'scaleoffset' in options):
+            data = _read_dataset(data)
+        if 'scaleoffset' in options:
+            if data is None:
+                raise Error("Scale-offset storage needs the whole data of " +
+                            name + ", which cannot be written slab by slab")
+            options.setdefault('chunks', True)
+            data = np.where(np.isnan(data), options['fillvalue'], data)
+        return group.create_dataset(name, shape, dtype, data, **options)
+
+    def _swap_shadows(self):
+        """
+        Replace datasets by their shadows through a journal
+        """
+        shadows = []
+
+        def find_shadow(name):
+            if name.endswith(self._shadow_suffix):
+                shadows.append(name)
+
+        self.visit(find_shadow)
+        if shadows:
+            self.flush()
+            self.attrs[self._journal_key] = np.string_('\n'.join(shadows))
+            self.flush()
+            self._recover_shadows()
+
+    def _recover_shadows(self):
+        """
+        Complete the journaled replacement by shadows if there is one,
+        otherwise remove the shadows left by an interrupted update
+        """
+        if self._journal_key in self.attrs:
+            for shadow in self.attrs[self._journal_key].decode().split('\n'):
+                name = shadow[:-len(self._shadow_suffix)]
+                if shadow in self:
+                    if name in self:
+                        for key, value in self[name].attrs.items():
+                            if key not in self[shadow].attrs:
+                                self[shadow].attrs[key] = value
+                        del self[name]
+                    self.move(shadow, name)
+            del self.attrs[self._journal_key]
+        else:
+            shadows = []
+
+            def find_shadow(name):
+                if name.endswith(self._shadow_suffix):
+                    shadows.append(name)
+
+            self.visit(find_shadow)
+            for shadow in shadows:
+                del self[shadow]
+        self.flush()
+
+    def _base_name(self, name):
+        """
+        Return name without the suffixes of _data_suffixes
+        """
+        for suffix in self._data_suffixes:
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+        return name
+
+    def _precision_options(self, name, data):
+        """
+        Return the create_dataset options of the precision profile
+        for dataset name of data, which is None if written later
+
+        The profiles are None or 'float64' for full precision, 'float32',
+        or a relative error R for the scale-offset filter keeping the
+        decimal digits such that the error is at most R times the largest
+        magnitude of the data. The nan are stored as the fill value.
+        """
+        precision = self.layout['precision']
+        if (precision in (None, 'float64') or
+                self._base_name(name) not in self._reduced_data):
+            return {}
+        if precision == 'float32':
+            return {'dtype': np.float32}
+        if not isinstance(precision, float) or not 0 < precision < 1:
+            raise Error("Unknown precision profile: {}".format(precision))
+
+        options = {'fillvalue': np.finfo(np.float64).max, 'scaleoffset': 0}
+        if data is not None:
+            data = np.abs(data[...])
+            max_abs = np.max(data, initial=0, where=np.isfinite(data))
+            if max_abs > 0:
+                options['scaleoffset'] = max(0, int(np.ceil(
+                    -np.log10(2 * precision * max_abs))))
+        return options
+
+    def _dataset_options(self, name, shape):
+        """
+        Return the create_dataset options of chunking and compression
+        for dataset name of shape
+        """
+        axes = self._data_axes.get(self._base_name(name))
+        if axes is None or len(axes) != len(shape):
+            return {}
+
+        options = {}
+        if self.layout['chunks'] is not None:
+            bin_block, time_block = self.layout['chunks']
+            block = {'fit': 1, 'type': 1, 'bin': bin_block,
+                     'time': time_block}
+            options['chunks'] = tuple(max(1, min(block[axis], size))
+                                      for axis, size in zip(axes, shape))
+        if self.layout['compression'] is not None:
+            options['compression'] = self.layout['compression']
+            if self.layout['compression_opts'] is not None:
+                options['compression_opts'] = self.layout['compression_opts']
+        if self.layout['shuffle']:
+            options['shuffle'] = True
+        return options
+
     def _shrink_corr_buffer(self, sel):
         self.buffer.timeLags = self.buffer.timeLags[sel]
-        self.buffer.nCorr = self.buffer.nCorr[..., sel]
+        self.buffer.nCorr = self.buffer._read('nCorr', np.s_[..., sel])
+        if self.buffer._has('nDCesaro'):
+            self.buffer.nDCesaro = self.buffer._read('nDCesaro',
+                                                     np.s_[..., sel])
+
+    def _shrink_buffer(self, sel, dec_sels):
+        """
+        Shrink the buffer to timeLags[sel] and decBins[dec_sels[dectype]]
+        """
+        self._shrink_corr_buffer(sel)
+        for dectype, sel_dec in dec_sels.items():
+            self._shrink_dec_buffer(dectype, sel, sel_dec)
 
     def _shrink_dec_buffer(self, dectype, sel, sel_dec):
         buf = getattr(self.buffer, dectype.value)
         buf.decBins = buf.decBins[sel_dec]
-        buf.decCorr = buf.decCorr[:, sel_dec, sel]
+        buf.decCorr = buf._read('decCorr', np.s_[:, sel_dec, sel])
         buf.decPairCount = buf.decPairCount[:, sel_dec]
+        if buf._has('decDCesaro'):
+            buf.decDCesaro = buf._read('decDCesaro', np.s_[:, sel_dec, sel])
 
     def _intersect_buffer(self, new_file):
         s_sel, n_sel = _get_inner_sel(
@@ -289,22 +573,103 @@ class CorrFile(h5py.File):
             if getattr(self.buffer, type_.value) is not None:
                 do_dec(type_)
 
+    def __exit__(self, *args):
+        if args[0] is not None and self.filemode == 'r+':
+            # keep the old data intact
+            self.filemode = 'r'
+        super().__exit__(*args)
+
     def close(self):
-        if self.filemode in ('w-', 'x'):
+        if self.filemode in ('w-', 'x') and self:
+            if self.link:
+                self._keep_deferred()
             self._write_buffer()
+        elif self.filemode == 'r+' and self:
+            self._keep_deferred()
+            self._write_buffer()
+            self._swap_shadows()
         super().close()
+        for sidecar in self._sidecars:
+            sidecar.close()
+
+    def _keep_deferred(self):
+        """
+        Keep the buffer attributes that have never been read as their
+        datasets, since they are unchanged
+        """
+        self.buffer._keep_deferred()
+        for type_ in DecType:
+            buf = getattr(self.buffer, type_.value, None)
+            if buf is not None:
+                buf._keep_deferred()
 
     class _Buffer():
-        pass
+        """
+        Container of data attributes
+
+        Attributes registered by _defer are read from their h5py dataset
+        on first access, as copy-on-write memory maps when possible.
+        """
+        def _defer(self, name, dataset, cache=True):
+            self.__dict__.setdefault('_deferred', {})[name] = (dataset, cache)
+
+        def _keep_deferred(self):
+            """
+            Set the attributes not read yet to their h5py datasets
+            """
+            for name, (dataset, cache) in list(
+                    self.__dict__.get('_deferred', {}).items()):
+                setattr(self, name, dataset)
+
+        def __setattr__(self, name, value):
+            self.__dict__.get('_deferred', {}).pop(name, None)
+            super().__setattr__(name, value)
+
+        def __getattr__(self, name):
+            deferred = self.__dict__.get('_deferred', {})
+            if name not in deferred:
+                raise AttributeError(name)
+            dataset, cache = deferred[name]
+            data = _read_dataset(dataset, mode='c')
+            if cache:
+                setattr(self, name, data)
+            return data
+
+        def _has(self, name):
+            """
+            Return True if <name> is set or deferred, without reading it
+            """
+            return (name in self.__dict__ or
+                    name in self.__dict__.get('_deferred', {}))
+
+        def _read(self, name, sel=Ellipsis):
+            """
+            Return <name>[sel], reading only the selection from the file
+            if <name> has not been read yet
+            """
+            deferred = self.__dict__.get('_deferred', {})
+            if name in deferred:
+                return _read_dataset(deferred[name][0], sel, 'c')
+            return getattr(self, name)[sel]
 
 
 class DecondFile(CorrFile):
     """
     Analyzed data
+
+    Since format revision 2, the m2 of the samples and the sums of
+    decPairCount are stored along with the errors, so that adding samples
+    needs no conversion and loses nothing when numSample is one. Files
+    without them are still read, restoring m2 from the errors.
     """
-    def __init__(self, name, mode='r', **kwarg):
-        super().__init__(name, mode, **kwarg)
-        if mode in ('r'):
+    _format_revision = 2
+    _format_revision_key = 'formatRevision'
+
+    def __init__(self, name, mode='r', lazy=False, cache=True, **kwarg):
+        super().__init__(name, mode, lazy, cache, **kwarg)
+        self._accumulators = {}  # of _add_corr_data
+        self._blockers = {}  # of _add_block_data
+        if mode in ('r', 'r+'):
             self._read_decond_buffer()
         else:
             self.buffer.numSample = 0  # initialize empty data
@@ -313,16 +678,38 @@ class DecondFile(CorrFile):
     def fit_sel(self):
         return _fit_to_sel(self.buffer.fit, self.buffer.timeLags)
 
+    def _check(self):
+        super()._check()
+        if self.attrs.get(self._format_revision_key, 1) > \
+                self._format_revision:
+            raise Error("File " + self.filename + " is of format revision " +
+                        str(self.attrs[self._format_revision_key]) +
+                        ", while this program reads only up to " +
+                        str(self._format_revision))
+
     def _read_decond_buffer(self):
+        def read_m2(buf, group, names):
+            """
+            Read or defer the <name>_m2 and <name>_sum stored in group
+            """
+            for name in names:
+                if name in group:
+                    if group[name].shape == ():
+                        setattr(buf, name, group[name][...])
+                    else:
+                        self._read_data(buf, name, group[name])
+
         self.buffer.numSample = self['numSample'][...]
         self.buffer.volume_err = self['volume_err'][...]
         self.buffer.temperature_err = self['temperature_err'][...]
-        self.buffer.nCorr_err = self['nCorr_err'][...]
-        self.buffer.nDCesaro = self['nDCesaro'][...]
-        self.buffer.nDCesaro_err = self['nDCesaro_err'][...]
+        self._read_data(self.buffer, 'nCorr_err', self['nCorr_err'])
+        self._read_data(self.buffer, 'nDCesaro', self['nDCesaro'])
+        self._read_data(self.buffer, 'nDCesaro_err', self['nDCesaro_err'])
         self.buffer.nDCesaro_unit = self['nDCesaro'].attrs['unit']
-        self.buffer.nDTotalCesaro = self['nDTotalCesaro'][...]
-        self.buffer.nDTotalCesaro_err = self['nDTotalCesaro_err'][...]
+        self._read_data(self.buffer, 'nDTotalCesaro',
+                        self['nDTotalCesaro'])
+        self._read_data(self.buffer, 'nDTotalCesaro_err',
+                        self['nDTotalCesaro_err'])
         self.buffer.nDTotalCesaro_unit = self['nDTotalCesaro'].attrs['unit']
         self.buffer.fit = self['fit'][...]
         self.buffer.fit_unit = self['fit'].attrs['unit']
@@ -332,14 +719,21 @@ class DecondFile(CorrFile):
         self.buffer.nDTotal = self['nDTotal'][...]
         self.buffer.nDTotal_err = self['nDTotal_err'][...]
         self.buffer.nDTotal_unit = self['nDTotal'].attrs['unit']
+        read_m2(self.buffer, self, ('volume_m2', 'temperature_m2',
+                                    'nCorr_m2', 'nDCesaro_m2',
+                                    'nDTotalCesaro_m2'))
 
         def do_dec(dectype):
             dec_group = self[dectype.value]
             buf = getattr(self.buffer, dectype.value)
-            buf.decCorr_err = dec_group['decCorr_err'][...]
-            buf.decPairCount_err = dec_group['decPairCount_err'][...]
-            buf.decDCesaro = dec_group['decDCesaro'][...]
-            buf.decDCesaro_err = dec_group['decDCesaro_err'][...]
+            read_m2(buf, dec_group, ('decCorr_m2', 'decDCesaro_m2',
+                                     'decPairCount_m2', 'decPairCount_sum'))
+            self._read_data(buf, 'decCorr_err', dec_group['decCorr_err'])
+            self._read_data(buf, 'decPairCount_err',
+                            dec_group['decPairCount_err'])
+            self._read_data(buf, 'decDCesaro', dec_group['decDCesaro'])
+            self._read_data(buf, 'decDCesaro_err',
+                            dec_group['decDCesaro_err'])
             buf.decDCesaro_unit = dec_group['decDCesaro'].attrs['unit']
             buf.decD = dec_group['decD'][...]
             buf.decD_err = dec_group['decD_err'][...]
@@ -349,7 +743,22 @@ class DecondFile(CorrFile):
             if type_.value in self:
                 do_dec(type_)
 
-    def _add_sample(self, samples, fit, report):
+    def _add_sample(self, samples, fit, report, max_memory=None,
+                    num_proc=1, max_lag=None, max_bin=None,
+                    cesaro_cache=None, block_average=False):
+        """
+        Add corr samples to the buffer
+
+        The timeLags and decBins of all samples are scanned first, and
+        each sample is then read only over the common grid, which is
+        further limited to timeLags <= max_lag and
+        |decBins| <= max_bin[dectype] if they are given.
+
+        cesaro_cache: CesaroCache of the Cesaro data of the samples
+        block_average: if True, the samples are consecutive blocks of one
+                       trajectory, and *_err are estimated by block
+                       averaging, see _finish_block_data
+        """
         if not isinstance(samples, list):
             samples = [samples]
 
@@ -360,194 +769,547 @@ class DecondFile(CorrFile):
 
         self.buffer.quantity = np.string_(qnttype_list[0])
 
-        if self.buffer.numSample == 0:
+        if block_average and (max_memory is not None or num_proc > 1 or
+                              self.buffer.numSample > 0):
+            raise Error("Block averaging can only read the samples of "
+                        "a new decond file one by one in order")
+
+        if max_memory is not None:
+            if num_proc > 1:
+                raise Error("max_memory and num_proc > 1 "
+                            "cannot be used together")
+            if isinstance(self.layout['precision'], float):
+                raise Error("max_memory and the scale-offset precision "
+                            "cannot be used together")
+            self._add_sample_slabs(samples, fit, report, max_memory,
+                                   max_lag, max_bin, cesaro_cache)
+            return
+
+        t_sels, dec_sels = self._get_sample_grid(samples, max_lag, max_bin)
+
+        if num_proc > 1:
+            self._add_sample_parallel(samples, fit, report, num_proc,
+                                      t_sels, dec_sels, cesaro_cache)
+            return
+
+        if self.buffer.numSample > 0:
+            # not new file, buffer should have already been loaded
+            self._restore_m2()
+            self._shrink_buffer(t_sels.pop(0), dec_sels.pop(0))
+
+        # add samples one by one
+        for i, sample in enumerate(samples):
             if (report):
                 print("Reading {0} of {1} corr files: {2}".format(
-                    1, len(samples), samples[0]))
-            with CorrFile(samples[0]) as cf:
-                cf._cal_cesaro()
-                self.buffer = cf.buffer
-            self.buffer.numSample = 1
-
-            def init_Err(data_name):
-                data_name_m2 = data_name + '_m2'
-                data_name_err = data_name + '_err'
-                setattr(self.buffer, data_name_m2,
-                        np.zeros_like(getattr(self.buffer, data_name)))
-                setattr(self.buffer, data_name_err,
-                        _m2_to_err(getattr(self.buffer, data_name_m2),
-                                   self.buffer.numSample))
-
-            init_Err('volume')
-            init_Err('temperature')
-            init_Err('nCorr')
-            init_Err('nDCesaro')
-            init_Err('nDTotalCesaro')
-
-            def init_decErr(buf):
-                num_sample = self.buffer.numSample
+                    i+1, len(samples), sample))
+
+            with CorrFile(sample, lazy=True,
+                          rdcc_nbytes=self.rdcc_nbytes) as f:
+                if cesaro_cache is not None:
+                    cesaro_cache.load(f, t_sels[i])
+                f._shrink_buffer(t_sels[i], dec_sels[i])
+                f._cal_cesaro()
+                if block_average:
+                    self._add_block_data(f.buffer)
+                if self.buffer.numSample == 0:
+                    self.buffer = f.buffer
+                    self.buffer.numSample = 1
+                    self._init_m2()
+                else:
+                    self.buffer.numSample += 1
+                    self._add_corr_data(f.buffer)
+
+        self._finish_corr_data()
+        if block_average:
+            self._finish_block_data(report)
+        self._fit_cesaro(fit)
+
+    def _get_sample_grid(self, samples, max_lag=None, max_bin=None):
+        """
+        Return the selections of the common grid of the buffer, if it holds
+        previous samples, and the samples, reading only their axes
+
+        Return t_sels, dec_sels, where dec_sels[i] is {dectype: sel_dec}
+        """
+        axes = [_read_axes(sample) for sample in samples]
+        if self.buffer.numSample > 0:
+            axes.insert(0, (self.buffer.timeLags,
+                            {dectype: getattr(self.buffer,
+                                              dectype.value).decBins
+                             for dectype in DecType
+                             if getattr(self.buffer, dectype.value)
+                             is not None}))
+        return _get_common_grid(axes, max_lag, max_bin)
+
+    def _add_sample_slabs(self, samples, fit, report, max_memory,
+                          max_lag=None, max_bin=None, cesaro_cache=None):
+        """
+        Same as _add_sample, but decCorr and decDCesaro are accumulated,
+        integrated, fitted, and written to this file slab by slab
+        over the [pairtype, decBins] axes, reading only the hyperslab of
+        each slab from every sample. Roughly max_memory bytes are used
+        for the slab data at a time.
+
+        If the buffer holds previous samples, it should be loaded lazily
+        and its file should stay open until this file is closed.
+        """
+        num_old = int(self.buffer.numSample)
+        corrfiles = [CorrFile(sample, lazy=True, cache=False,
+                              rdcc_nbytes=self.rdcc_nbytes)
+                     for sample in samples]
+        try:
+            bufs = [cf.buffer for cf in corrfiles]
+            if num_old > 0:
+                bufs.insert(0, self.buffer)
+
+            # the common grid of all samples
+            t_sels = _get_common_sels([b.timeLags for b in bufs],
+                                      upper=max_lag)
+            dec_sels = {}
+            paircounts = {}
+            for dectype in DecType:
+                if getattr(bufs[0], dectype.value) is not None:
+                    dec_sels[dectype] = _get_common_sels(
+                            [getattr(b, dectype.value).decBins
+                             for b in bufs],
+                            *_bin_limits(max_bin, dectype))
+                    paircounts[dectype] = [
+                            getattr(b, dectype.value).decPairCount[:, sel]
+                            .copy() for b, sel in zip(bufs, dec_sels[dectype])]
+
+            def shrink_dec(buf, dectype, sel_dec, m2=False):
+                decbuf = getattr(buf, dectype.value)
+                decbuf.decBins = decbuf.decBins[sel_dec]
+                decbuf.decPairCount = decbuf.decPairCount[:, sel_dec]
+                if m2:
+                    decbuf.decPairCount_m2 = decbuf.decPairCount_m2[:,
+                                                                    sel_dec]
+                    decbuf.decPairCount_err = (
+                            decbuf.decPairCount_err[:, sel_dec])
+                    decbuf.decPairCount_sum = (
+                            decbuf.decPairCount_sum[:, sel_dec])
+
+            # data other than decCorr and decDCesaro are small,
+            # and are accumulated in memory as _add_sample does
+            # the sums of decPairCount of the previous samples
+            old_sums = {}
+            if num_old > 0:
+                self._restore_m2(dec=False)
+                self._shrink_corr_buffer(t_sels[0])
+                for dectype, sels in dec_sels.items():
+                    shrink_dec(self.buffer, dectype, sels[0], m2=True)
+                    old_sums[dectype] = getattr(
+                            self.buffer, dectype.value).decPairCount_sum
+
+            for i, cf in enumerate(corrfiles):
+                if (report):
+                    print("Reading {0} of {1} corr files: {2}".format(
+                        i+1, len(samples), samples[i]))
+                idx = i + (num_old > 0)
+                if cesaro_cache is not None:
+                    cesaro_cache.load(cf, t_sels[idx])
+                cf._shrink_corr_buffer(t_sels[idx])
+                for dectype, sels in dec_sels.items():
+                    shrink_dec(cf.buffer, dectype, sels[idx])
+                cf._cal_cesaro(dec=False)
+
+                if i == 0 and num_old == 0:
+                    self.buffer = cf.buffer
+                    self.buffer.numSample = 1
+                    self._init_m2(dec=False)
+                else:
+                    self.buffer.numSample += 1
+                    self._add_corr_data(cf.buffer, dec=False)
+            self._finish_corr_data()
+
+            self._fit_cesaro(fit, dec=False)
+
+            buf = self.buffer
+            num_sample = buf.numSample
+            fit_sel = self.fit_sel
+
+            def cesaro_of(decbuf, corr, sel):
+                if decbuf._has('decDCesaro'):  # from cesaro_cache
+                    return decbuf._read('decDCesaro', sel)
+                return _cesaro_integrate(corr, buf.timeLags)
+
+            def old_m2(b_decbuf, data_name, sel, weight):
+                if b_decbuf._has(data_name + '_m2'):
+                    return b_decbuf._read(data_name + '_m2', sel)
+                return _err_to_m2(b_decbuf._read(data_name + '_err', sel),
+                                  num_old, weight)
+
+            def do_dec(dectype):
+                decbuf = getattr(buf, dectype.value)
+                dec_group = self.require_group(dectype.value)
+                shape = decbuf.decPairCount.shape + buf.timeLags.shape
+                out = {}
+                for name in ('decCorr', 'decCorr_err', 'decCorr_m2',
+                             'decDCesaro', 'decDCesaro_err',
+                             'decDCesaro_m2'):
+                    out[name] = self._create_dataset(
+                            dec_group, name, shape, np.float64)
+                decD = np.empty((len(fit_sel),) + shape[:-1])
+                decD_err = np.empty_like(decD)
+                zeros = {}  # of all slabs, warned once per fit range
+
+                for type_sel, bin_sel in _dec_slabs(
+                        shape[0], shape[1], shape[2], max_memory):
+                    n = 0
+                    for i, b in enumerate(bufs):
+                        b_decbuf = getattr(b, dectype.value)
+                        sel = (type_sel,
+                               _sub_sel(dec_sels[dectype][i], bin_sel),
+                               t_sels[i])
+                        weight = paircounts[dectype][i][type_sel, bin_sel]
+                        corr = b_decbuf._read('decCorr', sel)
+                        if i == 0 and num_old > 0:
+                            n = num_old
+                            sum_weight = old_sums[dectype][type_sel, bin_sel]
+                            corr_acc = WelfordAccumulator(
+                                    corr, old_m2(b_decbuf, 'decCorr', sel,
+                                                 weight), n, sum_weight)
+                            cesaro_acc = WelfordAccumulator(
+                                    b_decbuf._read('decDCesaro', sel),
+                                    old_m2(b_decbuf, 'decDCesaro', sel,
+                                           weight), n, sum_weight)
+                        elif n == 0:
+                            n = 1
+                            corr_acc = WelfordAccumulator(
+                                    corr, np.zeros_like(corr), n, weight)
+                            cesaro = cesaro_of(b_decbuf, corr, sel)
+                            cesaro_acc = WelfordAccumulator(
+                                    cesaro, np.zeros_like(cesaro), n,
+                                    weight)
+                        else:
+                            n += 1
+                            corr_acc.add(corr, weight)
+                            cesaro_acc.add(cesaro_of(b_decbuf, corr, sel),
+                                           weight)
+
+                    cesaro = cesaro_acc.mean
+                    cesaro_err = cesaro_acc.err()
+                    slab = (type_sel, bin_sel)
+                    out['decCorr'][slab] = corr_acc.mean
+                    out['decCorr_err'][slab] = corr_acc.err()
+                    out['decCorr_m2'][slab] = corr_acc.m2
+                    out['decDCesaro'][slab] = cesaro
+                    out['decDCesaro_err'][slab] = cesaro_err
+                    out['decDCesaro_m2'][slab] = cesaro_acc.m2
+                    slab_zeros = {}
+                    slab_fit, slab_fit_err = _fit_cesaro_data(
+                            buf.timeLags, fit_sel, cesaro, cesaro_err,
+                            num_sample, 'decDCesaro_err', zeros=slab_zeros)
+                    decD[(np.s_[:],) + slab] = slab_fit
+                    decD_err[(np.s_[:],) + slab] = slab_fit_err
+                    for i, indexes in slab_zeros.items():
+                        zeros.setdefault(i, []).extend(
+                                (t + type_sel.start, b + bin_sel.start, k)
+                                for t, b, k in indexes)
+
+                for i, indexes in sorted(zeros.items()):
+                    _warn_zero_err('decDCesaro_err', fit_sel[i], 0, indexes)
+
+                for name, dataset in out.items():
+                    setattr(decbuf, name, dataset)
+                decbuf.decD = decD
+                decbuf.decD_err = decD_err
+                decbuf.decD_unit = _fit_unit(decbuf.decCorr_unit)
+
+            for dectype in dec_sels:
+                do_dec(dectype)
+        finally:
+            for cf in corrfiles:
+                cf.close()
+
+    def _add_sample_parallel(self, samples, fit, report, num_proc,
+                             t_sels, dec_sels, cesaro_cache=None):
+        """
+        Same as _add_sample, but the samples are split into num_proc
+        groups, which are accumulated in worker processes and then merged
+        pairwise with the parallel algorithm.
+
+        t_sels, dec_sels: the common grid from _get_sample_grid
+        """
+        partials = []
+        if self.buffer.numSample > 0:
+            self._restore_m2()
+            self._shrink_buffer(t_sels.pop(0), dec_sels.pop(0))
+            partials.append(self.buffer)
+
+        jobs = [list(zip(idx, [samples[i] for i in idx],
+                         [t_sels[i] for i in idx],
+                         [dec_sels[i] for i in idx]))
+                for idx in np.array_split(np.arange(len(samples)),
+                                          min(num_proc, len(samples)))]
+        with ProcessPoolExecutor(num_proc) as executor:
+            partials += executor.map(_accumulate_samples, jobs,
+                                     [len(samples)] * len(jobs),
+                                     [report] * len(jobs),
+                                     [self.rdcc_nbytes] * len(jobs),
+                                     [cesaro_cache] * len(jobs))
+
+        # merge pairwise like a tree
+        while len(partials) > 1:
+            for i in range(0, len(partials) - 1, 2):
+                _merge_buffers(partials[i], partials[i+1])
+            partials = partials[::2]
+
+        self.buffer = partials[0]
+        self._fit_cesaro(fit)
+
+    def _add_decond(self, decnames, fit, report):
+        """
+        Merge the samples of several decond files without their corr files
+        """
+        if not isinstance(decnames, list):
+            decnames = [decnames]
+
+        qnttype_list = [get_qnttype(decname) for decname in decnames]
+        if not all(q == qnttype_list[0] for q in qnttype_list):
+            raise Error("All input decond files should have the same "
+                        "quantity type!")
+
+        for i, decname in enumerate(decnames):
+            if (report):
+                print("Reading {0} of {1} decond files: {2}".format(
+                    i+1, len(decnames), decname))
+            with DecondFile(decname, rdcc_nbytes=self.rdcc_nbytes) as f:
+                f._restore_m2()
+                if i == 0:
+                    self.buffer = f.buffer
+                else:
+                    self._intersect_buffer(f)
+                    _merge_buffers(self.buffer, f.buffer)
+
+        self._fit_cesaro(fit)
+
+    def _init_m2(self, dec=True):
+        """
+        Initialize *_m2 and *_err of a buffer holding one sample
+
+        dec: also initialize decCorr and decDCesaro if True
+        """
+        def init_Err(data_name):
+            data_name_m2 = data_name + '_m2'
+            data_name_err = data_name + '_err'
+            setattr(self.buffer, data_name_m2,
+                    np.zeros_like(getattr(self.buffer, data_name)))
+            setattr(self.buffer, data_name_err,
+                    _m2_to_err(getattr(self.buffer, data_name_m2),
+                               self.buffer.numSample))
+
+        init_Err('volume')
+        init_Err('temperature')
+        init_Err('nCorr')
+        init_Err('nDCesaro')
+        init_Err('nDTotalCesaro')
+
+        def init_decErr(buf):
+            num_sample = self.buffer.numSample
 
+            if dec:
                 buf.decCorr_m2 = np.zeros_like(buf.decCorr)
                 buf.decCorr_err = _m2_to_err(
                         buf.decCorr_m2, num_sample)  # nan
 
-                buf.decPairCount_m2 = np.zeros_like(buf.decPairCount)
-                buf.decPairCount_err = _m2_to_err(
-                        buf.decPairCount_m2, num_sample)  # nan
+            buf.decPairCount_m2 = np.zeros_like(buf.decPairCount)
+            buf.decPairCount_err = _m2_to_err(
+                    buf.decPairCount_m2, num_sample)  # nan
+            buf.decPairCount_sum = np.array(buf.decPairCount,
+                                            dtype=np.float64)
 
+            if dec:
                 buf.decDCesaro_m2 = np.zeros_like(buf.decDCesaro)
-                buf.decDCesaro_err = _m2_to_err(buf.decDCesaro_m2, num_sample)
+                buf.decDCesaro_err = _m2_to_err(buf.decDCesaro_m2,
+                                                num_sample)
 
-            for type_ in DecType:
-                buf = getattr(self.buffer, type_.value)
-                if buf is not None:
-                    init_decErr(buf)
+        for type_ in DecType:
+            buf = getattr(self.buffer, type_.value)
+            if buf is not None:
+                init_decErr(buf)
 
-            begin = 1
-        else:
-            # not new file, buffer should have already been loaded
-            self.buffer.volume_m2 = _err_to_m2(self.buffer.volume_err,
-                                               self.buffer.numSample)
-            self.buffer.temperature_m2 = _err_to_m2(
-                    self.buffer.temperature_err, self.buffer.numSample)
-            self.buffer.nCorr_m2 = _err_to_m2(self.buffer.nCorr_err,
-                                              self.buffer.numSample)
-            self.buffer.nDCesaro_m2 = _err_to_m2(self.buffer.nDCesaro_err,
-                                                 self.buffer.numSample)
-            self.buffer.nDTotalCesaro_m2 = _err_to_m2(
-                    self.buffer.nDTotalCesaro_err, self.buffer.numSample)
-
-            def init_dec_m2(buf):
-                num_sample = self.buffer.numSample
-                buf.decCorr_m2 = _err_to_m2(
-                        buf.decCorr_err, num_sample, buf.decPairCount)
-                buf.decDCesaro_m2 = _err_to_m2(
-                        buf.decDCesaro_err, num_sample, buf.decPairCount)
-                buf.decPairCount_m2 = _err_to_m2(
-                        buf.decPairCount_err, num_sample)
+    def _restore_m2(self, dec=True):
+        """
+        Restore *_m2 and decPairCount_sum of a buffer holding previous
+        samples from *_err, unless they have been read from the file
 
-            for type_ in DecType:
-                buf = getattr(self.buffer, type_.value)
-                if buf is not None:
-                    init_dec_m2(buf)
+        dec: also restore decCorr_m2 and decDCesaro_m2 if True
+        """
+        num_sample = self.buffer.numSample
+
+        def restore(buf, data_name, weight=None):
+            if not buf._has(data_name + '_m2'):
+                setattr(buf, data_name + '_m2', _err_to_m2(
+                    getattr(buf, data_name + '_err'), num_sample, weight))
+
+        restore(self.buffer, 'volume')
+        restore(self.buffer, 'temperature')
+        restore(self.buffer, 'nCorr')
+        restore(self.buffer, 'nDCesaro')
+        restore(self.buffer, 'nDTotalCesaro')
+
+        def init_dec_m2(buf):
+            if dec:
+                restore(buf, 'decCorr', buf.decPairCount)
+                restore(buf, 'decDCesaro', buf.decPairCount)
+            restore(buf, 'decPairCount')
+            if not buf._has('decPairCount_sum'):
+                buf.decPairCount_sum = num_sample * buf.decPairCount
+
+        for type_ in DecType:
+            buf = getattr(self.buffer, type_.value)
+            if buf is not None:
+                init_dec_m2(buf)
+
+    def _add_corr_data(self, new_buf, dec=True):
+        """
+        Add the data of new_buf to the buffer as the numSample-th sample
 
-            begin = 0
+        The means and m2 are updated in place by a WelfordAccumulator of
+        each data, while *_err are updated only by _finish_corr_data.
 
-        # add more samples one by one
+        dec: also add decCorr and decDCesaro if True
+        """
         def add_data(data_name, new_data, dectype=None):
             """
-            Update the number, mean, and m2 of buffer.<data_name>,
-            and add buffer.<data_name>_err
-
-            http://www.wikiwand.com/en/Algorithms_for_calculating_variance#/On-line_algorithm
+            Update the mean and m2 of buffer.<data_name>
             """
-            if dectype is None:
-                buf = self.buffer
-            else:
-                buf = getattr(self.buffer, dectype.value)
-
-            num_sample = self.buffer.numSample
-            mean = getattr(buf, data_name)
-            m2 = getattr(buf, data_name + '_m2')
-
-            delta = new_data - mean
-            mean += delta / num_sample
-            m2 += delta * (new_data - mean)
-
-            setattr(buf, data_name, mean)
-            setattr(buf, data_name + '_m2', m2)
-            setattr(buf, data_name + '_err',
-                    _m2_to_err(m2, num_sample))
+            add_weighted_data(data_name, None, new_data, None, dectype)
 
         def add_weighted_data(data_name, weight_name, new_data, new_weight,
                               dectype=None):
-            """
-            http://www.wikiwand.com/en/Algorithms_for_calculating_variance#/Weighted_incremental_algorithm
-            """
             if dectype is None:
                 buf = self.buffer
             else:
                 buf = getattr(self.buffer, dectype.value)
 
-            old_weight = getattr(buf, weight_name)
-            sum_weight = (self.buffer.numSample - 1) * old_weight
-            mean = getattr(buf, data_name)
-            m2 = getattr(buf, data_name + '_m2')
-
-            temp = new_weight + sum_weight
-            delta = new_data - mean
-            with np.errstate(invalid='ignore'):
-                r = delta * new_weight[..., np.newaxis] / temp[..., np.newaxis]
-            mean += r
-            m2 += sum_weight[..., np.newaxis] * delta * r
-            sum_weight = temp
-
-            if np.isscalar(mean):
-                setattr(buf, data_name, mean)
-                setattr(buf, data_name + '_m2', m2)
-
-            setattr(buf, data_name + '_err', _m2_to_err(
-                m2, self.buffer.numSample,
-                sum_weight / self.buffer.numSample))
+            key = (dectype, data_name)
+            if key not in self._accumulators:
+                num_old = self.buffer.numSample - 1
+                sum_weight = None
+                if weight_name is not None:
+                    sum_weight = getattr(buf, weight_name + '_sum')
+                accum = WelfordAccumulator(
+                        getattr(buf, data_name),
+                        getattr(buf, data_name + '_m2'), num_old, sum_weight)
+                setattr(buf, data_name, accum.mean)
+                setattr(buf, data_name + '_m2', accum.m2)
+                self._accumulators[key] = accum
+            self._accumulators[key].add(new_data, new_weight)
 
         def add_dec_data(dectype, new_buf):
             buf = getattr(new_buf, dectype.value)
-            add_weighted_data('decCorr', 'decPairCount',
-                              buf.decCorr, buf.decPairCount, dectype)
-            add_weighted_data('decDCesaro', 'decPairCount',
-                              buf.decDCesaro, buf.decPairCount, dectype)
+            if dec:
+                add_weighted_data('decCorr', 'decPairCount',
+                                  buf.decCorr, buf.decPairCount, dectype)
+                add_weighted_data('decDCesaro', 'decPairCount',
+                                  buf.decDCesaro, buf.decPairCount, dectype)
 
             # Note that decPairCount must be updated last
             add_data('decPairCount', buf.decPairCount, dectype)
+            decbuf = getattr(self.buffer, dectype.value)
+            decbuf.decPairCount_sum = np.add(decbuf.decPairCount_sum,
+                                             buf.decPairCount)
 
-        for i, sample in enumerate(samples[begin:]):
-            if (report):
-                print("Reading {0} of {1} corr files: {2}".format(
-                    i+begin+1, len(samples), sample))
+        add_data('volume', new_buf.volume)
+        add_data('temperature', new_buf.temperature)
+        add_data('nCorr', new_buf.nCorr)
+        add_data('nDCesaro', new_buf.nDCesaro)
+        add_data('nDTotalCesaro', new_buf.nDTotalCesaro)
 
-            with CorrFile(sample) as f:
-                self.buffer.numSample += 1
-                self._intersect_buffer(f)
-                f._cal_cesaro()
+        for type_ in DecType:
+            if getattr(self.buffer, type_.value) is not None:
+                add_dec_data(type_, new_buf)
+
+    def _finish_corr_data(self):
+        """
+        Update *_err of the data added by _add_corr_data
+        """
+        for (dectype, data_name), accum in self._accumulators.items():
+            if dectype is None:
+                buf = self.buffer
+            else:
+                buf = getattr(self.buffer, dectype.value)
+            setattr(buf, data_name + '_err', accum.err())
+        self._accumulators = {}
 
-                add_data('volume', f.buffer.volume)
-                add_data('temperature', f.buffer.temperature)
-                add_data('nCorr', f.buffer.nCorr)
-                add_data('nDCesaro', f.buffer.nDCesaro)
-                add_data('nDTotalCesaro', f.buffer.nDTotalCesaro)
+    def _add_block_data(self, new_buf):
+        """
+        Add the data of new_buf to the BlockingAccumulator of each data,
+        in the order of the trajectory
+        """
+        def add_data(data_name, new_data, new_weight=None, dectype=None):
+            key = (dectype, data_name)
+            if key not in self._blockers:
+                self._blockers[key] = BlockingAccumulator()
+            self._blockers[key].add(new_data, new_weight)
+
+        add_data('volume', new_buf.volume)
+        add_data('temperature', new_buf.temperature)
+        add_data('nCorr', new_buf.nCorr)
+        add_data('nDCesaro', new_buf.nDCesaro)
+        add_data('nDTotalCesaro', new_buf.nDTotalCesaro)
 
-                for type_ in DecType:
-                    if getattr(self.buffer, type_.value) is not None:
-                        add_dec_data(type_, f.buffer)
+        for dectype in DecType:
+            buf = getattr(new_buf, dectype.value)
+            if buf is not None:
+                add_data('decCorr', buf.decCorr, buf.decPairCount, dectype)
+                add_data('decDCesaro', buf.decDCesaro, buf.decPairCount,
+                         dectype)
+                add_data('decPairCount', buf.decPairCount, None, dectype)
 
-        self._fit_cesaro(fit)
+    def _finish_block_data(self, report):
+        """
+        Replace *_err by the errors of the optimal block sizes of each
+        element, see _optimal_block, such that the fits are weighted by
+        them. The *_m2 are kept as those of independent samples, so
+        samples added later give errors of independent samples again.
+        """
+        num_sample = self.buffer.numSample
+        for (dectype, data_name), blocker in self._blockers.items():
+            if dectype is None:
+                buf = self.buffer
+            else:
+                buf = getattr(self.buffer, dectype.value)
+            err, size = _optimal_block(blocker.err(), num_sample)
+            setattr(buf, data_name + '_err', err)
+            if (report) and data_name == 'nDTotalCesaro':
+                print("Block sizes of {0}: {1} to {2} of {3} samples".format(
+                    data_name + '_err', np.min(size), np.max(size),
+                    num_sample))
+        self._blockers = {}
 
     def _shrink_corr_buffer(self, sel):
         super()._shrink_corr_buffer(sel)
 
-        self.buffer.nCorr_m2 = self.buffer.nCorr_m2[..., sel]
-        self.buffer.nCorr_err = self.buffer.nCorr_err[..., sel]
-        self.buffer.nDCesaro = self.buffer.nDCesaro[..., sel]
-        self.buffer.nDCesaro_m2 = self.buffer.nDCesaro_m2[..., sel]
-        self.buffer.nDCesaro_err = self.buffer.nDCesaro_err[..., sel]
-        self.buffer.nDTotalCesaro = self.buffer.nDTotalCesaro[..., sel]
-        self.buffer.nDTotalCesaro_m2 = self.buffer.nDTotalCesaro_m2[..., sel]
-        self.buffer.nDTotalCesaro_err = self.buffer.nDTotalCesaro_err[...,
-                                                                      sel]
+        buf = self.buffer
+        sel = np.s_[..., sel]
+        buf.nCorr_m2 = buf._read('nCorr_m2', sel)
+        buf.nCorr_err = buf._read('nCorr_err', sel)
+        buf.nDCesaro_m2 = buf._read('nDCesaro_m2', sel)
+        buf.nDCesaro_err = buf._read('nDCesaro_err', sel)
+        buf.nDTotalCesaro = buf._read('nDTotalCesaro', sel)
+        buf.nDTotalCesaro_m2 = buf._read('nDTotalCesaro_m2', sel)
+        buf.nDTotalCesaro_err = buf._read('nDTotalCesaro_err', sel)
 
     def _shrink_dec_buffer(self, dectype, sel, sel_dec):
         super()._shrink_dec_buffer(dectype, sel, sel_dec)
 
         buf = getattr(self.buffer, dectype.value)
-        buf.decCorr_m2 = buf.decCorr_m2[:, sel_dec, sel]
-        buf.decCorr_err = buf.decCorr_err[:, sel_dec, sel]
+        sel = np.s_[:, sel_dec, sel]
+        buf.decCorr_m2 = buf._read('decCorr_m2', sel)
+        buf.decCorr_err = buf._read('decCorr_err', sel)
         buf.decPairCount_m2 = buf.decPairCount_m2[:, sel_dec]
         buf.decPairCount_err = buf.decPairCount_err[:, sel_dec]
-        buf.decDCesaro = buf.decDCesaro[:, sel_dec, sel]
-        buf.decDCesaro_m2 = buf.decDCesaro_m2[:, sel_dec, sel]
-        buf.decDCesaro_err = buf.decDCesaro_err[:, sel_dec, sel]
+        buf.decPairCount_sum = buf.decPairCount_sum[:, sel_dec]
+        buf.decDCesaro_m2 = buf._read('decDCesaro_m2', sel)
+        buf.decDCesaro_err = buf._read('decDCesaro_err', sel)
 
-    def _fit_cesaro(self, fit=None):
+    def _fit_cesaro(self, fit=None, dec=True):
+        """
+        dec: also fit decD if True
+        """
         buf = self.buffer
 
         if fit is None:
@@ -563,173 +1325,345 @@ class DecondFile(CorrFile):
 
         fit_sel = self.fit_sel
 
+        # only the time lags spanned by the fit ranges are read
+        span = np.s_[min(sel.start for sel in fit_sel):
+                     max(sel.stop for sel in fit_sel)]
+        span_fit_sel = [np.s_[sel.start - span.start:sel.stop - span.start]
+                        for sel in fit_sel]
+
         def fit_data(data_name, unit_ref_name, dectype=None):
             if dectype is not None:
                 buf = getattr(self.buffer, dectype.value)
             else:
                 buf = self.buffer
-            num_sample = self.buffer.numSample
-            timeLags = self.buffer.timeLags
-
-            data_cesaro = getattr(buf, data_name + 'Cesaro')
-            data_cesaro_err = getattr(buf, data_name + 'Cesaro_err')
-            data_cesaro_std = _err_to_std(data_cesaro_err, num_sample)
-            data_fit = np.empty((len(fit_sel),) + data_cesaro.shape[:-1])
-            data_std = np.empty((len(fit_sel),) + data_cesaro.shape[:-1])
-
-            if num_sample > 1:
-                for i, sel in enumerate(fit_sel):
-                    try:
-                        _, data_fit[i], _, data_std[i], _, _ = fitlinear(
-                                timeLags[sel], data_cesaro[..., sel],
-                                data_cesaro_std[..., sel])
-                    except ZeroStdError:
-                        errname = data_name + 'Cesaro_err'
-                        print("\nWarning!!")
-                        print(errname +
-                              " contains zero within the fitting range "
-                              "indexes {} to {}".format(sel.start, sel.stop))
-                        print("Below lists the indexs where " + errname +
-                              " is zero: ")
-                        print(list(zip(
-                            *np.where(data_cesaro_err[..., sel] == 0))))
-                        print("Probably you are fitting from the beginning?\n"
-                              "It may be better to avoid doing so.")
-            else:
-                for i, sel in enumerate(fit_sel):
-                    _, data_fit[i], _, data_std[i], _, _ = fitlinear(
-                            timeLags[sel], data_cesaro[..., sel])
 
-            data_err = _std_to_err(data_std, num_sample)
+            data_fit, data_err = _fit_cesaro_data(
+                    self.buffer.timeLags[span], span_fit_sel,
+                    buf._read(data_name + 'Cesaro', np.s_[..., span]),
+                    buf._read(data_name + 'Cesaro_err', np.s_[..., span]),
+                    self.buffer.numSample, data_name + 'Cesaro_err',
+                    span.start)
 
             setattr(buf, data_name, data_fit)
             setattr(buf, data_name + '_err', data_err)
-
-            unit_ref = getattr(buf, unit_ref_name)
-            if unit_ref.decode() == Unit.dimless:
-                unit = Unit.dimless
-            else:
-                unit_list = unit_ref.decode().split()
-                unit_L2 = unit_list[0]
-                unit_T = unit_list[1].split(sep='$')[0]
-                unit_T_1 = "{0}$^{{-1}}$".format(unit_T)
-                unit = unit_L2 + ' ' + unit_T_1
-            setattr(buf, data_name + '_unit', np.string_(unit))
+            setattr(buf, data_name + '_unit',
+                    _fit_unit(getattr(buf, unit_ref_name)))
 
         fit_data('nD', 'nCorr_unit')
         fit_data('nDTotal', 'nCorr_unit')
 
-        for dectype in DecType:
-            if getattr(buf, dectype.value) is not None:
-                fit_data('decD', 'decCorr_unit', dectype)
+        if dec:
+            for dectype in DecType:
+                if getattr(buf, dectype.value) is not None:
+                    fit_data('decD', 'decCorr_unit', dectype)
+
+    def _change_window(self, window, block=None):
+        """
+        Merge the bins of decomposed data by window, see _window_groups
 
-    def _change_window(self, window):
+        The data are averaged with the weights of decPairCount_sum, or
+        decPairCount for files without it, by np.add.reduceat over blocks
+        of time lags. The errors are propagated assuming independent bins,
+        and so is m2 if stored.
+
+        window: {dectype: window}, where window of 1 or None leaves dectype
+        block: number of time lags merged at a time,
+               default to use about 8 MB of scratch
+        """
         buf = self.buffer
 
         def window_data(dectype):
             decbuf = getattr(buf, dectype.value)
-            binw = window[dectype]
-
-            # determine appropriate data range
-            if dectype is DecType.spatial:
-                begin_idx = 0
-            elif dectype is DecType.energy:
-                # window must be an odd number since the bin center is fixed to zero for energy
-                if binw % 2 == 0:
-                    raise Error("window must be an odd number for {}".format(dectype.value))
-                center_idx = np.where(decbuf.decBins==0)[0][0]
-                begin_idx = (center_idx - (binw - 1) / 2) % binw
-            end_idx = (decbuf.decBins.size - 1) - (decbuf.decBins.size - begin_idx) % binw
-
-            # decBins
-            decbuf.decBins = decbuf.decBins[begin_idx:end_idx+1]
-            decbuf.decBins = np.concatenate(np.mean(np.split(
-                decbuf.decBins, decbuf.decBins.size // binw, axis=0), axis=1, keepdims=True), axis=0)
-
-            # decPairCount: [type, bins]
-            decbuf.decPairCount = decbuf.decPairCount[:, begin_idx:end_idx+1]  # [type, decBins*binw]
-
-            # decD: [fit, type, bins]  # L^2 T^-1
-            decbuf.decD = decbuf.decD[:, :, begin_idx:end_idx+1]  # [fit, type, decBins*binw]
-            decbuf.decD *= decbuf.decPairCount[np.newaxis, :, :]  # [fit, type, decBins*binw]
-            decbuf.decD = np.array(np.split(decbuf.decD, decbuf.decBins.size, axis=2))  # [decBins, fit, type, binw]
-            decbuf.decD = np.rollaxis(np.sum(decbuf.decD, axis=3), 0, 3)  # [fit, type, decBins]
-
-            # decCorr: [type, bins, time]
-            decbuf.decCorr = decbuf.decCorr[:, begin_idx:end_idx+1, :]  # [type, decBins*binw, time]
-            decbuf.decCorr *= decbuf.decPairCount[:, :, np.newaxis]  # [type, decBins*binw, time]
-            decbuf.decCorr = np.array(np.split(decbuf.decCorr, decbuf.decBins.size, axis=1))  # [decBins, type, binw, time]
-            decbuf.decCorr = np.rollaxis(np.sum(decbuf.decCorr, axis=2), 0, 2)  # [type, decBins, time]
-
-            # decDCesaro: [type, bins, time]
-            decbuf.decDCesaro = decbuf.decDCesaro[:, begin_idx:end_idx+1, :]  # [type, decBins*binw, time]
-            decbuf.decDCesaro *= decbuf.decPairCount[:, :, np.newaxis]  # [type, decBins*binw, time]
-            decbuf.decDCesaro = np.array(np.split(decbuf.decDCesaro, decbuf.decBins.size, axis=1))  # [decBins, type, binw, time]
-            decbuf.decDCesaro = np.rollaxis(np.sum(decbuf.decDCesaro, axis=2), 0, 2)  # [type, decBins, time]
-
-            # window decPairCount
-            decbuf.decPairCount = np.array(np.split(decbuf.decPairCount, decbuf.decBins.size, axis=1))  # [decBins, type, binw]
-            decbuf.decPairCount = np.sum(decbuf.decPairCount, axis=2).T  # [type, decBins]
-
-            # normalize again
-            decbuf.decD /= decbuf.decPairCount[np.newaxis, :, :]
-            decbuf.decCorr /= decbuf.decPairCount[:, :, np.newaxis]
-            decbuf.decDCesaro /= decbuf.decPairCount[:, :, np.newaxis]
-
-            # TODO: see how to decide error when binw > 1
-            decbuf.decD_err = np.full(decbuf.decD.shape, np.nan)
-            decbuf.decCorr_err = np.full(decbuf.decCorr.shape, np.nan)
-            decbuf.decDCesaro_err = np.full(decbuf.decDCesaro.shape, np.nan)
-            decbuf.decPairCount_err = np.full(decbuf.decPairCount.shape, np.nan)
+            keep, starts = _window_groups(decbuf.decBins,
+                                          decbuf.decPairCount,
+                                          window[dectype], dectype)
+            has_m2 = decbuf._has('decCorr_m2')
+
+            def reduce(data, axis=-1):
+                return np.add.reduceat(data, starts, axis=axis)
+
+            num_in_group = reduce(np.ones(keep.stop - keep.start))
+            decbuf.decBins = reduce(decbuf.decBins[keep]) / num_in_group
+
+            # weights: [type, bins] -> [type, decBins]
+            if decbuf._has('decPairCount_sum'):
+                weight = decbuf.decPairCount_sum[:, keep]
+                decbuf.decPairCount_sum = reduce(weight)
+            else:
+                weight = decbuf.decPairCount[:, keep]
+            sum_weight = reduce(weight)
+            sq_weight = np.square(weight)
+
+            # decPairCount: [type, bins] is summed
+            decbuf.decPairCount_err = np.sqrt(reduce(np.square(
+                decbuf.decPairCount_err[:, keep])))
+            if decbuf._has('decPairCount_m2'):
+                decbuf.decPairCount_m2 = reduce(
+                        decbuf.decPairCount_m2[:, keep])
+            decbuf.decPairCount = reduce(decbuf.decPairCount[:, keep])
+
+            # decD: [fit, type, bins]
+            decbuf.decD = (reduce(decbuf.decD[:, :, keep] * weight) /
+                           sum_weight)
+            decbuf.decD_err = np.sqrt(reduce(
+                np.square(decbuf.decD_err[:, :, keep]) * sq_weight)) / \
+                sum_weight
+
+            # decCorr, decDCesaro: [type, bins, time], block by block
+            num_time = buf.timeLags.size
+            num_row = weight.size
+            time_block = block
+            if time_block is None:
+                time_block = max(1, (1 << 20) // num_row)
+            names = ['decCorr', 'decDCesaro']
+            out = {}
+            for name in names:
+                out[name] = np.empty(sum_weight.shape + (num_time,))
+                out[name + '_err'] = np.empty_like(out[name])
+                if has_m2:
+                    out[name + '_m2'] = np.empty_like(out[name])
+            scratch = np.empty(weight.shape + (min(time_block, num_time),))
+
+            for t in range(0, num_time, time_block):
+                sel = np.s_[:, keep, t:t+time_block]
+                out_sel = np.s_[..., t:t+time_block]
+                s = scratch[..., :min(time_block, num_time - t)]
+                for name in names:
+                    np.multiply(decbuf._read(name, sel),
+                                weight[..., np.newaxis], out=s)
+                    out[name][out_sel] = reduce(s, axis=1)
+                    np.multiply(decbuf._read(name + '_err', sel),
+                                weight[..., np.newaxis], out=s)
+                    np.square(s, out=s)
+                    out[name + '_err'][out_sel] = np.sqrt(reduce(s, axis=1))
+                    if has_m2:
+                        np.multiply(decbuf._read(name + '_m2', sel),
+                                    weight[..., np.newaxis], out=s)
+                        out[name + '_m2'][out_sel] = reduce(s, axis=1)
+
+            for name, data in out.items():
+                data /= sum_weight[..., np.newaxis]
+                setattr(decbuf, name, data)
 
         for dectype in window:
-            if window[dectype] > 1:
-                if getattr(buf, dectype.value) is None:
-                    raise Error("{} does not have {} data".format(
-                        self.filename, dectype.value))
-                else:
-                    window_data(dectype)
+            if window[dectype] is None or (np.ndim(window[dectype]) == 0 and
+                                           window[dectype] == 1):
+                continue
+            if getattr(buf, dectype.value) is None:
+                raise Error("{} does not have {} data".format(
+                    self.filename, dectype.value))
+            else:
+                window_data(dectype)
 
     def _write_buffer(self):
         super()._write_buffer()
-        self['numSample'] = self.buffer.numSample
-        self['volume_err'] = self.buffer.volume_err
-        self['temperature_err'] = self.buffer.temperature_err
-        self['nCorr_err'] = self.buffer.nCorr_err
-        self['nDCesaro'] = self.buffer.nDCesaro
-        self['nDCesaro_err'] = self.buffer.nDCesaro_err
-        self['nDCesaro'].attrs['unit'] = self.buffer.nDCesaro_unit
-        self['nDTotalCesaro'] = self.buffer.nDTotalCesaro
-        self['nDTotalCesaro_err'] = self.buffer.nDTotalCesaro_err
-        self['nDTotalCesaro'].attrs['unit'] = self.buffer.nDTotalCesaro_unit
-        self['fit'] = self.buffer.fit
-        self['fit'].attrs['unit'] = self.buffer.timeLags_unit
-        self['nD'] = self.buffer.nD
-        self['nD_err'] = self.buffer.nD_err
-        self['nD'].attrs['unit'] = self.buffer.nD_unit
-        self['nDTotal'] = self.buffer.nDTotal
-        self['nDTotal_err'] = self.buffer.nDTotal_err
-        self['nDTotal'].attrs['unit'] = self.buffer.nDTotal_unit
+        self._write_data(self, 'numSample', self.buffer.numSample)
+        self._write_data(self, 'volume_err', self.buffer.volume_err)
+        self._write_data(self, 'temperature_err',
+                         self.buffer.temperature_err)
+        self._write_data(self, 'nCorr_err', self.buffer.nCorr_err)
+        self._write_data(self, 'nDCesaro', self.buffer.nDCesaro)
+        self._write_data(self, 'nDCesaro_err', self.buffer.nDCesaro_err)
+        self._write_unit(self, 'nDCesaro', self.buffer.nDCesaro_unit)
+        self._write_data(self, 'nDTotalCesaro', self.buffer.nDTotalCesaro)
+        self._write_data(self, 'nDTotalCesaro_err',
+                         self.buffer.nDTotalCesaro_err)
+        self._write_unit(self, 'nDTotalCesaro',
+                         self.buffer.nDTotalCesaro_unit)
+        self._write_data(self, 'fit', self.buffer.fit)
+        self._write_unit(self, 'fit', self.buffer.timeLags_unit)
+        self._write_data(self, 'nD', self.buffer.nD)
+        self._write_data(self, 'nD_err', self.buffer.nD_err)
+        self._write_unit(self, 'nD', self.buffer.nD_unit)
+        self._write_data(self, 'nDTotal', self.buffer.nDTotal)
+        self._write_data(self, 'nDTotal_err', self.buffer.nDTotal_err)
+        self._write_unit(self, 'nDTotal', self.buffer.nDTotal_unit)
+
+        def write_m2(group, buf, names):
+            """
+            Write the <name>_m2 and <name>_sum that buf has
+            """
+            for name in names:
+                if buf._has(name):
+                    self._write_data(group, name, getattr(buf, name))
+
+        if self.buffer._has('volume_m2'):
+            self.attrs[self._format_revision_key] = self._format_revision
+        write_m2(self, self.buffer, ('volume_m2', 'temperature_m2',
+                                     'nCorr_m2', 'nDCesaro_m2',
+                                     'nDTotalCesaro_m2'))
 
         def do_dec(dectype):
             dec_group = self.require_group(dectype.value)
             buf = getattr(self.buffer, dectype.value)
-            dec_group['decCorr_err'] = buf.decCorr_err
-            dec_group['decPairCount_err'] = buf.decPairCount_err
+            write_m2(dec_group, buf, ('decCorr_m2', 'decDCesaro_m2',
+                                      'decPairCount_m2', 'decPairCount_sum'))
+            self._write_data(dec_group, 'decCorr_err', buf.decCorr_err)
+            self._write_data(dec_group, 'decPairCount_err',
+                             buf.decPairCount_err)
 
-            dec_group['decDCesaro'] = buf.decDCesaro
-            dec_group['decDCesaro_err'] = buf.decDCesaro_err
-            dec_group['decDCesaro'].attrs['unit'] = buf.decDCesaro_unit
+            self._write_data(dec_group, 'decDCesaro', buf.decDCesaro)
+            self._write_data(dec_group, 'decDCesaro_err',
+                             buf.decDCesaro_err)
+            self._write_unit(dec_group, 'decDCesaro', buf.decDCesaro_unit)
 
-            dec_group['decD'] = buf.decD
-            dec_group['decD_err'] = buf.decD_err
-            dec_group['decD'].attrs['unit'] = buf.decD_unit
+            self._write_data(dec_group, 'decD', buf.decD)
+            self._write_data(dec_group, 'decD_err', buf.decD_err)
+            self._write_unit(dec_group, 'decD', buf.decD_unit)
 
         for type_ in DecType:
             if getattr(self.buffer, type_.value) is not None:
                 do_dec(type_)
 
 
+class CesaroCache:
+    """
+    Sidecar cache of the Cesaro data of corr files
+
+    The nDCesaro and decDCesaro over all time lags and bins of a corr file
+    are stored in directory as <content hash>.h5, so that a corr file is
+    integrated only once however it is aggregated. The content hash of a
+    path is kept in <path hash>.key with the size and mtime of the file,
+    and is computed again only when they change. Entries written by
+    another version of this module are integrated again.
+
+    max_size: bytes of entries to keep, removing the least recently used
+    """
+    _chunk_size = 1 << 20
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _replace(self, path, write):
+        """
+        Write path atomically through write(tmp_path)
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _content_hash(self, filename):
+        realpath = os.path.realpath(filename)
+        stat = os.stat(realpath)
+        keyfile = self._path(
+                hashlib.sha1(realpath.encode()).hexdigest() + '.key')
+        try:
+            with open(keyfile) as f:
+                key = json.load(f)
+            if (key['size'] == stat.st_size and
+                    key['mtime'] == stat.st_mtime_ns):
+                return key['hash']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        content = hashlib.sha1()
+        with open(realpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(self._chunk_size), b''):
+                content.update(chunk)
+        key = {'path': realpath, 'size': stat.st_size,
+               'mtime': stat.st_mtime_ns, 'hash': content.hexdigest()}
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(key, f)
+        self._replace(keyfile, write)
+        return key['hash']
+
+    def _store(self, corrfile, entry):
+        """
+        Integrate the Cesaro data of the whole corrfile into entry,
+        one pair type at a time for decDCesaro
+        """
+        timeLags = corrfile['timeLags'][...]
+
+        def write(tmp):
+            with h5py.File(tmp, 'w') as f:
+                f.attrs['version'] = np.string_(__version__)
+                f['nDCesaro'] = _cesaro_integrate(
+                        _read_dataset(corrfile['nCorr']), timeLags)
+                for dectype in DecType:
+                    if dectype.value not in corrfile:
+                        continue
+                    corr = corrfile[dectype.value]['decCorr']
+                    cesaro = f.create_dataset(
+                            dectype.value + '/decDCesaro', corr.shape,
+                            np.float64)
+                    out = np.empty(corr.shape[1:])
+                    for i in range(corr.shape[0]):
+                        cesaro[i] = _cesaro_integrate(
+                                _read_dataset(corr, np.s_[i]), timeLags, out)
+        self._replace(entry, write)
+        self._evict(entry)
+
+    def _evict(self, keep):
+        """
+        Remove the least recently used entries but keep
+        until they fit in max_size
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.h5') and e.path != keep:
+                stat = e.stat()
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+        total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
+
+    def load(self, corrfile, sel=np.s_[:]):
+        """
+        Read or defer nDCesaro and decDCesaro of corrfile from its entry,
+        which is integrated first if missing. It should be called before
+        the buffer of corrfile is shrunk.
+
+        sel: the time lags corrfile will be shrunk to. The Cesaro data
+             starting later than the first time lag are different,
+             so they are not loaded.
+
+        Return True if loaded
+        """
+        if sel.start not in (None, 0):
+            return False
+        entry = self._path(self._content_hash(corrfile.filename) + '.h5')
+        try:
+            os.utime(entry)  # most recently used
+            sidecar = h5py.File(entry, 'r')
+        except OSError:  # missing or broken
+            sidecar = None
+        if (sidecar is not None and
+                sidecar.attrs.get('version') != np.string_(__version__)):
+            sidecar.close()  # integrated by another version
+            sidecar = None
+        if sidecar is None:
+            self._store(corrfile, entry)
+            sidecar = h5py.File(entry, 'r')
+        corrfile._sidecars.append(sidecar)
+
+        corrfile._read_data(corrfile.buffer, 'nDCesaro', sidecar['nDCesaro'])
+        for dectype in DecType:
+            buf = getattr(corrfile.buffer, dectype.value)
+            if buf is not None:
+                corrfile._read_data(buf, 'decDCesaro',
+                                    sidecar[dectype.value]['decDCesaro'])
+        return True
+
+
 class Error(Exception):
     pass
 
@@ -751,72 +1685,424 @@ class NotImplementedError(Error):
     pass
 
 
-def _err_to_m2(err, n, w=None):
-    """
-    err: standard error of the mean
-    n: number of samples
-    w: average weight
+def _read_dataset(dataset, sel=Ellipsis, mode='r'):
     """
-    if n > 1:
-        if w is None:
-            return np.square(err) * n * (n - 1)
-        else:
-            # it is important to explicitly extend the dimension of weight, w,
-            # by [..., np.newaxis], otherwise, numpy will broadcast it
-            # wrongly when the dimension of m2 and w are [N, N, N] and [N, N],
-            # respectivly.
-            return np.square(err) * w[..., np.newaxis] * n * (n - 1)
-    else:
-        return np.zeros_like(err)
+    Return dataset[sel], as a view of a memory map of the file if the
+    dataset is stored contiguously and unfiltered in a file opened
+    read-only, so that only the pages touched are read and they are
+    shared with other processes through the page cache
 
+    mode: 'r' for a read-only map, 'c' for a copy-on-write map
 
-def _m2_to_err(m2, n, w=None):
+    Datasets stored in reduced precision, see CorrFile._precision_options,
+    are read as float64 with their nan restored.
     """
-    m2: sum of squares of differences from the (current) mean
-    n: number of samples
-    w: average weight
+    if dataset.dtype == np.float32:
+        return dataset.astype(np.float64)[sel]
+    if dataset.scaleoffset is not None:
+        data = np.asarray(dataset[sel])
+        data[data == dataset.fillvalue] = np.nan
+        return data
+    f = dataset.file
+    if (f.mode != 'r' or f.driver != 'sec2' or dataset.chunks is not None or
+            dataset.shape == () or dataset.dtype.kind not in 'biufc'):
+        return dataset[sel]
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return dataset[sel]
+    data = np.memmap(f.filename, dtype=dataset.dtype, mode=mode,
+                     offset=offset, shape=dataset.shape)
+    return data[sel]
+
+
+def _is_reduced(dataset):
     """
-    if n > 1:
-        if w is None:
-            return np.sqrt(m2 / ((n - 1) * n))
-        else:
-            # it is important to explicitly extend the dimension of weight, w,
-            # by [..., np.newaxis], otherwise, numpy will broadcast it
-            # wrongly when the dimension of m2 and w are [N, N, N] and [N, N],
-            # respectivly.
-            return np.sqrt(m2 / ((n - 1) * n * w[..., np.newaxis]))
-    else:
-        return np.full(m2.shape, np.nan)
+    Return True if dataset is stored in reduced precision,
+    see CorrFile._precision_options
+    """
+    return dataset.dtype == np.float32 or dataset.scaleoffset is not None
 
 
-def _err_to_var(err, n):
-    """
-    err: standard error of the mean
-    n: number of samples
+def _cesaro_integrate(y, x, out=None, block=None):
     """
-    if n > 1:
-        err = np.square(err) * n
-        err[err == 0] = np.nan
-        return err
-    else:
-        return np.full(err.shape, np.nan)
+    Cesaro sum of y along the last axis, i.e. the double cumulative
+    integration of y over x, the same as two integrate.cumtrapz
 
-
-def _err_to_std(err, n):
+    out: C-contiguous output of y.shape, allocated if None, may be y
+    block: number of rows of the other axes integrated at a time,
+           default to use about 8 MB of scratch
     """
-    err: standard error of the mean
-    n: number of samples
+    if out is None:
+        out = np.empty(y.shape)
+    elif not out.flags.c_contiguous:
+        raise Error("out should be C-contiguous")
+    num_time = y.shape[-1]
+    if num_time < 2:
+        out[...] = 0
+        return out
+
+    rows = np.reshape(y, (-1, num_time))
+    out_rows = out.reshape((-1, num_time))
+    if block is None:
+        block = max(1, (1 << 20) // num_time)
+    half_dx = np.diff(x) / 2
+    scratch = np.empty((min(block, rows.shape[0]), num_time - 1))
+
+    for start in range(0, rows.shape[0], block):
+        y_ = rows[start:start+block]
+        out_ = out_rows[start:start+block]
+        s = scratch[:y_.shape[0]]
+        np.add(y_[:, 1:], y_[:, :-1], out=s)
+        s *= half_dx
+        out_[:, 0] = 0
+        np.cumsum(s, axis=-1, out=out_[:, 1:])
+        np.add(out_[:, 1:], out_[:, :-1], out=s)
+        s *= half_dx
+        np.cumsum(s, axis=-1, out=out_[:, 1:])
+    return out
+
+
+class WelfordAccumulator:
     """
-    if n > 1:
-        return err * np.sqrt(n)
-    else:
-        return np.full(err.shape, np.nan)
+    Running mean and m2 of samples, updated in place by add without
+    allocating any temporary, while the error is computed only by err
 
+    mean, m2: of the samples so far, updated in place if writable
+    num_sample: number of the samples so far
+    sum_weight: sum of the weights so far, which have one dimension less
+                than the data, or None if the samples are not weighted
 
-def _std_to_err(std, n):
-    """
-    std: standard deviation
-    n: number of samples
+    http://www.wikiwand.com/en/Algorithms_for_calculating_variance#/On-line_algorithm
+    http://www.wikiwand.com/en/Algorithms_for_calculating_variance#/Weighted_incremental_algorithm
+    """
+    def __init__(self, mean, m2, num_sample, sum_weight=None):
+        def writable(data):
+            if isinstance(data, np.ndarray) and data.flags.writeable:
+                return data
+            return np.array(data, dtype=np.float64)
+
+        self.mean = writable(mean)
+        self.m2 = writable(m2)
+        self.num_sample = num_sample
+        self._delta = np.empty(self.mean.shape)
+        self._r = np.empty(self.mean.shape)
+        if sum_weight is None:
+            self.sum_weight = None
+        else:
+            self.sum_weight = np.array(sum_weight, dtype=np.float64)
+            self._temp = np.empty(self.sum_weight.shape)
+
+    def add(self, new_data, new_weight=None):
+        """
+        Add new_data, of new_weight if weighted
+        """
+        self.num_sample += 1
+        delta = np.subtract(new_data, self.mean, out=self._delta)
+        r = self._r
+        if self.sum_weight is None:
+            np.divide(delta, self.num_sample, out=r)
+            self.mean += r
+            np.subtract(new_data, self.mean, out=r)
+            np.multiply(delta, r, out=r)
+            self.m2 += r
+        else:
+            temp = np.add(new_weight, self.sum_weight, out=self._temp)
+            np.multiply(delta, new_weight[..., np.newaxis], out=r)
+            with np.errstate(invalid='ignore'):
+                np.divide(r, temp[..., np.newaxis], out=r)
+            self.mean += r
+            np.multiply(self.sum_weight[..., np.newaxis], delta, out=delta)
+            np.multiply(delta, r, out=delta)
+            self.m2 += delta
+            self.sum_weight += new_weight
+
+    def err(self):
+        """
+        Return the standard error of the mean
+        """
+        if self.sum_weight is None:
+            return _m2_to_err(self.m2, self.num_sample)
+        return _m2_to_err(self.m2, self.num_sample,
+                          self.sum_weight / self.num_sample)
+
+
+class BlockingAccumulator:
+    """
+    Standard errors of the mean of consecutive, correlated samples at each
+    level of the blocking transformation, where a block of level l is the
+    mean of 2**l consecutive samples
+
+    Samples are added in order, keeping only the WelfordAccumulator of
+    the blocks and one unpaired block of each level. The samples are
+    weighted if weight is given to add, as in WelfordAccumulator.
+
+    H. Flyvbjerg and H. G. Petersen, J. Chem. Phys. 91, 461 (1989)
+    """
+    def __init__(self):
+        self.num_sample = 0
+        self._accums = []
+        self._unpaired = []  # (mean, weight) or None
+
+    def add(self, new_data, new_weight=None):
+        """
+        Add new_data, of new_weight if weighted
+        """
+        self.num_sample += 1
+        block = (np.array(new_data, dtype=np.float64),
+                 None if new_weight is None else
+                 np.array(new_weight, dtype=np.float64))
+        level = 0
+        while level < len(self._accums):
+            self._accums[level].add(*block)
+            if self._unpaired[level] is None:
+                self._unpaired[level] = block
+                return
+            block = self._pair(self._unpaired[level], block)
+            self._unpaired[level] = None
+            level += 1
+        mean, weight = block
+        self._accums.append(WelfordAccumulator(
+            mean.copy(), np.zeros_like(mean), 1, weight))
+        self._unpaired.append(block)
+
+    @staticmethod
+    def _pair(first, second):
+        """
+        Return the block of two consecutive blocks
+        """
+        (mean, weight), (other_mean, other_weight) = first, second
+        if weight is None:
+            return (mean + other_mean) / 2, None
+        sum_weight = weight + other_weight
+        with np.errstate(invalid='ignore'):
+            mean = ((mean * weight[..., np.newaxis] +
+                     other_mean * other_weight[..., np.newaxis]) /
+                    sum_weight[..., np.newaxis])
+        return mean, sum_weight
+
+    def err(self):
+        """
+        Return the standard errors of the mean by the levels of at least
+        two blocks: [level, ...]
+        """
+        return np.stack([accum.err() for accum in self._accums
+                         if accum.num_sample > 1])
+
+
+def _optimal_block(err, num_sample):
+    """
+    Return the error of the optimal block size of each element, which is
+    the smallest 2**l with (2**l)**3 > 2 * num_sample * (err[l] / err[0])**4,
+    or the largest one if none, and the block sizes
+
+    err: [level, ...] from BlockingAccumulator.err
+
+    M. C. Lee et al., Phys. Rev. E 83, 066706 (2011)
+    """
+    size = 2**np.arange(len(err)).reshape((-1,) + (1,) * (err.ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        optimal = size**3 > 2 * num_sample * (err / err[0])**4
+    level = np.where(np.any(optimal, axis=0), np.argmax(optimal, axis=0),
+                     len(err) - 1)
+    return (np.take_along_axis(err, level[np.newaxis], axis=0)[0],
+            2**level)
+
+
+def _merge_data(mean, m2, num_sample, other_mean, other_m2,
+                other_num_sample):
+    """
+    Combine the mean and m2 of two groups of samples
+
+    http://www.wikiwand.com/en/Algorithms_for_calculating_variance#/Parallel_algorithm
+
+    Return mean, m2
+    """
+    num = num_sample + other_num_sample
+    delta = other_mean - mean
+    mean = mean + delta * (other_num_sample / num)
+    m2 = m2 + other_m2 + np.square(delta) * (num_sample *
+                                             other_num_sample / num)
+    return mean, m2
+
+
+def _merge_weighted_data(mean, m2, sum_weight, other_mean, other_m2,
+                         other_sum_weight):
+    """
+    Combine the weighted mean and m2 of two groups of samples,
+    where sum_weight and other_sum_weight are the sums of weights
+    of each group. The weights have one dimension less than the data.
+
+    Return mean, m2, sum_weight
+    """
+    temp = sum_weight + other_sum_weight
+    delta = other_mean - mean
+    with np.errstate(invalid='ignore'):
+        r = delta * (other_sum_weight / temp)[..., np.newaxis]
+    mean = mean + r
+    m2 = m2 + other_m2 + sum_weight[..., np.newaxis] * delta * r
+    return mean, m2, temp
+
+
+def _merge_buffers(buf, other):
+    """
+    Merge the samples accumulated in the buffer other into buf
+
+    Both buffers should be on the same grid and have their *_m2
+    """
+    num_sample = buf.numSample
+    other_num_sample = other.numSample
+    num = num_sample + other_num_sample
+
+    def merge_data(data_name, dectype=None):
+        if dectype is None:
+            b, o = buf, other
+        else:
+            b, o = getattr(buf, dectype.value), getattr(other, dectype.value)
+        mean, m2 = _merge_data(
+                getattr(b, data_name), getattr(b, data_name + '_m2'),
+                num_sample, getattr(o, data_name),
+                getattr(o, data_name + '_m2'), other_num_sample)
+        setattr(b, data_name, mean)
+        setattr(b, data_name + '_m2', m2)
+        setattr(b, data_name + '_err', _m2_to_err(m2, num))
+
+    def merge_weighted_data(data_name, dectype):
+        b, o = getattr(buf, dectype.value), getattr(other, dectype.value)
+        mean, m2, sum_weight = _merge_weighted_data(
+                getattr(b, data_name), getattr(b, data_name + '_m2'),
+                b.decPairCount_sum, getattr(o, data_name),
+                getattr(o, data_name + '_m2'), o.decPairCount_sum)
+        setattr(b, data_name, mean)
+        setattr(b, data_name + '_m2', m2)
+        setattr(b, data_name + '_err',
+                _m2_to_err(m2, num, sum_weight / num))
+
+    merge_data('volume')
+    merge_data('temperature')
+    merge_data('nCorr')
+    merge_data('nDCesaro')
+    merge_data('nDTotalCesaro')
+
+    for dectype in DecType:
+        if getattr(buf, dectype.value) is not None:
+            merge_weighted_data('decCorr', dectype)
+            merge_weighted_data('decDCesaro', dectype)
+            # Note that decPairCount must be merged last
+            merge_data('decPairCount', dectype)
+            decbuf = getattr(buf, dectype.value)
+            decbuf.decPairCount_sum = (
+                    decbuf.decPairCount_sum +
+                    getattr(other, dectype.value).decPairCount_sum)
+
+    buf.numSample = num
+
+
+def _accumulate_samples(jobs, num_total, report, rdcc_nbytes=None,
+                        cesaro_cache=None):
+    """
+    Accumulate corr samples in a worker process
+
+    jobs: list of (index, filename, sel, {dectype: sel_dec}),
+          where the selections give the common grid of all samples
+    num_total: total number of samples, for reporting
+    rdcc_nbytes: h5py chunk cache size for reading the samples
+
+    Return the buffer of the accumulated samples, including *_m2
+    """
+    # an in-memory file serves as the accumulator, and is discarded
+    # without writing its buffer
+    accum = DecondFile('partial-{}'.format(os.getpid()), 'w-',
+                       driver='core', backing_store=False)
+    try:
+        for idx, sample, sel, dec_sels in jobs:
+            if (report):
+                print("Reading {0} of {1} corr files: {2}".format(
+                    idx+1, num_total, sample))
+            with CorrFile(sample, lazy=True,
+                          rdcc_nbytes=rdcc_nbytes) as cf:
+                if cesaro_cache is not None:
+                    cesaro_cache.load(cf, sel)
+                cf._shrink_buffer(sel, dec_sels)
+                cf._cal_cesaro()
+                if accum.buffer.numSample == 0:
+                    accum.buffer = cf.buffer
+                    accum.buffer.numSample = 1
+                    accum._init_m2()
+                else:
+                    accum.buffer.numSample += 1
+                    accum._add_corr_data(cf.buffer)
+        accum._finish_corr_data()
+        return accum.buffer
+    finally:
+        h5py.File.close(accum)
+
+
+def _err_to_m2(err, n, w=None):
+    """
+    err: standard error of the mean
+    n: number of samples
+    w: average weight
+    """
+    if n > 1:
+        if w is None:
+            return np.square(err) * n * (n - 1)
+        else:
+            # it is important to explicitly extend the dimension of weight, w,
+            # by [..., np.newaxis], otherwise, numpy will broadcast it
+            # wrongly when the dimension of m2 and w are [N, N, N] and [N, N],
+            # respectivly.
+            return np.square(err) * w[..., np.newaxis] * n * (n - 1)
+    else:
+        return np.zeros_like(err)
+
+
+def _m2_to_err(m2, n, w=None):
+    """
+    m2: sum of squares of differences from the (current) mean
+    n: number of samples
+    w: average weight
+    """
+    if n > 1:
+        if w is None:
+            return np.sqrt(m2 / ((n - 1) * n))
+        else:
+            # it is important to explicitly extend the dimension of weight, w,
+            # by [..., np.newaxis], otherwise, numpy will broadcast it
+            # wrongly when the dimension of m2 and w are [N, N, N] and [N, N],
+            # respectivly.
+            return np.sqrt(m2 / ((n - 1) * n * w[..., np.newaxis]))
+    else:
+        return np.full(m2.shape, np.nan)
+
+
+def _err_to_var(err, n):
+    """
+    err: standard error of the mean
+    n: number of samples
+    """
+    if n > 1:
+        err = np.square(err) * n
+        err[err == 0] = np.nan
+        return err
+    else:
+        return np.full(err.shape, np.nan)
+
+
+def _err_to_std(err, n):
+    """
+    err: standard error of the mean
+    n: number of samples
+    """
+    if n > 1:
+        return err * np.sqrt(n)
+    else:
+        return np.full(err.shape, np.nan)
+
+
+def _std_to_err(std, n):
+    """
+    std: standard deviation
+    n: number of samples
     """
     if n > 1:
         return std / np.sqrt(n)
@@ -855,6 +2141,260 @@ def _get_inner_sel(a, b):
     return np.s_[a_begin:a_end+1], np.s_[b_begin:b_end+1]
 
 
+def _get_common_sels(axes, lower=None, upper=None):
+    """
+    Return the intersection of all axes in terms of np.s_ with respect to
+    each of them
+
+    lower, upper: if given, the intersection is further limited to
+                  lower <= axis <= upper
+    """
+    common = axes[0]
+    for axis in axes[1:]:
+        sel, _ = _get_inner_sel(common, axis)
+        common = common[sel]
+
+    if lower is not None or upper is not None:
+        tol = (common[1] - common[0]) * 1e-6
+        keep = np.ones(common.shape, dtype=bool)
+        if lower is not None:
+            keep &= common >= lower - tol
+        if upper is not None:
+            keep &= common <= upper + tol
+        idx = np.nonzero(keep)[0]
+        if idx.size < 2:
+            raise Error("Less than two grid points are within the limits "
+                        "[{0}, {1}]".format(lower, upper))
+        common = common[idx[0]:idx[-1]+1]
+
+    return [_get_inner_sel(common, axis)[1] for axis in axes]
+
+
+def _read_axes(name):
+    """
+    Return timeLags, {dectype: decBins} of a corr or decond file,
+    without reading its data
+    """
+    with h5py.File(name, 'r') as f:
+        return f['timeLags'][...], {dectype: f[dectype.value]['decBins'][...]
+                                    for dectype in DecType
+                                    if dectype.value in f}
+
+
+def _bin_limits(max_bin, dectype):
+    """
+    Return the lower and upper limits of decBins of dectype
+    for |decBins| <= max_bin[dectype]
+    """
+    if max_bin is None or max_bin.get(dectype) is None:
+        return None, None
+    return -max_bin[dectype], max_bin[dectype]
+
+
+def _get_common_grid(axes, max_lag=None, max_bin=None):
+    """
+    Return the selections of the common grid of several files
+
+    axes: list of timeLags, {dectype: decBins} of each file
+    max_lag, max_bin: if given, the common grid is further limited to
+                      timeLags <= max_lag and
+                      |decBins| <= max_bin[dectype]
+
+    Return t_sels, dec_sels, where dec_sels[i] is {dectype: sel_dec}
+    """
+    t_sels = _get_common_sels([timelags for timelags, _ in axes],
+                              upper=max_lag)
+    dec_sels = [{} for _ in axes]
+    for dectype in axes[0][1]:
+        for i, sel in enumerate(_get_common_sels(
+                [decbins[dectype] for _, decbins in axes],
+                *_bin_limits(max_bin, dectype))):
+            dec_sels[i][dectype] = sel
+    return t_sels, dec_sels
+
+
+def _sub_sel(sel, sub):
+    """
+    Return the selection of sub, relative to the selection sel,
+    in terms of the whole axis
+    """
+    return np.s_[sel.start + sub.start:sel.start + sub.stop]
+
+
+def _dec_slabs(num_type, num_bin, num_time, max_memory, num_array=12):
+    """
+    Yield (type_sel, bin_sel) that cover a [type, bin, time] array by slabs,
+    such that num_array float64 arrays of a slab take at most
+    about max_memory bytes, but at least one [time] row
+    """
+    num_row = max(1, int(max_memory // (num_array * num_time *
+                                        np.dtype(np.float64).itemsize)))
+    if num_row >= num_bin:
+        num_slab_type = num_row // num_bin
+        for t in range(0, num_type, num_slab_type):
+            yield (np.s_[t:min(t + num_slab_type, num_type)],
+                   np.s_[0:num_bin])
+    else:
+        for t in range(num_type):
+            for b in range(0, num_bin, num_row):
+                yield np.s_[t:t+1], np.s_[b:min(b + num_row, num_bin)]
+
+
+def _window_groups(decBins, decPairCount, window, dectype):
+    """
+    Return the bins kept and the groups of them merged by window
+
+    window: one of
+            an integer number of bins merged into one, from the first bin
+            for spatial, or about the zero bin for energy, which must be
+            odd then
+            an increasing sequence of bin edges, in the unit of decBins,
+            where each bin goes to the group its center falls in, the last
+            edge inclusive
+            ('log', num) for num groups of logarithmic spaced edges from
+            the first positive bin to the last bin
+            ('equal', num) for num groups of about equal decPairCount
+            summed over pair types
+
+    Return keep, starts, where keep is the slice of decBins kept,
+    and starts are the beginnings of the groups relative to keep
+    as np.add.reduceat takes
+    """
+    num_bin = decBins.size
+    if np.ndim(window) == 0:
+        binw = int(window)
+        if binw < 1:
+            raise Error("window must be positive for {}".format(
+                dectype.value))
+        if dectype is DecType.spatial:
+            begin_idx = 0
+        elif dectype is DecType.energy:
+            # window must be an odd number since the bin center is fixed
+            # to zero for energy
+            if binw % 2 == 0:
+                raise Error("window must be an odd number for {}".format(
+                    dectype.value))
+            center_idx = np.argmin(np.abs(decBins))
+            begin_idx = (center_idx - (binw - 1) // 2) % binw
+        num_group = (num_bin - begin_idx) // binw
+        if num_group == 0:
+            raise Error("window {} is larger than the {} bins of {}".format(
+                binw, num_bin, dectype.value))
+        keep = np.s_[begin_idx:begin_idx + num_group * binw]
+        return keep, np.arange(0, num_group * binw, binw)
+
+    if isinstance(window[0], str):
+        kind, num = window
+        num = int(num)
+        if num < 1:
+            raise Error("number of {} bins must be positive".format(
+                dectype.value))
+        if kind == 'log':
+            positive = decBins[decBins > 0]
+            if positive.size == 0:
+                raise Error("{} has no positive bins for log spaced "
+                            "edges".format(dectype.value))
+            edges = np.geomspace(positive[0], positive[-1], num + 1)
+            edges[[0, -1]] = positive[[0, -1]]
+        elif kind == 'equal':
+            cum_count = np.cumsum(np.sum(decPairCount, axis=0))
+            targets = cum_count[-1] * np.arange(1, num) / num
+            # each group ends at the bin of cum_count closest to its target
+            ends = np.searchsorted(cum_count, targets)
+            lower = np.maximum(ends - 1, 0)
+            ends = np.where(targets - cum_count[lower] <
+                            cum_count[ends] - targets, lower, ends)
+            starts = np.unique(np.concatenate(([0], ends + 1)))
+            return np.s_[0:num_bin], starts[starts < num_bin]
+        else:
+            raise Error("Unknown kind of {} bin edges: {}".format(
+                dectype.value, kind))
+    else:
+        edges = np.asarray(window, dtype=np.float64)
+        if edges.ndim != 1 or edges.size < 2 or np.any(np.diff(edges) <= 0):
+            raise Error("{} bin edges must be at least two increasing "
+                        "values".format(dectype.value))
+
+    group = np.searchsorted(edges, decBins, side='right') - 1
+    group[decBins == edges[-1]] = edges.size - 2
+    inside = np.flatnonzero((group >= 0) & (group < edges.size - 1))
+    if inside.size == 0:
+        raise Error("No {} bins within the edges".format(dectype.value))
+    keep = np.s_[inside[0]:inside[-1] + 1]
+    # empty groups are dropped
+    starts = np.flatnonzero(np.diff(group[keep])) + 1
+    return keep, np.concatenate(([0], starts))
+
+
+class PairTypeIndex:
+    """
+    Mapping between moltypes and the pairtypes of _pairtype_index,
+    precomputed for a number of moltypes, see pair_type_index
+
+    moltype1, moltype2: [pairtype] moltypes of each pairtype,
+                        moltype1 <= moltype2
+    index: [moltype, moltype] pairtype of each two moltypes
+    multiplicity: [pairtype] number of ordered pairs of each pairtype
+    ww: [alltype] weight of each component considering the double cross
+        terms, eg. for NaCl, ww = [1, 1, 1, 2, 1]
+    incidence: [moltype, pairtype] matrix summing the data of pairtypes
+               into each of their moltypes, a pair of the same moltype once
+
+    The arrays are read-only, since they are shared.
+    """
+    def __init__(self, num_moltype):
+        self.num_moltype = num_moltype
+        self.num_pairtype = num_moltype * (num_moltype + 1) // 2
+        self.num_alltype = num_moltype + self.num_pairtype
+        self.moltype1, self.moltype2 = np.triu_indices(num_moltype)
+        pairtypes = np.arange(self.num_pairtype)
+        self.index = np.empty((num_moltype, num_moltype), dtype=int)
+        self.index[self.moltype1, self.moltype2] = pairtypes
+        self.index[self.moltype2, self.moltype1] = pairtypes
+        self.multiplicity = np.where(self.moltype1 == self.moltype2, 1, 2)
+        self.ww = np.concatenate((np.ones(num_moltype, dtype=int),
+                                  self.multiplicity))
+        self.incidence = np.zeros((num_moltype, self.num_pairtype))
+        self.incidence[self.moltype1, pairtypes] = 1
+        self.incidence[self.moltype2, pairtypes] = 1
+        for array in (self.moltype1, self.moltype2, self.index,
+                      self.multiplicity, self.ww, self.incidence):
+            array.setflags(write=False)
+
+    def zz(self, charge):
+        """
+        Return the charge product [alltype] of each component
+        """
+        charge = np.asarray(charge)
+        return np.concatenate((np.square(charge),
+                               charge[self.moltype1] * charge[self.moltype2]))
+
+    def nummolpair(self, nummol):
+        """
+        Return the number of molecule pairs [pairtype] of each pairtype
+        """
+        nummol = np.asarray(nummol)
+        n1 = nummol[self.moltype1]
+        n2 = nummol[self.moltype2]
+        return np.where(self.moltype1 == self.moltype2, n1 * (n2 - 1),
+                        n1 * n2)
+
+    def to_moltype(self, data, axis=-1):
+        """
+        Return data summed from pairtypes into moltypes along axis
+        """
+        return np.moveaxis(np.tensordot(self.incidence, data,
+                                        axes=([1], [axis])), 0, axis)
+
+
+@functools.lru_cache(maxsize=None)
+def pair_type_index(num_moltype):
+    """
+    Return the PairTypeIndex of num_moltype, shared by all its callers
+    """
+    return PairTypeIndex(num_moltype)
+
+
 def _pairtype_index(moltype1, moltype2, num_moltype):
     """
     Return pairtype from two moltypes
@@ -872,8 +2412,8 @@ def _pairtype_index(moltype1, moltype2, num_moltype):
       index(r, c) = r * n + c - r * (r + 1) / 2
       where n = size(c) = size(r), r <= c
     """
-    r = min(moltype1, moltype2)
-    c = max(moltype1, moltype2)
+    r = np.minimum(moltype1, moltype2)
+    c = np.maximum(moltype1, moltype2)
     return r * num_moltype + c - r * (r + 1) // 2
 
 
@@ -901,7 +2441,7 @@ def _fit_to_sel(fit, timelags):
     return sel
 
 
-def fitlinear(x, y, sig=None):
+def fitlinear(x, y, sig=None, ranges=None):
     """
     Given a set of data points x, y with individual standard deviations sig,
     fit them to a straight line y = a + bx by minimizing chi2.
@@ -917,15 +2457,20 @@ def fitlinear(x, y, sig=None):
     x: 1-dimension
     y: 1 or more dimensions, fit only the last axis
     sig (optional): same dimension as y
+    ranges (optional): list of slices of the last axis to be fitted
+                       separately, all at once from prefix sums
 
     Return:
     a, b, siga, sigb, chi2, q
+    of shape [len(ranges), y.shape[:-1]] if ranges are given
     """
     if x.ndim != 1:
         raise Error("x must be one dimensional. x.ndim={0}".format(x.ndim))
     if x.size != y.shape[-1]:
         raise Error("lengths of the last dimension of x and y do not match\n"
                     "x.size={0}, y.shape[-1]={1}".format(x.size, y.shape[-1]))
+    if ranges is not None:
+        return _fitlinear_ranges(x, y, sig, ranges)
     if sig is not None:
         if np.any(sig == 0):
             raise ZeroStdError(list(zip(*np.where(sig == 0))))
@@ -969,10 +2514,195 @@ def fitlinear(x, y, sig=None):
     return a, b, siga, sigb, chi2, q
 
 
+def _fitlinear_ranges(x, y, sig, ranges):
+    """
+    fitlinear over each of ranges, computed from the cumulative sums of
+    w, wx, wx^2, wy, wxy and wy^2 along the last axis, so that each range
+    costs O(1) instead of O(range length)
+    """
+    begin = np.array([r.start for r in ranges])
+    end = np.array([r.stop for r in ranges])
+    n = (end - begin).reshape((-1,) + (1,) * (y.ndim - 1))
+
+    def cum_sums(v):
+        """
+        Return the sums of v before and after each index: [..., v.size + 1]
+        """
+        before = np.zeros(v.shape[:-1] + (v.shape[-1] + 1,))
+        after = np.zeros(before.shape)
+        np.cumsum(v, axis=-1, out=before[..., 1:])
+        np.cumsum(v[..., ::-1], axis=-1, out=after[..., -2::-1])
+        return before, after
+
+    def range_sum(v):
+        """
+        Return the sums of v over the ranges: [ranges, v.shape[:-1]]
+        """
+        before, after = cum_sums(v)
+        return np.where(forward,
+                        np.moveaxis(before[..., end] - before[..., begin],
+                                    -1, 0),
+                        np.moveaxis(after[..., begin] - after[..., end],
+                                    -1, 0))
+
+    # subtract the line through the end points, which leaves only small
+    # residuals to the cumulative sums and thus reduces their cancellation
+    x0 = x[0]
+    x = x - x0
+    y0 = np.nan_to_num(y[..., 0])
+    slope0 = np.nan_to_num((y[..., -1] - y[..., 0]) / x[-1])
+    y = y - y0[..., np.newaxis] - slope0[..., np.newaxis] * x
+
+    # take each range from the side carrying less weight to limit the
+    # cancellation, e.g. the Cesaro errors grow with time
+    if sig is None:
+        forward = (begin < x.size - end).reshape(n.shape)
+    else:
+        is_zero = sig == 0
+        sig_nan = np.isnan(sig)
+        wt = 1 / np.where(is_zero | sig_nan, 1, sig)**2
+        wt[is_zero | sig_nan] = 0
+        before, after = cum_sums(wt)
+        forward = np.moveaxis(before[..., begin] < after[..., end], -1, 0)
+        if np.any(range_sum(is_zero)):
+            raise ZeroStdError(list(zip(*np.where(is_zero))))
+
+    # ranges with nan are nan as in fitlinear, without spoiling the others
+    y_nan = range_sum(np.isnan(y)) > 0
+    y = np.nan_to_num(y)
+
+    if sig is not None:
+        ss = range_sum(wt)
+        sx = range_sum(wt * x)
+        sxx = range_sum(wt * x * x)
+        wy = wt * y
+    else:
+        ss = n
+        x_nd = x.reshape((1,) * (y.ndim - 1) + x.shape)
+        sx = range_sum(x_nd)
+        sxx = range_sum(x_nd * x_nd)
+        wy = y
+    sy = range_sum(wy)
+    sxy = range_sum(wy * x)
+    syy = range_sum(wy * y)
+
+    st2 = sxx - sx * sx / ss
+    b = (sxy - sx * sy / ss) / st2
+    a = (sy - sx * b) / ss
+    chi2 = (syy - 2 * a * sy - 2 * b * sxy + a * a * ss + 2 * a * b * sx +
+            b * b * sxx)
+    chi2 = np.maximum(chi2, 0)
+    sx0 = sx + x0 * ss  # sum of the original x
+    siga = np.sqrt((1. + sx0 * sx0 / (ss * st2)) / ss)
+    sigb = np.sqrt(1. / st2)
+    q = np.ones(chi2.shape)
+    if sig is None:
+        sigdat = np.sqrt(chi2 / (n - 2))
+        siga = siga * sigdat
+        sigb = sigb * sigdat
+    else:
+        q = np.where(n > 2, gammainc(0.5 * np.maximum(n - 2, 1), 0.5 * chi2),
+                     q)
+
+    # back to the original line
+    b = b + slope0
+    a = a + y0 - b * x0
+
+    results = [np.broadcast_to(v, chi2.shape).copy()
+               for v in (a, b, siga, sigb, chi2, q)]
+    if sig is None:
+        nan_masks = [y_nan] * 5 + [False]
+    else:
+        sig_nan = range_sum(sig_nan) > 0
+        any_nan = y_nan | sig_nan
+        nan_masks = [any_nan] * 2 + [sig_nan] * 2 + [any_nan] * 2
+    for v, mask in zip(results, nan_masks):
+        v[np.broadcast_to(mask, v.shape)] = np.nan
+    return tuple(results)
+
+
+def _fit_cesaro_data(timeLags, fit_sel, data_cesaro, data_cesaro_err,
+                     num_sample, errname, offset=0, zeros=None):
+    """
+    Fit the slopes of data_cesaro over each range of fit_sel
+
+    offset: index of timeLags[0] in the whole time axis, for reporting
+    zeros: if given, a dict where the indexes at which data_cesaro_err is
+           zero are collected by the index of the fit range, to be
+           reported by _warn_zero_err later instead of here
+
+    Return data_fit, data_err: [fit, data_cesaro.shape[:-1]]
+    """
+    data_cesaro_std = _err_to_std(data_cesaro_err, num_sample)
+
+    if len(fit_sel) > 1:
+        # all ranges at once
+        try:
+            _, data_fit, _, data_std, _, _ = fitlinear(
+                    timeLags, data_cesaro,
+                    data_cesaro_std if num_sample > 1 else None,
+                    ranges=fit_sel)
+            return data_fit, _std_to_err(data_std, num_sample)
+        except ZeroStdError:
+            pass  # fit range by range to report where the zeros are
+
+    # ranges that cannot be fitted are left as nan
+    data_fit = np.full((len(fit_sel),) + data_cesaro.shape[:-1], np.nan)
+    data_std = np.full((len(fit_sel),) + data_cesaro.shape[:-1], np.nan)
+
+    if num_sample > 1:
+        for i, sel in enumerate(fit_sel):
+            try:
+                _, data_fit[i], _, data_std[i], _, _ = fitlinear(
+                        timeLags[sel], data_cesaro[..., sel],
+                        data_cesaro_std[..., sel])
+            except ZeroStdError:
+                indexes = list(zip(
+                    *np.where(data_cesaro_err[..., sel] == 0)))
+                if zeros is None:
+                    _warn_zero_err(errname, sel, offset, indexes)
+                else:
+                    zeros.setdefault(i, []).extend(indexes)
+    else:
+        for i, sel in enumerate(fit_sel):
+            _, data_fit[i], _, data_std[i], _, _ = fitlinear(
+                    timeLags[sel], data_cesaro[..., sel])
+
+    data_err = _std_to_err(data_std, num_sample)
+    return data_fit, data_err
+
+
+def _warn_zero_err(errname, sel, offset, indexes):
+    """
+    Warn that errname is zero at indexes within the fitting range sel
+    """
+    print("\nWarning!!")
+    print(errname +
+          " contains zero within the fitting range "
+          "indexes {} to {}".format(sel.start + offset, sel.stop + offset))
+    print("Below lists the indexs where " + errname + " is zero: ")
+    print(indexes)
+    print("Probably you are fitting from the beginning?\n"
+          "It may be better to avoid doing so.")
+
+
+def _fit_unit(unit_ref):
+    """
+    Return the unit of the fitted slope, given the unit of the correlation
+    """
+    if unit_ref.decode() == Unit.dimless:
+        unit = Unit.dimless
+    else:
+        unit_list = unit_ref.decode().split()
+        unit_L2 = unit_list[0]
+        unit_T = unit_list[1].split(sep='$')[0]
+        unit_T_1 = "{0}$^{{-1}}$".format(unit_T)
+        unit = unit_L2 + ' ' + unit_T_1
+    return np.string_(unit)
+
+
 def _nummolpair(nummol):
-    return np.array([n1 * (n2-1) if e1 == e2 else n1*n2
-                     for (e1, n1) in enumerate(nummol)
-                     for (e2, n2) in enumerate(nummol) if e2 >= e1])
+    return pair_type_index(np.size(nummol)).nummolpair(nummol)
 
 
 def _paircount_to_rdf(paircount, rbins, nummol, volume, solid_angle):
@@ -1024,256 +2754,985 @@ def _numtype(nummol):
 
 
 def _zz(charge, nummol):
-    num_moltype, _, num_alltype = _numtype(nummol)
-    zz = np.empty(num_alltype, dtype=np.int)
-    for i in range(num_moltype):
-        zz[i] = charge[i]**2
-        for j in range(i, num_moltype):
-            zz[num_moltype + _pairtype_index(i, j, num_moltype)] = (
-                    charge[i] * charge[j])
-    return zz
+    return pair_type_index(np.size(nummol)).zz(charge)
 
 
-def _nD_to_qnt_const(decname):
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        vol = f['volume'][...]
-        vol_unit = f['volume'].attrs['unit'].decode()
-        temp = f['temperature'][...]
-        temp_unit = f['temperature'].attrs['unit'].decode()
-        nD_unit = f['nD'].attrs['unit'].decode()
-        charge_unit = f['charge'].attrs['unit'].decode()
-
-    if temp_unit == Unit.dimless:
-        kB = 1
-    elif temp_unit == Unit.si_temperature:
-        kB = const.k
-    else:
-        raise UnknownUnitError('temperature unit "{}" cannot be '
-                               'recognized'.format(temp_unit))
-    if vol_unit == Unit.dimless:
-        pass
-    elif vol_unit == "nm$^3$":
-        vol *= const.nano**3
-    else:
-        raise UnknownUnitError('volume unit "{}" cannot be '
-                               'recognized'.format(vol_unit))
+def _copy_arrays(values):
+    """
+    Return the tuple values with its arrays copied
+    """
+    return tuple(np.copy(v) if isinstance(v, np.ndarray) else v
+                 for v in values)
 
-    if charge_unit == Unit.dimless:
-        e = 1
-    elif charge_unit == Unit.electric_charge:
-        e = const.e
-    else:
-        raise UnknownUnitError('charge unit "{}" cannot be '
-                               'recognized'.format(charge_unit))
 
-    if nD_unit == Unit.dimless:
-        fac = 1
-    elif nD_unit in Unit.gmx_ec_nD_list:
-        fac = (const.nano**2 / const.pico)
-    else:
-        raise UnknownUnitError('nD_unit "{}" cannot be '
-                               'recognized'.format(nD_unit))
+def _threshold_index(weight, threshold):
+    """
+    Return the index of the first bin of each row of weight [..., bins]
+    where weight >= threshold, nan weights never passing,
+    or the number of bins if none
+    """
+    passed = np.greater_equal(np.where(np.isnan(weight), -np.inf, weight),
+                              threshold)
+    idx = np.argmax(passed, axis=-1)
+    idx[~np.any(passed, axis=-1)] = passed.shape[-1]
+    return idx
 
-    if qnttype == Quantity.ec:
-        fac *= e**2
 
-    nD_to_qnt = fac / (kB * temp * vol)
-    return nD_to_qnt
+def _smooth_curves(x, y, valid, kind, num_point):
+    """
+    Interpolate each curve y[..., bins] over x[bins] at its valid points,
+    to num_point points evenly spaced between its first and last valid x
 
+    Curves of the same valid points are interpolated together
+    by one interp1d of them stacked. Curves of less than two valid points,
+    such as those of a failed fit, are nan.
 
-def get_qnttype(decname):
+    Return x_smooth, y_smooth, both of shape y.shape[:-1] + (num_point,)
     """
-    Return quantity string
+    rows = y.reshape((-1, y.shape[-1]))
+    patterns, inverse = np.unique(valid.reshape(rows.shape), axis=0,
+                                  return_inverse=True)
+    x_smooth = np.empty((rows.shape[0], num_point))
+    y_smooth = np.empty_like(x_smooth)
+    for i, pattern in enumerate(patterns):
+        same = np.ravel(inverse) == i
+        if np.count_nonzero(pattern) < 2:
+            x_smooth[same] = np.nan
+            y_smooth[same] = np.nan
+            continue
+        x_valid = x[pattern]
+        interp = interpolate.interp1d(x_valid, rows[same][:, pattern],
+                                      kind=kind, axis=-1)
+        x_smooth[same] = np.linspace(x_valid[0], x_valid[-1], num_point)
+        y_smooth[same] = interp(x_smooth[same][0])
+    shape = y.shape[:-1] + (num_point,)
+    return x_smooth.reshape(shape), y_smooth.reshape(shape)
+
+
+class DecondReader:
     """
-    with h5py.File(decname, 'r') as f:
-        if Quantity.key in f.attrs:
-            qnttype = f.attrs[Quantity.key].decode()
-        else:
-            qnttype = Quantity.ec
-
-    return qnttype
+    Read-only session on a decond file for the analysis getters
 
+    The file is opened once, and the metadata and unit-converted arrays
+    are cached, keyed by dataset and conversion, so that a series of
+    getters neither reopens the file nor redoes the conversions.
+    Getters return copies of the cached arrays.
 
-def get_temperature(decname):
-    """
-    Return temperature, temperature unit
+    with DecondReader('decond.d5') as reader:
+        D = reader.get_D()[0]
+        decD = reader.get_decD(DecType.spatial)[0]
     """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        temperature = f['temperature'][...]
-        temperature_unit = f['temperature'].attrs['unit'].decode()
-
-    if temperature_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if temperature_unit == Unit.gmx_temperature:
-                pass
-            else:
-                raise UnknownUnitError('temperature_unit "{}" cannot be '
-                                       'recognized for ec'.format(
-                                           temperature_unit))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('temperature_unit "{}" cannot be '
-                                   'recognized for {}'.format(
-                                       temperature_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
 
-    return temperature, temperature_unit
+    def __init__(self, decname):
+        self.decname = decname
+        self.file = h5py.File(decname, 'r')
+        self._cache = {}
 
+    def __enter__(self):
+        return self
 
-def get_volume(decname):
-    """
-    Return volume, volume unit
-    """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        vol = f['volume'][...]
-        vol_unit = f['volume'].attrs['unit'].decode()
+    def __exit__(self, *args):
+        self.close()
 
-    if vol_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if vol_unit == Unit.gmx_volume:
-                vol *= const.nano ** 3
-                vol_unit = "{volume}".format(**Unit.default_unit)
-            else:
-                raise UnknownUnitError('vol_unit "{}" cannot be '
-                                       'recognized for ec'.format(
-                                           vol_unit))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('vol_unit "{}" cannot be '
-                                   'recognized for {}'.format(
-                                       vol_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
+    def close(self):
+        self.file.close()
+        self._cache.clear()
 
-    return vol, vol_unit
+    def _cached(self, key, func):
+        """
+        Return func(), which is computed only once for key
+        """
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
 
+    def _read(self, name):
+        """
+        Return dataset name as a read-only array
+        """
+        def read():
+            data = _read_dataset(self.file[name])
+            data.setflags(write=False)
+            return data
 
-def _check_qnttype(decname, required_qnt):
-    quantity = get_qnttype(decname)
-    if quantity != required_qnt:
-        raise Error('The file {} is of quantity "{}", but "{}" '
-                    'is required.'.format(decname, quantity,
-                                          required_qnt))
+        return self._cached(('data', name), read)
 
+    def _unit(self, name):
+        return self._cached(('unit', name),
+                            lambda: self.file[name].attrs['unit'].decode())
 
-def get_fit(decname):
-    """
-    Return fit, fit_unit
-    """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        fit = f['fit'][...]
-        fit_unit = f['fit'].attrs['unit'].decode()
+    def _converted(self, name, gmx_units, cc, default_unit):
+        """
+        Return data, data_err, data_unit of dataset name,
+        converted by the factor cc from gmx_units to default_unit
+        """
+        def convert():
+            qnttype = self.get_qnttype()
+            data = self._read(name)
+            data_err = self._read(name + '_err')
+            data_unit = self._unit(name)
+            unit_name = name.split('/')[-1] + '_unit'
+            if data_unit != Unit.dimless:
+                if qnttype == Quantity.ec:
+                    if data_unit in gmx_units:
+                        data = data * cc
+                        data_err = data_err * cc
+                        data_unit = default_unit.format(**Unit.default_unit)
+                    else:
+                        raise UnknownUnitError('{} "{}" cannot be recognized'
+                                               ' for {}'.format(
+                                                   unit_name, data_unit,
+                                                   qnttype))
+                elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+                    raise UnknownUnitError('{} "{}" cannot be recognized '
+                                           'for {}'.format(
+                                               unit_name, data_unit, qnttype))
+                else:
+                    raise Error("Unknown qnttype: {}".format(qnttype))
+            return data, data_err, data_unit
+
+        return self._cached(('converted', name), convert)
+
+    def _nD_to_qnt_const(self):
+        def compute():
+            qnttype = self.get_qnttype()
+            vol = self._read('volume')
+            vol_unit = self._unit('volume')
+            temp = self._read('temperature')
+            temp_unit = self._unit('temperature')
+            nD_unit = self._unit('nD')
+            charge_unit = self._unit('charge')
+
+            if temp_unit == Unit.dimless:
+                kB = 1
+            elif temp_unit == Unit.si_temperature:
+                kB = const.k
+            else:
+                raise UnknownUnitError('temperature unit "{}" cannot be '
+                                       'recognized'.format(temp_unit))
+            if vol_unit == Unit.dimless:
+                pass
+            elif vol_unit == "nm$^3$":
+                vol = vol * const.nano**3
+            else:
+                raise UnknownUnitError('volume unit "{}" cannot be '
+                                       'recognized'.format(vol_unit))
 
-    if fit_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if fit_unit == Unit.gmx_time:
-                fit *= const.pico
-                fit_unit = Unit.si_time
+            if charge_unit == Unit.dimless:
+                e = 1
+            elif charge_unit == Unit.electric_charge:
+                e = const.e
+            else:
+                raise UnknownUnitError('charge unit "{}" cannot be '
+                                       'recognized'.format(charge_unit))
+
+            if nD_unit == Unit.dimless:
+                fac = 1
+            elif nD_unit in Unit.gmx_ec_nD_list:
+                fac = (const.nano**2 / const.pico)
+            else:
+                raise UnknownUnitError('nD_unit "{}" cannot be '
+                                       'recognized'.format(nD_unit))
+
+            if qnttype == Quantity.ec:
+                fac *= e**2
+
+            return fac / (kB * temp * vol)
+
+        return self._cached('nD_to_qnt', compute)
+
+    def get_qnttype(self):
+        """
+        Return quantity string
+        """
+        def read():
+            if Quantity.key in self.file.attrs:
+                return self.file.attrs[Quantity.key].decode()
             else:
-                raise UnknownUnitError('fit_unit "{}" cannot be recognized'
-                                       ' for {}'.format(fit_unit, qnttype))
+                return Quantity.ec
+
+        return self._cached('qnttype', read)
+
+    def _check_qnttype(self, required_qnt):
+        quantity = self.get_qnttype()
+        if quantity != required_qnt:
+            raise Error('The file {} is of quantity "{}", but "{}" '
+                        'is required.'.format(self.decname, quantity,
+                                              required_qnt))
+
+    def get_temperature(self):
+        """
+        Return temperature, temperature unit
+        """
+        def convert():
+            qnttype = self.get_qnttype()
+            temperature = self._read('temperature')
+            temperature_unit = self._unit('temperature')
+            if temperature_unit != Unit.dimless:
+                if qnttype == Quantity.ec:
+                    if temperature_unit == Unit.gmx_temperature:
+                        pass
+                    else:
+                        raise UnknownUnitError('temperature_unit "{}" cannot '
+                                               'be recognized for ec'.format(
+                                                   temperature_unit))
+                elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+                    raise UnknownUnitError('temperature_unit "{}" cannot be '
+                                           'recognized for {}'.format(
+                                               temperature_unit, qnttype))
+                else:
+                    raise Error("Unknown qnttype: {}".format(qnttype))
+            return temperature, temperature_unit
+
+        return _copy_arrays(self._cached(('converted', 'temperature'),
+                                         convert))
+
+    def get_volume(self):
+        """
+        Return volume, volume unit
+        """
+        def convert():
+            qnttype = self.get_qnttype()
+            vol = self._read('volume')
+            vol_unit = self._unit('volume')
+            if vol_unit != Unit.dimless:
+                if qnttype == Quantity.ec:
+                    if vol_unit == Unit.gmx_volume:
+                        vol = vol * const.nano ** 3
+                        vol_unit = "{volume}".format(**Unit.default_unit)
+                    else:
+                        raise UnknownUnitError('vol_unit "{}" cannot be '
+                                               'recognized for ec'.format(
+                                                   vol_unit))
+                elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+                    raise UnknownUnitError('vol_unit "{}" cannot be '
+                                           'recognized for {}'.format(
+                                               vol_unit, qnttype))
+                else:
+                    raise Error("Unknown qnttype: {}".format(qnttype))
+            return vol, vol_unit
+
+        return _copy_arrays(self._cached(('converted', 'volume'), convert))
+
+    def _get_time(self, name):
+        """
+        Return time data name, name_unit
+        """
+        def convert():
+            qnttype = self.get_qnttype()
+            time = self._read(name)
+            time_unit = self._unit(name)
+            if time_unit != Unit.dimless:
+                if qnttype == Quantity.ec:
+                    if time_unit == Unit.gmx_time:
+                        time = time * const.pico
+                        time_unit = Unit.si_time
+                    else:
+                        raise UnknownUnitError('{}_unit "{}" cannot be '
+                                               'recognized for {}'.format(
+                                                   name, time_unit, qnttype))
+                elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+                    raise UnknownUnitError('{}_unit "{}" cannot be recognized '
+                                           'for {}'.format(
+                                               name, time_unit, qnttype))
+                else:
+                    raise Error("Unknown qnttype: {}".format(qnttype))
+            return time, time_unit
+
+        return _copy_arrays(self._cached(('converted', name), convert))
+
+    def get_fit(self):
+        """
+        Return fit, fit_unit
+        """
+        return self._get_time('fit')
+
+    def get_timelags(self):
+        """
+        Return timelags, timelags_unit
+        """
+        return self._get_time('timeLags')
+
+    def get_decbins(self, dectype):
+        """
+        Return decBins, decBins_unit
+        """
+        def convert():
+            qnttype = self.get_qnttype()
+            name = dectype.value + '/decBins'
+            decBins = self._read(name)
+            decBins_unit = self._unit(name)
+            if decBins_unit != Unit.dimless:
+                if qnttype == Quantity.ec:
+                    if dectype is DecType.spatial:
+                        if decBins_unit == Unit.gmx_length:
+                            decBins = decBins * const.nano
+                            decBins_unit = "{length}".format(
+                                    **Unit.default_unit)
+                        else:
+                            raise UnknownUnitError(
+                                    'decBins_unit "{}" cannot be '
+                                    'recognized for ec'.format(decBins_unit))
+                    elif dectype is DecType.energy:
+                        if decBins_unit == Unit.er_energy:
+                            decBins = decBins * const.calorie
+                            decBins_unit = "{energy}".format(
+                                    **Unit.default_unit)
+                        else:
+                            raise UnknownUnitError(
+                                    'decBins_unit "{}" cannot be '
+                                    'recognized for ec'.format(decBins_unit))
+                elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+                    raise UnknownUnitError('decBins_unit "{}" cannot be '
+                                           'recognized for {}'.format(
+                                               decBins_unit, qnttype))
+                else:
+                    raise Error("Unknown qnttype: {}".format(qnttype))
+            return decBins, decBins_unit
+
+        return _copy_arrays(self._cached(('converted', dectype.value +
+                                          '/decBins'), convert))
+
+    def get_ncorr(self):
+        """
+        Return ncorr, ncorr_err, ncorr_unit, timelags, timelags_unit
+        """
+        return (_copy_arrays(self._converted(
+                    'nCorr', (Unit.gmx_ec_corr,),
+                    const.nano**2 / const.pico**2,
+                    "{length}$^2$ {time}$^{{-2}}$")) +
+                self.get_timelags())
+
+    def get_ndtotal_cesaro(self):
+        """
+        Return ndtotal_cesaro, ndtotal_cesaro_err, ndtotal_cesaro_unit,
+               timelags, timelags_unit
+        """
+        return (_copy_arrays(self._converted(
+                    'nDTotalCesaro', (Unit.gmx_ec_dcesaro,), const.nano**2,
+                    "{length}$^2$")) +
+                self.get_timelags())
+
+    def get_dec_dcesaro(self, dectype):
+        """
+        Return dec_dcesaro, dec_dcesaro_err, dec_dcesaro_unit,
+               decbins, decbins_unit, timelags, timelags_unit
+        """
+        return (_copy_arrays(self._converted(
+                    dectype.value + '/decDCesaro', (Unit.gmx_ec_dcesaro,),
+                    const.nano**2, "{length}$^2$")) +
+                self.get_decbins(dectype) + self.get_timelags())
+
+    def get_deccorr(self, dectype, weight=None, threshold=0.0,
+                    padded=False):
+        """
+        Return deccorr, deccorr_err, deccorr_unit,
+               decbins, decbins_unit, timelags, timelags_unit
+
+        weight: [type, bins], whose bins before the first one of
+                weight >= threshold are cut from deccorr of each type
+        padded: if False, the cut deccorr and decbins are lists of type,
+                otherwise deccorr and deccorr_err are masked arrays of
+                the cut bins, and idx_threshold [type] of the first bins
+                kept is also returned
+        """
+        deccorr, deccorr_err, deccorr_unit = _copy_arrays(self._converted(
+                dectype.value + '/decCorr', (Unit.gmx_ec_corr,),
+                const.nano**2 / const.pico**2,
+                "{length}$^2$ {time}$^{{-2}}$"))
+        decbins, decbins_unit = self.get_decbins(dectype)
+
+        if weight is not None:
+            idx_threshold = _threshold_index(weight, threshold)
+            if padded:
+                cut = (np.arange(decbins.size) <
+                       idx_threshold[:, np.newaxis])[..., np.newaxis]
+                cut = np.broadcast_to(cut, deccorr.shape)
+                deccorr = np.ma.masked_array(deccorr, cut)
+                deccorr_err = np.ma.masked_array(deccorr_err, cut)
+                return ((deccorr, deccorr_err, deccorr_unit,
+                         decbins, decbins_unit) + self.get_timelags() +
+                        (idx_threshold,))
+            deccorr = [decc[idx:] for decc, idx in
+                       zip(deccorr, idx_threshold)]
+            decbins = [decbins[idx:] for idx in idx_threshold]
+
+        return ((deccorr, deccorr_err, deccorr_unit, decbins, decbins_unit) +
+                self.get_timelags())
+
+    def get_rdf(self, solid_angle=None):
+        """
+        Return rdf, rbins, rbins_unit
+        """
+        if solid_angle is None:
+            solid_angle = 4 * np.pi
+        name = DecType.spatial.value + '/decBins'
+        rbins = self._read(name)
+        rdf = _paircount_to_rdf(
+                self._read(DecType.spatial.value + '/decPairCount'), rbins,
+                self._read('numMol'), self._read('volume'), solid_angle)
+        if self._unit(name) == Unit.dimless:
+            rbins = rbins.copy()
+            rbins_unit = Unit.dimless
+        else:
+            rbins = rbins * const.nano
+            rbins_unit = Unit.si_length
+
+        return rdf, rbins, rbins_unit
+
+    def get_edf(self):
+        """
+        Return edf, ebins, ebins_unit
+        """
+        name = DecType.energy.value + '/decBins'
+        ebins = self._read(name) * const.calorie  # kJ mol^-1
+        volume = self._read('volume') * const.nano**3  # m^3
+        edf = _paircount_to_edf(
+                self._read(DecType.energy.value + '/decPairCount'),
+                ebins, volume)
+        if self._unit(name) == Unit.dimless:
+            edf_unit = Unit.dimless
+            ebins_unit = Unit.dimless
+        else:
+            edf_unit = "{length}$^{{-3}}$ {energy_inv}".format(
+                    **Unit.default_unit)
+            ebins_unit = "{energy}".format(
+                    **Unit.default_unit)
+        return edf, edf_unit, ebins, ebins_unit
+
+    def get_D(self):
+        """
+        Return D, D_err, D_unit, fit, fit_unit
+        """
+        nummol = self._read('numMol')
+        num_moltype, _, _ = _numtype(nummol)
+        nD, nD_err, nD_unit = self._converted(
+                'nD', Unit.gmx_ec_nD_list, const.nano**2 / const.pico,
+                "{length}$^2$ {time}$^{{-1}}$")
+
+        D = nD[:, :num_moltype] / nummol  # L^2 T^-1  [fit, num_moltype]
+        D_err = nD_err[:, :num_moltype] / nummol
+        return (D, D_err, nD_unit) + self.get_fit()
+
+    def get_decD(self, dectype, weight=None, threshold=0.0,
+                 smooth=None, num_smooth_point=500, padded=False):
+        """
+        Return decD, decD_err, decD_unit, decBins, decBins_unit, fit, fit_unit
+
+        weight: [type, bins], whose bins before the first one of
+                weight >= threshold are cut from decD of each type
+        smooth: if given, each cut decD is interpolated without its nan
+                to num_smooth_point points, by the smoothing method
+        padded: if False, the cut decD and decBins are lists of [fit][type],
+                otherwise arrays of [fit, type, bins], where decD and decD_err
+                are masked arrays of the cut bins, or of [fit, type,
+                num_smooth_point] if smoothed, where decD_err is not;
+                idx_threshold [type] of the first bins kept is also returned
+
+        smoothing method
+        http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.interpolate.interp1d.html
+        ‘linear’, ‘nearest’, ‘zero’, ‘slinear’, ‘quadratic, ‘cubic’
+        """
+        decD, decD_err, decD_unit = _copy_arrays(self._converted(
+                dectype.value + '/decD', Unit.gmx_ec_nD_list,
+                const.nano**2 / const.pico,
+                "{length}$^2$ {time}$^{{-1}}$"))  # L^2 T^-1
+        fit, fit_unit = self.get_fit()
+        decBins, decBins_unit = self.get_decbins(dectype)
+
+        if weight is not None:
+            idx_threshold = _threshold_index(weight, threshold)
+            # [type, bins] -> [fit, type, bins]
+            kept = np.broadcast_to(np.arange(decBins.size) >=
+                                   idx_threshold[:, np.newaxis], decD.shape)
+            if smooth is not None:
+                decBins, decD = _smooth_curves(
+                        decBins, decD, kept & ~np.isnan(decD), smooth,
+                        num_smooth_point)
+                if not padded:
+                    decD = [list(DD) for DD in decD]
+                    decBins = [list(bins) for bins in decBins]
+            elif padded:
+                decD = np.ma.masked_array(decD, ~kept)
+                decD_err = np.ma.masked_array(decD_err, ~kept)
+            else:
+                decD = [[D[idx:] for D, idx in zip(DD, idx_threshold)]
+                        for DD in decD]
+                decBins = [[decBins[idx:] for idx in idx_threshold]
+                           for _ in decD]
+            if padded:
+                return (decD, decD_err, decD_unit, decBins, decBins_unit,
+                        fit, fit_unit, idx_threshold)
+        return decD, decD_err, decD_unit, decBins, decBins_unit, fit, fit_unit
+
+    def _zz(self):
+        """
+        Return zz of the quantity type
+        """
+        zz = _zz(self._read('charge'), self._read('numMol'))
+        qnttype = self.get_qnttype()
+        if qnttype == Quantity.ec:
+            return zz
         elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('fit_unit "{}" cannot be recognized '
-                                   'for {}'.format(fit_unit, qnttype))
+            return np.ones_like(zz)
         else:
             raise Error("Unknown qnttype: {}".format(qnttype))
-    return fit, fit_unit
 
+    def _decqnt_unit(self):
+        qnttype = self.get_qnttype()
+        nD_unit = self._unit('nD')
+        if qnttype == Quantity.ec:
+            if nD_unit in Unit.gmx_ec_nD_list:
+                return "{siemens} {length}$^{{-1}}$".format(
+                        **Unit.default_unit)
+            else:
+                raise UnknownUnitError('nD_unit "{}" cannot be '
+                                       'recognized'.format(nD_unit))
+        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
+            if nD_unit == Unit.dimless:
+                return Unit.dimless
+            else:
+                raise UnknownUnitError('nD_unit "{}" cannot be recognized '
+                                       'for {}'.format(nD_unit, qnttype))
+        else:
+            raise Error("Unknown qnttype: {}".format(qnttype))
 
-def get_timelags(decname):
-    """
-    Return timelags, timelags_unit
-    """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        timelags = f['timeLags'][...]
-        timelags_unit = f['timeLags'].attrs['unit'].decode()
-
-    if timelags_unit != Unit.dimless:
+    def get_quantity(self):
+        """
+        Return
+        qnt_total, qnt_total_err,
+        qnt[:num_moltype], qnt_err[:num_moltype], qnt_unit,
+        fit, fit_unit
+        """
+        qnttype = self.get_qnttype()
+        nD2qnt = self._nD_to_qnt_const()
+        nD_unit = self._unit('nD')
         if qnttype == Quantity.ec:
-            if timelags_unit == Unit.gmx_time:
-                timelags *= const.pico
-                timelags_unit = Unit.si_time
+            zz = _zz(self._read('charge'), self._read('numMol'))
+            if nD_unit == Unit.dimless:
+                qnt_unit = Unit.dimless
+            elif nD_unit in Unit.gmx_ec_nD_list:
+                qnt_unit = "{siemens} m$^{{-1}}$".format(**Unit.default_unit)
             else:
-                raise UnknownUnitError('timelags_unit "{}" cannot be recognized'
-                                       ' for {}'.format(timelags_unit, qnttype))
+                raise UnknownUnitError('nD_unit "{}" cannot be '
+                                       'recognized'.format(nD_unit))
         elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('timelags_unit "{}" cannot be recognized '
-                                   'for {}'.format(timelags_unit, qnttype))
+            zz = 1
+            if nD_unit == Unit.dimless:
+                qnt_unit = Unit.dimless
+            else:
+                raise UnknownUnitError('nD_unit "{}" cannot be recognized '
+                                       'for {}'.format(nD_unit, qnttype))
         else:
             raise Error("Unknown qnttype: {}".format(qnttype))
-    return timelags, timelags_unit
+
+        qnt_total = self._read('nDTotal') * nD2qnt
+        qnt_totol_err = self._read('nDTotal_err') * nD2qnt
+        qnt = self._read('nD') * zz * nD2qnt
+        qnt_err = self._read('nD_err') * abs(zz) * nD2qnt
+
+        return ((qnt_total, qnt_totol_err, qnt, qnt_err, qnt_unit) +
+                self.get_fit())
+
+    def _spatial_sums(self):
+        """
+        Return the sums over the spatial bins shared by get_decqnt_sd and
+        get_decqnt2_sd, computed once
+
+        local_decD, local_paircount: [fit, pairtype, bins] cumulative
+            integrals of paircount * decD and paircount, skipping the bins
+            where paircount * decD is nan, such that decqnt_local is
+            (local_decD - decD_nonlocal * local_paircount) * zz * nD2qnt
+        paircount_decD, paircount: [..., bins + 1] prefix sums over bins
+            of paircount * decD and paircount, nan summed as zero
+        decD, decD_nan: [fit, pairtype, bins + 1] prefix sums over bins of
+            decD, nan summed as zero, and of the number of nan
+        """
+        def prefix_sum(data):
+            return np.concatenate((np.zeros(data.shape[:-1] + (1,)),
+                                   np.cumsum(data, axis=-1)), axis=-1)
+
+        def compute():
+            dectype = DecType.spatial
+            decD = self._read(dectype.value + '/decD')  # L^2 T^-1
+            paircount = self._read(dectype.value + '/decPairCount')
+            paircount_decD = paircount * decD
+            valid = ~np.isnan(paircount_decD)
+            return {
+                'local_decD': integrate.cumtrapz(
+                    np.where(valid, paircount_decD, 0), initial=0),
+                'local_paircount': integrate.cumtrapz(
+                    np.where(valid, paircount, 0), initial=0),
+                'paircount_decD': prefix_sum(np.where(valid,
+                                                      paircount_decD, 0)),
+                'paircount': prefix_sum(np.nan_to_num(paircount)),
+                'decD': prefix_sum(np.nan_to_num(decD)),
+                'decD_nan': prefix_sum(np.isnan(decD))}
+
+        return self._cached(('spatial sums',), compute)
+
+    def _spatial_window_sum(self, name, begin, end):
+        """
+        Return the sums of _spatial_sums()[name] over the bins
+        [begin, end) of each of the arrays begin and end, stacked first
+        """
+        cum = self._spatial_sums()[name]
+        return np.moveaxis(np.take(cum, end, axis=-1) -
+                           np.take(cum, begin, axis=-1), -1, 0)
+
+    def _decqnt_sd(self, decD_nonlocal, nonlocal_weight):
+        """
+        Return decqnt, decqnt_local, decqnt_nonlocal of the spatial
+        decomposition, for decD_nonlocal [..., fit, pairtype], the nonlocal
+        decD of each of the separations stacked in the leading axes
+
+        nonlocal_weight: [pairtype] number of pairs of the nonlocal part
+        """
+        sums = self._spatial_sums()
+        nummol = self._read('numMol')
+        num_moltype, _, _ = _numtype(nummol)
+        nD = self._read('nD')
+        zz = self._zz()
+        nD2qnt = self._nD_to_qnt_const()
+
+        zz_pair = zz[num_moltype:] * nD2qnt
+        decqnt_nonlocal = decD_nonlocal * nonlocal_weight * zz_pair
+        decqnt_local = ((sums['local_decD'] -
+                         decD_nonlocal[..., np.newaxis] *
+                         sums['local_paircount']) *
+                        zz_pair[:, np.newaxis])
+        # the integrand is zero where decD_nonlocal is nan
+        decqnt_local = np.where(np.isnan(decD_nonlocal)[..., np.newaxis],
+                                0, decqnt_local)
+
+        # decqnt = qnt_auto + qnt_cross
+        #        = qnt_auto + (decqnt_local + decqnt_nonlocal)
+        qnt_auto = (nD[:, :num_moltype] * zz[:num_moltype] * nD2qnt)
+        decqnt = (qnt_auto[..., np.newaxis] +
+                  pair_type_index(num_moltype).to_moltype(
+                      decqnt_local + decqnt_nonlocal[..., np.newaxis],
+                      axis=-2))
+        return decqnt, decqnt_local, decqnt_nonlocal
+
+    def _spatial_bins(self):
+        """
+        Return decBins, decBins_unit of spatial decomposition
+        """
+        dectype = DecType.spatial
+        decBins = self._read(dectype.value + '/decBins').copy()
+        decBins_unit = self._unit(dectype.value + '/decBins')
+        if decBins_unit == Unit.gmx_length:
+            decBins *= const.nano
+            decBins_unit = "{length}".format(**Unit.default_unit)
+        return decBins, decBins_unit
+
+    def get_decqnt2_sd(self, sep_nonlocal=False, sep_r=None):
+        """
+        Instead of avewidth, r ranges from sep_r to the end will be averaged
+        as the nonlocal component.
+
+        sep_r: separation radius, or an array of them, default to half of
+               the box length
+
+        Return decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
+               decqnt_local, decqnt_nonlocal
+
+        If sep_r is an array, decqnt, decqnt_local and decqnt_nonlocal are
+        stacked over it, where decqnt is a masked array of the bins beyond
+        each sep_r instead of being cut.
+        """
+        dectype = DecType.spatial
+        decBins = self._read(dectype.value + '/decBins')
+        decD = self._read(dectype.value + '/decD')
+        bw = decBins[1] - decBins[0]
+        stacked = sep_nonlocal and np.ndim(sep_r) > 0
+
+        if sep_nonlocal:
+            if sep_r is None:
+                sep_r = self._read('volume')**(1/3) / 2
+            sep_idx = (np.atleast_1d(sep_r) / bw).astype(int) + 1
+            if np.any(sep_idx >= decBins.size):
+                raise Error("sep_r is too large: {}, it should be smaller "
+                            "than {}".format(sep_r, decBins[-1]))
+            num_bin = np.full_like(sep_idx, decBins.size)
+            # [sep, fit, pairtype]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                decD_nonlocal = (
+                        self._spatial_window_sum('paircount_decD', sep_idx,
+                                                 num_bin) /
+                        self._spatial_window_sum('paircount', sep_idx,
+                                                 num_bin)[:, np.newaxis])
+            if not stacked:
+                sep_idx = sep_idx[0]
+                decD_nonlocal = decD_nonlocal[0]
+            decqnt, decqnt_local, decqnt_nonlocal = self._decqnt_sd(
+                    decD_nonlocal, self._spatial_sums()['paircount'][:, -1])
+        else:
+            sep_idx = decBins.size
+            decqnt, decqnt_local, decqnt_nonlocal = self._decqnt_sd(
+                    np.zeros(decD.shape[:-1]),
+                    self._spatial_sums()['paircount'][:, -1])
+
+        decBins, decBins_unit = self._spatial_bins()
+        decqnt_unit = self._decqnt_unit()
+        fit, fit_unit = self.get_fit()
+        if stacked:
+            beyond = (np.arange(decBins.size) >=
+                      sep_idx[:, np.newaxis])[:, np.newaxis, np.newaxis]
+            decqnt = np.ma.masked_array(
+                    decqnt, np.broadcast_to(beyond, decqnt.shape))
+            decqnt_local = np.take_along_axis(
+                    decqnt_local, (sep_idx - 1)[:, np.newaxis, np.newaxis,
+                                                np.newaxis], axis=-1)[..., 0]
+            return (decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
+                    decqnt_local, decqnt_nonlocal)
+        sep_idx = int(sep_idx)
+        return (decqnt[..., :sep_idx], decqnt_unit,
+                decBins[:sep_idx], decBins_unit, fit, fit_unit,
+                decqnt_local[:, :, sep_idx-1], decqnt_nonlocal)
+
+    def get_decqnt_sd(self, sep_nonlocal=False, nonlocal_ref=None,
+                      avewidth=None):
+        """
+        Return decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
+               decqnt_local, decqnt_nonlocal
+
+        The nonlocal decD is the mean over nonlocal_ref +/- avewidth.
+        If nonlocal_ref or avewidth are arrays, which are broadcast together,
+        decqnt, decqnt_local and decqnt_nonlocal are stacked over them.
+        """
+        dectype = DecType.spatial
+        nummol = self._read('numMol')
+        decD = self._read(dectype.value + '/decD')  # L^2 T^-1
+        decBins = self._read(dectype.value + '/decBins')
+        bw = decBins[1] - decBins[0]
+
+        if sep_nonlocal:
+            if nonlocal_ref is None:
+                nonlocal_ref_idx = int(decBins.size / np.sqrt(3))
+            else:
+                nonlocal_ref_idx = (np.asarray(nonlocal_ref) /
+                                    bw).astype(int)
+            if avewidth is None:
+                avewidth = 0.25
+            avewidth_idx = (np.asarray(avewidth) / bw).astype(int)
+            stacked = np.broadcast(nonlocal_ref_idx, avewidth_idx).ndim > 0
+            nonlocal_ref_idx, avewidth_idx = np.broadcast_arrays(
+                    np.atleast_1d(nonlocal_ref_idx), avewidth_idx)
+            shape = nonlocal_ref_idx.shape
+            nonlocal_ref_idx = nonlocal_ref_idx.ravel()
+            avewidth_idx = avewidth_idx.ravel()
+            # windows out of the bins are cut, and are nan if empty
+            begin = np.clip(nonlocal_ref_idx - avewidth_idx, 0, decBins.size)
+            end = np.clip(nonlocal_ref_idx + avewidth_idx, begin,
+                          decBins.size)
+
+            # [window, fit, pairtype], nan if any decD is nan, as np.mean
+            with np.errstate(invalid='ignore', divide='ignore'):
+                decD_nonlocal = np.where(
+                        self._spatial_window_sum('decD_nan', begin, end) > 0,
+                        np.nan,
+                        self._spatial_window_sum('decD', begin, end) /
+                        (end - begin)[:, np.newaxis, np.newaxis])
+            if stacked:
+                decD_nonlocal = decD_nonlocal.reshape(
+                        shape + decD_nonlocal.shape[1:])
+            else:
+                decD_nonlocal = decD_nonlocal[0]
+            decqnt, decqnt_local, decqnt_nonlocal = self._decqnt_sd(
+                    decD_nonlocal, _nummolpair(nummol))
+        else:
+            decqnt, decqnt_local, decqnt_nonlocal = self._decqnt_sd(
+                    np.zeros(decD.shape[:-1]), _nummolpair(nummol))
+
+        decBins, decBins_unit = self._spatial_bins()
+        decqnt_unit = self._decqnt_unit()
+        fit, fit_unit = self.get_fit()
+        return (decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
+                decqnt_local[..., -1], decqnt_nonlocal)
+
+    def get_normalize_paircount(self, dectype):
+        paircount = self._read(dectype.value + '/decPairCount')
+        return paircount / integrate.trapz(paircount)[..., np.newaxis]
+
+    def get_ec_dec_energy(self, sep_nonlocal=True, threshold=0):
+        """
+        Return ec_dec_cross_I, ec_dec_cross_I_unit,
+               ec_dec_cross_IL, ec_dec_cross_IL_unit,
+               decBins, decBins_unit, fit, fit_unit
+
+        sep_nonlocal: how decD is separated into the nonlocal part,
+                      'edf_max' or True for decD at the maximum of the
+                      energy distribution, 'end' for decD at the first or
+                      last valid bin by the sign of zz, and False for none,
+                      or a list of them
+        threshold: bins of normalized paircount below threshold are cut,
+                   or an array of them
+
+        If sep_nonlocal is a list or threshold is an array,
+        ec_dec_cross_I and ec_dec_cross_IL are stacked over them,
+        as [sep_nonlocal, threshold, fit, type, bins] if both are.
+        """
+        dectype = DecType.energy
+        nummol = self._read('numMol')
+        charge = self._read('charge')
+        volume = self._read('volume')
+        fit = self._read('fit')
+        temperature = self._read('temperature')
+        decD = self._read(dectype.value + '/decD')  # L^2 T^-1
+        decBins = self._read(dectype.value + '/decBins').copy()
+        paircount = self._read(dectype.value + '/decPairCount')
+
+        beta = 1 / (const.k * temperature)
+        zz = _zz(charge, nummol)
+        num_moltype, num_pairtype, _ = _numtype(nummol)
+        zz_pair = zz[num_moltype:]
+
+        def nonlocal_idx(sep):
+            """
+            Return the bin index of decD_nonlocal of each [fit, pairtype]
+            """
+            if sep is True or sep == 'edf_max':
+                return np.broadcast_to(np.argmax(paircount, axis=-1),
+                                       decD.shape[:-1])
+            elif sep == 'end':
+                valid = ~np.isnan(decD)
+                first = np.argmax(valid, axis=-1)
+                last = decBins.size - 1 - np.argmax(valid[..., ::-1], axis=-1)
+                return np.where(zz_pair > 0, first, last)
+            else:
+                raise Error("Unknown sep_nonlocal: {}".format(sep))
+
+        seps = sep_nonlocal if isinstance(sep_nonlocal, (list, tuple)) \
+            else [sep_nonlocal]
+        # [sep, fit, pairtype]
+        decD_nonlocal = np.stack([
+            np.zeros(decD.shape[:-1]) if sep is False or sep is None else
+            np.take_along_axis(decD, nonlocal_idx(sep)[..., np.newaxis],
+                               axis=-1)[..., 0]
+            for sep in seps])
+
+        ec_nonlocal = (
+                integrate.trapz(paircount) / volume * decD_nonlocal *
+                zz_pair * beta)
+        ec_local = (
+                paircount / volume * (decD - decD_nonlocal[..., np.newaxis]) *
+                zz_pair[:, np.newaxis] * beta)
+
+        norm_paircount = self.get_normalize_paircount(dectype)
+        norm_paircount, _ = _symmetrize_array(norm_paircount, decBins)
+        ec_local, decBins = _symmetrize_array(ec_local, decBins)
+
+        ec_local[np.isnan(ec_local)] = 0
+        # filter with threshold: [sep, threshold, fit, pairtype, bins]
+        thresholds = np.reshape(threshold, (-1,) + (1,) * 3)
+        ec_local = np.where(norm_paircount < thresholds,
+                            0, ec_local[:, np.newaxis])
+
+        # reverse the integrate direction for zz > 0 component
+        ec_local = np.where((zz_pair > 0)[:, np.newaxis],
+                            ec_local[..., ::-1], ec_local)
+
+        ec_local = integrate.cumtrapz(ec_local, initial=0)
+
+        ec_dec_cross_IL = ec_local + ec_nonlocal[:, np.newaxis, ...,
+                                                 np.newaxis]
+        ec_dec_cross_I = pair_type_index(num_moltype).to_moltype(
+                ec_dec_cross_IL, axis=-2)
+
+        # drop the axes of sep_nonlocal and threshold not given as arrays
+        squeeze = tuple(axis for axis, stacked in enumerate((
+            isinstance(sep_nonlocal, (list, tuple)),
+            np.ndim(threshold) > 0)) if not stacked)
+        ec_dec_cross_IL = np.squeeze(ec_dec_cross_IL, axis=squeeze)
+        ec_dec_cross_I = np.squeeze(ec_dec_cross_I, axis=squeeze)
+
+        cc = (1 / const.nano**3 *
+              const.nano**2 / const.pico *
+              const.e**2)
+        ec_dec_cross_IL *= cc
+        ec_dec_cross_IL_unit = "{siemens} {length}$^{{-1}}$".format(
+                **Unit.default_unit)
+        ec_dec_cross_I *= cc
+        ec_dec_cross_I_unit = "{siemens} {length}$^{{-1}}$".format(
+                **Unit.default_unit)
+
+        decBins *= const.calorie
+        decBins_unit = "{energy}".format(
+                **Unit.default_unit)
+
+        fit, fit_unit = self.get_fit()
+
+        return (ec_dec_cross_I, ec_dec_cross_I_unit,
+                ec_dec_cross_IL, ec_dec_cross_IL_unit,
+                decBins, decBins_unit,
+                fit, fit_unit)
+
+
+def _nD_to_qnt_const(decname):
+    with DecondReader(decname) as reader:
+        return reader._nD_to_qnt_const()
+
+
+def get_qnttype(decname):
+    """
+    Return quantity string
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_qnttype()
+
+
+def get_temperature(decname):
+    """
+    Return temperature, temperature unit
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_temperature()
+
+
+def get_volume(decname):
+    """
+    Return volume, volume unit
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_volume()
+
+
+def _check_qnttype(decname, required_qnt):
+    with DecondReader(decname) as reader:
+        reader._check_qnttype(required_qnt)
+
+
+def get_fit(decname):
+    """
+    Return fit, fit_unit
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_fit()
+
+
+def get_timelags(decname):
+    """
+    Return timelags, timelags_unit
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_timelags()
 
 
 def get_decbins(decname, dectype):
     """
     Return decBins, decBins_unit
     """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        decBins = gid['decBins'][...]
-        decBins_unit = gid['decBins'].attrs['unit'].decode()
-        if decBins_unit != Unit.dimless:
-            if qnttype == Quantity.ec:
-                if dectype is DecType.spatial:
-                    if decBins_unit == Unit.gmx_length:
-                        decBins *= const.nano
-                        decBins_unit = "{length}".format(**Unit.default_unit)
-                    else:
-                        raise UnknownUnitError('decBins_unit "{}" cannot be '
-                                               'recognized for ec'.format(
-                                                   decBins_unit))
-                elif dectype is DecType.energy:
-                    if decBins_unit == Unit.er_energy:
-                        decBins *= const.calorie
-                        decBins_unit = "{energy}".format(
-                                **Unit.default_unit)
-                    else:
-                        raise UnknownUnitError('decBins_unit "{}" cannot be '
-                                               'recognized for ec'.format(
-                                                   decBins_unit))
-            elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-                raise UnknownUnitError('decBins_unit "{}" cannot be '
-                                       'recognized for {}'.format(
-                                           decBins_unit, qnttype))
-            else:
-                raise Error("Unknown qnttype: {}".format(qnttype))
-    return decBins, decBins_unit
+    with DecondReader(decname) as reader:
+        return reader.get_decbins(dectype)
 
 
 def get_ncorr(decname):
     """
     Return ncorr, ncorr_err, ncorr_unit, timelags, timelags_unit
     """
-    qnttype = get_qnttype(decname)
-    timelags, timelags_unit = get_timelags(decname)
-    with h5py.File(decname, 'r') as f:
-        ncorr = f['nCorr'][...]
-        ncorr_err = f['nCorr_err'][...]
-        ncorr_unit = f['nCorr'].attrs['unit'].decode()
-
-    if  ncorr_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if ncorr_unit == Unit.gmx_ec_corr:
-                cc = const.nano**2 / const.pico**2
-                ncorr *= cc
-                ncorr_err *= cc
-                ncorr_unit = "{length}$^2$ {time}$^{{-2}}$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('ncorr_unit "{}" cannot be recognized'
-                                       ' for {}'.format(ncorr_unit, qnttype))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('ncorr_unit "{}" cannot be recognized '
-                                   'for {}'.format(ncorr_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    return (ncorr, ncorr_err, ncorr_unit, timelags, timelags_unit)
+    with DecondReader(decname) as reader:
+        return reader.get_ncorr()
 
 
 def get_ndtotal_cesaro(decname):
@@ -1281,32 +3740,8 @@ def get_ndtotal_cesaro(decname):
     Return ndtotal_cesaro, ndtotal_cesaro_err, ndtotal_cesaro_unit,
            timelags, timelags_unit
     """
-    qnttype = get_qnttype(decname)
-    timelags, timelags_unit = get_timelags(decname)
-    with h5py.File(decname, 'r') as f:
-        ndtotal_cesaro = f['nDTotalCesaro'][...]
-        ndtotal_cesaro_err = f['nDTotalCesaro_err'][...]
-        ndtotal_cesaro_unit = f['nDTotalCesaro'].attrs['unit'].decode()
-
-    if  ndtotal_cesaro_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if ndtotal_cesaro_unit == Unit.gmx_ec_dcesaro:
-                cc = const.nano**2
-                ndtotal_cesaro *= cc
-                ndtotal_cesaro_err *= cc
-                ndtotal_cesaro_unit = "{length}$^2$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('ndtotal_cesaro_unit "{}" cannot be recognized'
-                                       ' for {}'.format(ndtotal_cesaro_unit, qnttype))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('decD_unit "{}" cannot be recognized '
-                                   'for {}'.format(ndtotal_cesaro_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    return (ndtotal_cesaro, ndtotal_cesaro_err, ndtotal_cesaro_unit,
-            timelags, timelags_unit)
+    with DecondReader(decname) as reader:
+        return reader.get_ndtotal_cesaro()
 
 
 def get_dec_dcesaro(decname, dectype):
@@ -1314,234 +3749,53 @@ def get_dec_dcesaro(decname, dectype):
     Return dec_dcesaro, dec_dcesaro_err, dec_dcesaro_unit,
            decbins, decbins_unit, timelags, timelags_unit
     """
-    qnttype = get_qnttype(decname)
-    timelags, timelags_unit = get_timelags(decname)
-    decbins, decbins_unit = get_decbins(decname, dectype)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        dec_dcesaro = gid['decDCesaro'][...]
-        dec_dcesaro_err = gid['decDCesaro_err'][...]
-        dec_dcesaro_unit = gid['decDCesaro'].attrs['unit'].decode()
-
-    if dec_dcesaro_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if dec_dcesaro_unit == Unit.gmx_ec_dcesaro:
-                cc = const.nano**2
-                dec_dcesaro *= cc
-                dec_dcesaro_err *= cc
-                dec_dcesaro_unit = "{length}$^2$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('dec_dcesaro_unit "{}" cannot be recognized'
-                                       ' for {}'.format(dec_dcesaro_unit, qnttype))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('decD_unit "{}" cannot be recognized '
-                                   'for {}'.format(dec_dcesaro_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    return (dec_dcesaro, dec_dcesaro_err, dec_dcesaro_unit,
-            decbins, decbins_unit, timelags, timelags_unit)
+    with DecondReader(decname) as reader:
+        return reader.get_dec_dcesaro(dectype)
 
 
-def get_deccorr(decname, dectype, weight=None, threshold=0.0):
+def get_deccorr(decname, dectype, weight=None, threshold=0.0, padded=False):
     """
     Return deccorr, deccorr_err, deccorr_unit,
            decbins, decbins_unit, timelags, timelags_unit
     """
-    qnttype = get_qnttype(decname)
-    timelags, timelags_unit = get_timelags(decname)
-    decbins, decbins_unit = get_decbins(decname, dectype)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        deccorr = gid['decCorr'][...]
-        deccorr_err = gid['decCorr_err'][...]
-        deccorr_unit = gid['decCorr'].attrs['unit'].decode()
-
-    if deccorr_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if deccorr_unit == Unit.gmx_ec_corr:
-                cc = const.nano**2 / const.pico**2
-                deccorr *= cc
-                deccorr_err *= cc
-                deccorr_unit = "{length}$^2$ {time}$^{{-2}}$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('deccorr_unit "{}" cannot be recognized'
-                                       ' for {}'.format(deccorr_unit, qnttype))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('decD_unit "{}" cannot be recognized '
-                                   'for {}'.format(deccorr_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    if weight is not None:
-        deccorr_ret = []
-        decbins_ret = []
-        w_masked = np.where(np.isnan(weight), -1, weight)
-        for itype, decc in enumerate(deccorr):
-            idx_threshold = next(
-                    i for i, w in enumerate(w_masked[itype])
-                    if w >= threshold)
-
-            _decbins = decbins[idx_threshold:]
-            decc = decc[idx_threshold:, :]
-
-            deccorr_ret.append(decc)
-            decbins_ret.append(_decbins)
-
-        deccorr = deccorr_ret
-        decbins = decbins_ret
-
-    return (deccorr, deccorr_err, deccorr_unit,
-            decbins, decbins_unit, timelags, timelags_unit)
+    with DecondReader(decname) as reader:
+        return reader.get_deccorr(dectype, weight, threshold, padded)
 
 
 def get_rdf(decname, solid_angle=None):
     """
     Return rdf, rbins, rbins_unit
     """
-    if solid_angle is None:
-        solid_angle = 4 * np.pi
-    with h5py.File(decname, 'r') as f:
-        gid = f[DecType.spatial.value]
-        rbins = gid['decBins'][...]
-        rdf = _paircount_to_rdf(gid['decPairCount'][...], rbins,
-                                f['numMol'][...], f['volume'][...], solid_angle)
-        if gid['decBins'].attrs['unit'].decode() == Unit.dimless:
-            rbins_unit = Unit.dimless
-        else:
-            rbins *= const.nano
-            rbins_unit = Unit.si_length
-
-        return rdf, rbins, rbins_unit
+    with DecondReader(decname) as reader:
+        return reader.get_rdf(solid_angle)
 
 
 def get_edf(decname):
     """
     Return edf, ebins, ebins_unit
     """
-    with h5py.File(decname, 'r') as f:
-        gid = f[DecType.energy.value]
-        ebins = gid['decBins'][...] * const.calorie  # kJ mol^-1
-        volume = f['volume'][...] * const.nano**3  # m^3
-        edf = _paircount_to_edf(gid['decPairCount'][...], ebins, volume)
-        if gid['decBins'].attrs['unit'].decode() == Unit.dimless:
-            edf_unit = Unit.dimless
-            ebins_unit = Unit.dimless
-        else:
-            edf_unit = "{length}$^{{-3}}$ {energy_inv}".format(
-                    **Unit.default_unit)
-            ebins_unit = "{energy}".format(
-                    **Unit.default_unit)
-        return edf, edf_unit, ebins, ebins_unit
+    with DecondReader(decname) as reader:
+        return reader.get_edf()
 
 
 def get_D(decname):
     """
     Return D, D_err, D_unit, fit, fit_unit
     """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        nummol = f['numMol'][...]
-        num_moltype, _, _ = _numtype(nummol)
-        nD = f['nD'][:, :num_moltype]
-        nD_unit = f['nD'].attrs['unit'].decode()
-        nD_err = f['nD_err'][:, :num_moltype]
-
-    D = nD / nummol  # L^2 T^-1  [fit, num_moltype]
-    D_err = nD_err / nummol
-    if nD_unit == Unit.dimless:
-        D_unit = Unit.dimless
-    else:
-        if qnttype == Quantity.ec:
-            if nD_unit in Unit.gmx_ec_nD_list:
-                cc = const.nano**2 / const.pico
-                D *= cc
-                D_err *= cc
-                D_unit = "{length}$^2$ {time}$^{{-1}}$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('nD_unit "{}" cannot be '
-                                       'recognized'.format(nD_unit))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('nD_unit "{}" cannot be recognized '
-                                   'for {}'.format(nD_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    fit, fit_unit = get_fit(decname)
-    return D, D_err, D_unit, fit, fit_unit
+    with DecondReader(decname) as reader:
+        return reader.get_D()
 
 
 def get_decD(decname, dectype, weight=None, threshold=0.0,
-             smooth=None, num_smooth_point=500):
+             smooth=None, num_smooth_point=500, padded=False):
     """
     Return decD, decD_err, decD_unit, decBins, decBins_unit, fit, fit_unit
 
-    smoothing method
-    http://docs.scipy.org/doc/scipy-0.15.1/reference/generated/scipy.interpolate.interp1d.html
-    ‘linear’, ‘nearest’, ‘zero’, ‘slinear’, ‘quadratic, ‘cubic’
+    See DecondReader.get_decD for the smoothing methods.
     """
-    qnttype = get_qnttype(decname)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        decD = gid['decD'][...]  # L^2 T^-1
-        decD_unit = gid['decD'].attrs['unit'].decode()
-        decD_err = gid['decD_err'][...]
-        decBins = gid['decBins'][...]
-
-    if decD_unit != Unit.dimless:
-        if qnttype == Quantity.ec:
-            if decD_unit in Unit.gmx_ec_nD_list:
-                ccD = const.nano**2 / const.pico
-                decD *= ccD
-                decD_err *= ccD
-                decD_unit = "{length}$^2$ {time}$^{{-1}}$".format(
-                        **Unit.default_unit)
-            else:
-                raise UnknownUnitError('decD_unit "{}" cannot be '
-                                       'recognized'.format(decD_unit))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            raise UnknownUnitError('decD_unit "{}" cannot be recognized '
-                                   'for {}'.format(decD_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-    fit, fit_unit = get_fit(decname)
-    decBins, decBins_unit = get_decbins(decname, dectype)
-
-    if weight is not None:
-        decD_ret = []
-        decBins_ret = []
-        w_masked = np.where(np.isnan(weight), -1, weight)
-        for fitkey, DD in enumerate(decD):
-            decD_ret.append([])
-            decBins_ret.append([])
-            for itype, D in enumerate(DD):
-                idx_threshold = next(
-                        i for i, w in enumerate(w_masked[itype])
-                        if w >= threshold)
-
-                _decBins = decBins[idx_threshold:]
-                D = D[idx_threshold:]
-
-                if smooth is not None:
-                    not_nan_D = np.logical_not(np.isnan(D))
-                    _decBins = _decBins[not_nan_D]
-                    D = D[not_nan_D]
-
-                    D_interp = interpolate.interp1d(_decBins, D, kind=smooth)
-                    _decBins = np.linspace(
-                            _decBins[0], _decBins[-1], num_smooth_point)
-                    D = D_interp(_decBins)
-
-                decD_ret[fitkey].append(D)
-                decBins_ret[fitkey].append(_decBins)
-
-        decD = decD_ret
-        decBins = decBins_ret
-    return decD, decD_err, decD_unit, decBins, decBins_unit, fit, fit_unit
+    with DecondReader(decname) as reader:
+        return reader.get_decD(dectype, weight, threshold, smooth,
+                               num_smooth_point, padded)
 
 
 def get_quantity(decname):
@@ -1551,61 +3805,27 @@ def get_quantity(decname):
     qnt[:num_moltype], qnt_err[:num_moltype], qnt_unit,
     fit, fit_unit
     """
-    qnttype = get_qnttype(decname)
-    nD2qnt = _nD_to_qnt_const(decname)
-    with h5py.File(decname, 'r') as f:
-        nDTotal = f['nDTotal'][...]
-        nDTotal_err = f['nDTotal_err'][...]
-        nD = f['nD'][...]
-        nD_unit = f['nD'].attrs['unit'].decode()
-        nD_err = f['nD_err'][...]
-        nummol = f['numMol'][...]
-        charge = f['charge'][...]
-        if qnttype == Quantity.ec:
-            zz = _zz(charge, nummol)
-            if nD_unit == Unit.dimless:
-                qnt_unit = Unit.dimless
-            elif nD_unit in Unit.gmx_ec_nD_list:
-                qnt_unit = "{siemens} m$^{{-1}}$".format(**Unit.default_unit)
-            else:
-                raise UnknownUnitError('nD_unit "{}" cannot be '
-                                       'recognized'.format(nD_unit))
-        elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-            zz = 1
-            if nD_unit == Unit.dimless:
-                qnt_unit = Unit.dimless
-            else:
-                raise UnknownUnitError('nD_unit "{}" cannot be recognized '
-                                       'for {}'.format(nD_unit, qnttype))
-        else:
-            raise Error("Unknown qnttype: {}".format(qnttype))
-
-        qnt_total = nDTotal * nD2qnt
-        qnt_totol_err = nDTotal_err * nD2qnt
-        qnt = nD * zz * nD2qnt
-        qnt_err = nD_err * abs(zz) * nD2qnt
-
-    fit, fit_unit = get_fit(decname)
-    return qnt_total, qnt_totol_err, qnt, qnt_err, qnt_unit, fit, fit_unit
+    with DecondReader(decname) as reader:
+        return reader.get_quantity()
 
 
 def _symmetrize_array(arr, decBins, center=0, axis=-1):
+    """
+    Pad arr with zeros along axis, and decBins, such that decBins are
+    symmetric about center
+    """
     center_idx = np.where(decBins == center)[0][0]
     num_left = center_idx
     num_right = decBins.size - num_left - 1
     bw = decBins[1] - decBins[0]
-    if num_left > num_right:
-        # postpad zero
-        numpad = num_left - num_right
-        arr = np.append(arr, np.zeros(arr.shape[:-1]+(numpad,)), axis=axis)
-        decBins = np.hstack((decBins, [decBins[-1] + (i+1) * bw
-                             for i in range(numpad)]))
-    elif num_left < num_right:
-        # prepad zero
-        numpad = num_right - num_left
-        arr = np.insert(arr, [0]*numpad, 0., axis=axis)
-        decBins = np.hstack((list(reversed([decBins[0] - (i+1) * bw
-                                           for i in range(numpad)])), decBins))
+    # (prepad, postpad)
+    numpad = (max(num_right - num_left, 0), max(num_left - num_right, 0))
+    pad_width = [(0, 0)] * arr.ndim
+    pad_width[axis] = numpad
+    arr = np.pad(arr, pad_width, mode='constant')
+    decBins = np.concatenate((
+        decBins[0] - bw * np.arange(numpad[0], 0, -1), decBins,
+        decBins[-1] + bw * np.arange(1, numpad[1] + 1)))
 
     return arr, decBins
 
@@ -1617,95 +3837,11 @@ def get_decqnt2_sd(decname, sep_nonlocal=False, sep_r=None):
 
     Return decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
            decqnt_local, decqnt_nonlocal
-    """
-    dectype = DecType.spatial
-    qnttype = get_qnttype(decname)
-    nD2qnt = _nD_to_qnt_const(decname)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        nummol = f['numMol'][...]
-        charge = f['charge'][...]
-        vol = f['volume'][...]
-        num_moltype, _, _ = _numtype(nummol)
-        nD = f['nD'][...]
-        nD_unit = f['nD'].attrs['unit'].decode()
-        decD = gid['decD'][...]  # L^2 T^-1
-        decBins = gid['decBins'][...]
-        decBins_unit = gid['decBins'].attrs['unit'].decode()
-        paircount = gid['decPairCount'][...]
-        bw = decBins[1] - decBins[0]
 
-#     if qnttype != Quantity.vsc:
-#         raise Error("get_decqnt2_sd currenlty only supports qnttype: "
-#                     "{}".format(Quantity.vsc))
-    if qnttype == Quantity.ec:
-        zz = _zz(charge, nummol)
-    elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-        zz = np.ones_like(_zz(charge, nummol))
-    else:
-        raise Error("Unknown qnttype: {}".format(qnttype))
-
-    if sep_nonlocal:
-        if sep_r is None:
-            sep_r = vol**(1/3) / 2
-        sep_idx = int(sep_r / bw) + 1
-        if sep_idx >= decBins.size:
-            raise Error("sep_r is too large: {}, it should be smaller than "
-                        "{}".format(sep_r, decBins[-1]))
-        c_all = np.nansum(paircount[:, :], axis=1)
-        c_out = np.nansum(paircount[:, sep_idx:], axis=1)
-        tmp = paircount[np.newaxis, :, sep_idx:] * decD[:, :, sep_idx:]
-        decD_nonlocal = np.nansum(tmp, axis=2) / c_out[np.newaxis, :]
-        decqnt_nonlocal = decD_nonlocal * c_all * zz[num_moltype:] * nD2qnt
-
-    else:
-        sep_idx = decBins.size
-        decD_nonlocal = np.zeros(decD.shape[:-1])
-        decqnt_nonlocal = np.zeros_like(decD_nonlocal)
-
-    decqnt_local = (paircount * (decD - decD_nonlocal[:, :, np.newaxis]) *
-                    zz[num_moltype:, np.newaxis] * nD2qnt)
-    decqnt_local[np.isnan(decqnt_local)] = 0
-    decqnt_local = integrate.cumtrapz(decqnt_local, initial=0)
-
-    qnt_auto = (nD[:, :num_moltype] * zz[:num_moltype] * nD2qnt)
-    decqnt = qnt_auto[:, :, np.newaxis] * np.ones_like(decBins)
-
-    # decqnt = qnt_auto + qnt_cross
-    #        = qnt_auto + (decqnt_local + decqnt_nonlocal)
-    for r in range(num_moltype):
-        for c in range(r, num_moltype):
-            idx = _pairtype_index(r, c, num_moltype)
-            decqnt[:, r] += (decqnt_local[:, idx] +
-                             decqnt_nonlocal[:, idx, np.newaxis])
-            if (r != c):
-                decqnt[:, c] += (decqnt_local[:, idx] +
-                                 decqnt_nonlocal[:, idx, np.newaxis])
-
-    if qnttype == Quantity.ec:
-        if nD_unit in Unit.gmx_ec_nD_list:
-            decqnt_unit = "{siemens} {length}$^{{-1}}$".format(
-                    **Unit.default_unit)
-        else:
-            raise UnknownUnitError('nD_unit "{}" cannot be '
-                                   'recognized'.format(nD_unit))
-    elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-        if nD_unit == Unit.dimless:
-            decqnt_unit = Unit.dimless
-        else:
-            raise UnknownUnitError('nD_unit "{}" cannot be recognized '
-                                   'for {}'.format(nD_unit, qnttype))
-    else:
-        raise Error("Unknown qnttype: {}".format(qnttype))
-
-    if decBins_unit == Unit.gmx_length:
-        decBins *= const.nano
-        decBins_unit = "{length}".format(**Unit.default_unit)
-
-    fit, fit_unit = get_fit(decname)
-    return (decqnt[..., :sep_idx], decqnt_unit,
-            decBins[:sep_idx], decBins_unit, fit, fit_unit,
-            decqnt_local[:, :, sep_idx-1], decqnt_nonlocal)
+    See DecondReader.get_decqnt2_sd for an array of sep_r.
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_decqnt2_sd(sep_nonlocal, sep_r)
 
 
 def get_decqnt_sd(decname, sep_nonlocal=False, nonlocal_ref=None,
@@ -1713,249 +3849,861 @@ def get_decqnt_sd(decname, sep_nonlocal=False, nonlocal_ref=None,
     """
     Return decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
            decqnt_local, decqnt_nonlocal
+
+    See DecondReader.get_decqnt_sd for arrays of nonlocal_ref and avewidth.
     """
-    dectype = DecType.spatial
-    qnttype = get_qnttype(decname)
-    nD2qnt = _nD_to_qnt_const(decname)
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        nummol = f['numMol'][...]
-        charge = f['charge'][...]
-        num_moltype, _, _ = _numtype(nummol)
-        nD = f['nD'][...]
-        nD_unit = f['nD'].attrs['unit'].decode()
-        decD = gid['decD'][...]  # L^2 T^-1
-        decBins = gid['decBins'][...]
-        decBins_unit = gid['decBins'].attrs['unit'].decode()
-        paircount = gid['decPairCount'][...]
-        bw = decBins[1] - decBins[0]
+    with DecondReader(decname) as reader:
+        return reader.get_decqnt_sd(sep_nonlocal, nonlocal_ref, avewidth)
 
-    if qnttype == Quantity.ec:
-        zz = _zz(charge, nummol)
-    elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-        zz = np.ones_like(_zz(charge, nummol))
-    else:
-        raise Error("Unknown qnttype: {}".format(qnttype))
 
-    if sep_nonlocal:
-        if nonlocal_ref is None:
-            nonlocal_ref_idx = int(decBins.size / np.sqrt(3))
-        else:
-            nonlocal_ref_idx = int(nonlocal_ref / bw)
-        if avewidth is None:
-            avewidth = 0.25
-        avewidth_idx = int(avewidth / bw)
-        decD_nonlocal = np.mean(
-                decD[:, :,
-                     nonlocal_ref_idx - avewidth_idx:
-                     nonlocal_ref_idx + avewidth_idx],
-                axis=-1)
-        decqnt_nonlocal = (_nummolpair(nummol) * decD_nonlocal *
-                           zz[num_moltype:] * nD2qnt)
-    else:
-        decD_nonlocal = np.zeros(decD.shape[:-1])
-        decqnt_nonlocal = np.zeros_like(decD_nonlocal)
-
-    decqnt_local = (paircount * (decD - decD_nonlocal[:, :, np.newaxis]) *
-                    zz[num_moltype:, np.newaxis] * nD2qnt)
-    decqnt_local[np.isnan(decqnt_local)] = 0
-    decqnt_local = integrate.cumtrapz(decqnt_local, initial=0)
-
-    qnt_auto = (nD[:, :num_moltype] * zz[:num_moltype] * nD2qnt)
-    decqnt = qnt_auto[:, :, np.newaxis] * np.ones_like(decBins)
-
-    # decqnt = qnt_auto + qnt_cross
-    #        = qnt_auto + (decqnt_local + decqnt_nonlocal)
-    for r in range(num_moltype):
-        for c in range(r, num_moltype):
-            idx = _pairtype_index(r, c, num_moltype)
-            decqnt[:, r] += (decqnt_local[:, idx] +
-                             decqnt_nonlocal[:, idx, np.newaxis])
-            if (r != c):
-                decqnt[:, c] += (decqnt_local[:, idx] +
-                                 decqnt_nonlocal[:, idx, np.newaxis])
+def get_normalize_paircount(decname, dectype):
+    with DecondReader(decname) as reader:
+        return reader.get_normalize_paircount(dectype)
 
-    if qnttype == Quantity.ec:
-        if nD_unit in Unit.gmx_ec_nD_list:
-            decqnt_unit = "{siemens} {length}$^{{-1}}$".format(
-                    **Unit.default_unit)
-        else:
-            raise UnknownUnitError('nD_unit "{}" cannot be '
-                                   'recognized'.format(nD_unit))
-    elif qnttype == Quantity.vsc or qnttype == Quantity.vel:
-        if nD_unit == Unit.dimless:
-            decqnt_unit = Unit.dimless
-        else:
-            raise UnknownUnitError('nD_unit "{}" cannot be recognized '
-                                   'for {}'.format(nD_unit, qnttype))
-    else:
-        raise Error("Unknown qnttype: {}".format(qnttype))
 
-    if decBins_unit == Unit.gmx_length:
-        decBins *= const.nano
-        decBins_unit = "{length}".format(**Unit.default_unit)
+def get_ec_dec_energy(decname, sep_nonlocal=True, threshold=0):
+    """
+    Return ec_dec_cross_I, ec_dec_cross_I_unit,
+           ec_dec_cross_IL, ec_dec_cross_IL_unit,
+           decBins, decBins_unit, fit, fit_unit
 
-    fit, fit_unit = get_fit(decname)
-    return (decqnt, decqnt_unit, decBins, decBins_unit, fit, fit_unit,
-            decqnt_local[:, :, -1], decqnt_nonlocal)
+    See DecondReader.get_ec_dec_energy for the arguments.
+    """
+    with DecondReader(decname) as reader:
+        return reader.get_ec_dec_energy(sep_nonlocal, threshold)
 
 
-def get_normalize_paircount(decname, dectype):
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        paircount = gid['decPairCount'][...]
-    return paircount / integrate.trapz(paircount)[..., np.newaxis]
+def new_decond(outname, samples, fit, report=True, max_memory=None,
+               num_proc=1, max_lag=None, max_bin=None, cesaro_cache=None,
+               block_average=False, **layout):
+    """
+    max_memory: if given, decCorr and decDCesaro are processed in slabs
+                using about max_memory bytes at a time
+    num_proc: number of worker processes to accumulate samples
+    max_lag, max_bin: if given, only timeLags <= max_lag and
+                      |decBins| <= max_bin[dectype] are read and kept,
+                      max_bin being {DecType: bound or None}
+    cesaro_cache: if given, a CesaroCache to reuse the Cesaro data
+                  of samples integrated before
+    block_average: if True, samples are the corr files of consecutive
+                   blocks of one trajectory, in order, whose errors are
+                   estimated by block averaging instead of as independent
+                   samples
+    layout: chunks, compression, compression_opts, shuffle of the output,
+            and rdcc_nbytes of all files, see CorrFile
+    """
+    with DecondFile(outname, 'w-', **layout) as outfile:
+        outfile._add_sample(samples, fit, report, max_memory, num_proc,
+                            max_lag, max_bin, cesaro_cache, block_average)
+        return outfile.buffer
 
 
-def get_ec_dec_energy(decname, sep_nonlocal=True, threshold=0):
+def extend_decond(outname, decname, samples, fit=None, report=True,
+                  max_memory=None, num_proc=1, max_lag=None, max_bin=None,
+                  cesaro_cache=None, **layout):
     """
-    Return ec_dec_cross_IL, ec_dec_cross_IL_unit, decBins, decBins_unit,
-           fit, fit_unit
-    """
-    dectype = DecType.energy
-    with h5py.File(decname, 'r') as f:
-        gid = f[dectype.value]
-        nummol = f['numMol'][...]
-        charge = f['charge'][...]
-        volume = f['volume'][...]
-        fit = f['fit'][...]
-        temperature = f['temperature'][...]
-        decD = gid['decD'][...]  # L^2 T^-1
-        decBins = gid['decBins'][...]
-        paircount = gid['decPairCount'][...]
-
-    beta = 1 / (const.k * temperature)
-    zz = _zz(charge, nummol)
-    num_moltype, num_pairtype, _ = _numtype(nummol)
-
-    def sep_at_end():
-        nonlocal_idx = np.empty(decD.shape[:-1], dtype=int)
-        for f in range(nonlocal_idx.shape[0]):
-            for t in range(nonlocal_idx.shape[1]):
-                if zz[num_moltype + t] > 0:
-                    nonlocal_idx[f, t] = np.nonzero(
-                            np.invert(np.isnan(decD[f, t, :])))[0][0]
-                else:
-                    nonlocal_idx[f, t] = np.nonzero(
-                            np.invert(np.isnan(decD[f, t, :])))[0][-1]
-        for f in range(nonlocal_idx.shape[0]):
-            for t in range(nonlocal_idx.shape[1]):
-                decD_nonlocal[f, t] = decD[f, t, nonlocal_idx[f, t]]
-        return decD_nonlocal
-
-    def sep_at_edf_max():
-        nonlocal_idx = np.empty(decD.shape[:-1], dtype=int)
-        for f in range(nonlocal_idx.shape[0]):
-            nonlocal_idx[f, :] = np.argmax(paircount, axis=-1)
-        for f in range(nonlocal_idx.shape[0]):
-            for t in range(nonlocal_idx.shape[1]):
-                decD_nonlocal[f, t] = decD[f, t, nonlocal_idx[f, t]]
-        return decD_nonlocal
-
-    decD_nonlocal = np.empty(decD.shape[:-1])
-    if sep_nonlocal:
-        # decD_nonlocal = sep_at_end()
-        decD_nonlocal = sep_at_edf_max()
-    else:
-        decD_nonlocal = np.zeros(decD.shape[:-1])
-
-    ec_nonlocal = (
-            integrate.trapz(paircount) / volume * decD_nonlocal *
-            zz[np.newaxis, num_moltype:] * beta)
-    ec_local = (
-            paircount / volume * (decD - decD_nonlocal[:, :, np.newaxis]) *
-            zz[num_moltype:, np.newaxis] * beta)
-
-    norm_paircount = get_normalize_paircount(decname, dectype)
-    norm_paircount, _ = _symmetrize_array(norm_paircount, decBins)
-    ec_local, decBins = _symmetrize_array(ec_local, decBins)
-
-    ec_local[np.isnan(ec_local)] = 0
-    # filter with threshold
-    # ec_local_masked = np.ma.masked_where(
-    #        np.ones_like(ec_local) *
-    #        norm_paircount[np.newaxis, ...] < threshold,
-    #        ec_local)
-    np.place(ec_local,
-             np.ones_like(ec_local) *
-             norm_paircount[np.newaxis, ...] < threshold,
-             0)
-
-    # reverse the integrate direction for zz > 0 component
-    for i, czz in enumerate(zz[num_moltype:]):
-        if czz > 0:
-            ec_local[:, i, :] = ec_local[:, i, ::-1]
-
-    ec_local = integrate.cumtrapz(ec_local, initial=0)
-
-    ec_dec_cross_IL = ec_local + ec_nonlocal[:, :, np.newaxis]
-    ec_dec_cross_I = np.zeros(
-            (fit.shape[0], num_moltype, ec_dec_cross_IL.shape[-1]))
-    for r in range(num_moltype):
-        for c in range(r, num_moltype):
-            idx = _pairtype_index(r, c, num_moltype)
-            ec_dec_cross_I[:, r] += ec_dec_cross_IL[:, idx]
-            if c > r:
-                ec_dec_cross_I[:, c] += ec_dec_cross_IL[:, idx]
-
-    cc = (1 / const.nano**3 *
-          const.nano**2 / const.pico *
-          const.e**2)
-    ec_dec_cross_IL *= cc
-    ec_dec_cross_IL_unit = "{siemens} {length}$^{{-1}}$".format(
-            **Unit.default_unit)
-    ec_dec_cross_I *= cc
-    ec_dec_cross_I_unit = "{siemens} {length}$^{{-1}}$".format(
-            **Unit.default_unit)
-
-    decBins *= const.calorie
-    decBins_unit = "{energy}".format(
-            **Unit.default_unit)
-
-    fit, fit_unit = get_fit(decname)
-
-    return (ec_dec_cross_I, ec_dec_cross_I_unit,
-            ec_dec_cross_IL, ec_dec_cross_IL_unit,
-            decBins, decBins_unit,
-            fit, fit_unit)
-
-
-def new_decond(outname, samples, fit, report=True):
-    with DecondFile(outname, 'w-') as outfile:
-        outfile._add_sample(samples, fit, report)
+    max_memory: if given, decCorr and decDCesaro are processed in slabs
+                using about max_memory bytes at a time
+    num_proc: number of worker processes to accumulate samples
+    max_lag, max_bin: if given, only timeLags <= max_lag and
+                      |decBins| <= max_bin[dectype] are read and kept,
+                      max_bin being {DecType: bound or None}
+    cesaro_cache: if given, a CesaroCache to reuse the Cesaro data
+                  of samples integrated before
+    layout: chunks, compression, compression_opts, shuffle of the output,
+            and rdcc_nbytes of all files, see CorrFile
+    """
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    # infile stays open until outfile is written,
+    # so that its datasets can be read slab by slab
+    with DecondFile(decname, lazy=True,
+                    rdcc_nbytes=layout.get('rdcc_nbytes')) as infile, \
+            DecondFile(outname, 'w-', **layout) as outfile:
+        outfile.buffer = infile.buffer
+        outfile._add_sample(samples, fit, report, max_memory, num_proc,
+                            max_lag, max_bin, cesaro_cache)
         return outfile.buffer
 
 
-def extend_decond(outname, decname, samples, fit=None, report=True):
-    with DecondFile(outname, 'w-') as outfile:
+def append_decond(decname, samples, fit=None, report=True, max_memory=None,
+                  num_proc=1, max_lag=None, max_bin=None, cesaro_cache=None,
+                  **layout):
+    """
+    Add samples to decname in place, instead of writing a new file
+
+    See extend_decond for the other arguments.
+    """
+    with DecondFile(decname, 'r+', lazy=True, **layout) as decfile:
         if (report):
-            print("Reading decond file: {0}".format(decname))
-        with DecondFile(decname) as infile:
-            outfile.buffer = infile.buffer
-        outfile._add_sample(samples, fit, report)
+            print("Updating decond file: {0}".format(decname))
+        decfile._add_sample(samples, fit, report, max_memory, num_proc,
+                            max_lag, max_bin, cesaro_cache)
+        return decfile.buffer
+
+
+def merge_decond(outname, decnames, fit=None, report=True, **layout):
+    """
+    Merge decond files built from different samples into one
+
+    fit: fit ranges, default to those of the first decond file
+    layout: chunks, compression, compression_opts, shuffle of the output,
+            and rdcc_nbytes of all files, see CorrFile
+    """
+    with DecondFile(outname, 'w-', **layout) as outfile:
+        outfile._add_decond(decnames, fit, report)
         return outfile.buffer
 
 
-def fit_decond(outname, decname, fit, report=True):
-    with DecondFile(outname, 'w-') as outfile:
-        if (report):
-            print("Reading decond file: {0}".format(decname))
-        with DecondFile(decname) as infile:
-            outfile.buffer = infile.buffer
+def fit_decond(outname, decname, fit, report=True, link=False, **layout):
+    """
+    Only the Cesaro data within the fit ranges are read
+
+    link: if True, the unchanged datasets are linked to decname
+          instead of copied, so that outname depends on decname
+    layout: chunks, compression, compression_opts, shuffle of the output,
+            and rdcc_nbytes of all files, see CorrFile
+    """
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    # infile stays open until outfile is written,
+    # so that the unfitted datasets are read only when they are copied
+    with DecondFile(decname, lazy=True, cache=False,
+                    rdcc_nbytes=layout.get('rdcc_nbytes')) as infile, \
+            DecondFile(outname, 'w-', link=link, **layout) as outfile:
+        outfile.buffer = infile.buffer
         outfile._fit_cesaro(fit)
         return outfile.buffer
 
 
-def window_decond(outname, decname, window, report=True):
-    with DecondFile(outname, 'w-') as outfile:
+def refit_decond(decname, fit, report=True, **layout):
+    """
+    Change the fit ranges of decname in place
+
+    Only the Cesaro data within the fit ranges are read, and only fit,
+    nD, nDTotal, decD and their errors are written.
+    """
+    with DecondFile(decname, 'r+', lazy=True, cache=False,
+                    **layout) as decfile:
         if (report):
-            print("Reading decond file: {0}".format(decname))
-        with DecondFile(decname) as infile:
-            outfile.buffer = infile.buffer
+            print("Updating decond file: {0}".format(decname))
+        decfile._fit_cesaro(fit)
+        return decfile.buffer
+
+
+def _scan_grid(timelags, lower, upper, num):
+    """
+    Return up to num distinct time lags evenly spread within [lower, upper]
+    """
+    lower = timelags[1] if lower is None else lower
+    upper = timelags[-1] if upper is None else upper
+    idx = np.searchsorted(timelags, [lower, upper])
+    idx[1] = min(idx[1], timelags.size - 1)
+    return timelags[np.unique(np.linspace(*idx, num=num).round().astype(int))]
+
+
+def _scan_cesaro_data(timeLags, fit_sel, valid, data_cesaro,
+                      data_cesaro_err, num_sample, errname):
+    """
+    Fit data_cesaro over the windows fit_sel, which are those of the
+    window grid where valid is True
+
+    Return slope, slope_err, chi2, q: [valid.shape, data_cesaro.shape[:-1]]
+    nan for invalid windows
+    """
+    sig = None
+    if num_sample > 1:
+        sig = _err_to_std(data_cesaro_err, num_sample)
+    try:
+        _, slope, _, slope_std, chi2, q = fitlinear(
+                timeLags, data_cesaro, sig, ranges=fit_sel)
+    except ZeroStdError:
+        raise Error("{} contains zero within the scanned windows, "
+                    "begin the scan after the first time lag".format(
+                        errname))
+
+    results = []
+    for data in (slope, _std_to_err(slope_std, num_sample), chi2, q):
+        surface = np.full(valid.shape + data.shape[1:], np.nan)
+        surface[valid] = data
+        results.append(surface)
+    return results
+
+
+def _plateau(slope, slope_err, chi2, q, num_point, weighted=True,
+             max_chi2=None, max_q=None, max_rel_err=None):
+    """
+    Return the windows [begin, end] on the plateau of slope [begin, end, ...]
+
+    A window is on the plateau if its slope agrees with those of its
+    neighboring windows within slope_err, and passes max_chi2 (chi2 per
+    degree of freedom), max_q and max_rel_err, for all of the trailing axes.
+    The chi2 and q criteria apply only to weighted fits.
+    """
+    drift = np.full(slope.shape, np.nan)
+    for axis in (0, 1):
+        diff = np.abs(np.diff(slope, axis=axis))
+        lower = [slice(None)] * slope.ndim
+        upper = [slice(None)] * slope.ndim
+        lower[axis] = np.s_[:-1]
+        upper[axis] = np.s_[1:]
+        drift[tuple(lower)] = np.fmax(drift[tuple(lower)], diff)
+        drift[tuple(upper)] = np.fmax(drift[tuple(upper)], diff)
+
+    with np.errstate(invalid='ignore'):
+        plateau = drift <= slope_err
+        if max_rel_err is not None:
+            plateau &= slope_err <= max_rel_err * np.abs(slope)
+        if weighted:
+            dof = (num_point - 2).reshape(
+                    num_point.shape + (1,) * (slope.ndim - 2))
+            if max_chi2 is not None:
+                plateau &= chi2 <= max_chi2 * dof
+            if max_q is not None:
+                plateau &= q <= max_q
+
+    return np.all(plateau.reshape(plateau.shape[:2] + (-1,)), axis=-1)
+
+
+def scan_decond(decname, begin=None, end=None, num=50, dec=False,
+                max_chi2=None, max_q=None, max_rel_err=None, apply=False,
+                outname=None, report=True):
+    """
+    Fit over a grid of fit windows and pick one on the plateau of nDTotal
+
+    begin, end: (lower, upper) of the window begins and ends in the unit
+                of timeLags, default all time lags but the first
+    num: number of the window begins and ends
+    dec: also scan decD, one pair type at a time
+    max_chi2, max_q, max_rel_err: plateau criteria, see _plateau,
+                                  which nDTotal and every nD must pass
+    apply: if True, refit decname in place to the chosen window
+    outname: if given, write the scan surfaces into it
+
+    All windows are fitted at once from the cumulative sums of the Cesaro
+    data. Among the plateau windows, the one of the smallest relative
+    error of nDTotal is chosen.
+
+    Return a dict of the surfaces [begin, end, ...] with 'begin', 'end',
+    'plateau', and 'fit', the chosen [[begin, end]] or None
+    """
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    with DecondFile(decname, lazy=True, cache=False) as f:
+        buf = f.buffer
+        timeLags = buf.timeLags
+        num_sample = buf.numSample
+        dt = timeLags[1] - timeLags[0]
+
+        begins = _scan_grid(timeLags, *(begin or (None, None)), num=num)
+        ends = _scan_grid(timeLags, *(end or (None, None)), num=num)
+        # at least three points to have a chi2
+        valid = ends[np.newaxis, :] - begins[:, np.newaxis] > 2.5 * dt
+        if not np.any(valid):
+            raise Error("No fit window of at least three time lags "
+                        "within begin and end")
+        windows = np.stack(np.broadcast_arrays(
+            begins[:, np.newaxis], ends[np.newaxis, :]), axis=-1)[valid]
+        fit_sel = _fit_to_sel(windows, timeLags)
+
+        num_point = np.zeros(valid.shape, dtype=int)
+        num_point[valid] = [sel.stop - sel.start for sel in fit_sel]
+
+        # only the time lags spanned by the windows are read
+        span = np.s_[min(sel.start for sel in fit_sel):
+                     max(sel.stop for sel in fit_sel)]
+        span_fit_sel = [np.s_[sel.start - span.start:sel.stop - span.start]
+                        for sel in fit_sel]
+
+        surfaces = {'begin': begins, 'end': ends, 'numPoint': num_point}
+        units = {'begin': buf.timeLags_unit, 'end': buf.timeLags_unit}
+
+        def scan_data(data_name, dectype=None, sel=()):
+            b = buf if dectype is None else getattr(buf, dectype.value)
+            return _scan_cesaro_data(
+                    timeLags[span], span_fit_sel, valid,
+                    b._read(data_name + 'Cesaro', np.s_[sel + (..., span)]),
+                    b._read(data_name + 'Cesaro_err',
+                            np.s_[sel + (..., span)]),
+                    num_sample, data_name + 'Cesaro_err')
+
+        plateau = np.ones(valid.shape, dtype=bool)
+        for data_name in ('nDTotal', 'nD'):
+            data = scan_data(data_name)
+            plateau &= _plateau(*data, num_point, num_sample > 1,
+                                max_chi2, max_q, max_rel_err)
+            for key, d in zip(('', '_err', '_chi2', '_q'), data):
+                surfaces[data_name + key] = d
+            units[data_name] = _fit_unit(buf.nCorr_unit)
+            units[data_name + '_err'] = units[data_name]
+
+        if dec:
+            for dectype in DecType:
+                decbuf = getattr(buf, dectype.value)
+                if decbuf is None:
+                    continue
+                data = [scan_data('decD', dectype, (i,))
+                        for i in range(f.num_pairtype)]
+                for key, d in zip(('', '_err', '_chi2', '_q'), zip(*data)):
+                    name = dectype.value + '/decD' + key
+                    surfaces[name] = np.stack(d, axis=2)
+                units[dectype.value + '/decD'] = _fit_unit(
+                        decbuf.decCorr_unit)
+                units[dectype.value + '/decD_err'] = units[
+                        dectype.value + '/decD']
+
+    fit = None
+    if np.any(plateau):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_err = surfaces['nDTotal_err'] / np.abs(surfaces['nDTotal'])
+        rel_err[~plateau] = np.inf
+        i, j = np.unravel_index(np.argmin(rel_err), rel_err.shape)
+        fit = np.array([[begins[i], ends[j]]])
+    surfaces['plateau'] = plateau
+    surfaces['fit'] = fit
+
+    if (report):
+        print("Scanned {} fit windows, {} on the plateau".format(
+            np.count_nonzero(valid), np.count_nonzero(plateau)))
+        if fit is None:
+            print("No fit window on the plateau")
+        else:
+            print("Chosen fit ({}): {} {}".format(
+                units['begin'].decode(), *fit[0]))
+            print("nDTotal ({}): {} +/- {}".format(
+                units['nDTotal'].decode(), surfaces['nDTotal'][i, j],
+                surfaces['nDTotal_err'][i, j]))
+
+    if outname is not None:
+        with h5py.File(outname, 'w-') as outfile:
+            for name, data in surfaces.items():
+                if data is not None:
+                    outfile[name] = data
+                    if name in units:
+                        outfile[name].attrs['unit'] = units[name]
+        if (report):
+            print("Scan surfaces: {}".format(outname))
+
+    if apply:
+        if fit is None:
+            raise Error("No fit window on the plateau to apply")
+        refit_decond(decname, fit, report)
+
+    return surfaces
+
+
+def window_decond(outname, decname, window, report=True, **layout):
+    """
+    Merge the bins of decname into outname
+
+    window: {dectype: window}, see _window_groups for the windows,
+            such as an integer, bin edges, ('log', num), or ('equal', num)
+    layout: chunks, compression, compression_opts, shuffle of the output,
+            and rdcc_nbytes of all files, see CorrFile
+
+    decname is read lazily, so that decCorr and decDCesaro are read
+    block by block while merged
+    """
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    with DecondFile(decname, lazy=True,
+                    rdcc_nbytes=layout.get('rdcc_nbytes')) as infile, \
+            DecondFile(outname, 'w-', **layout) as outfile:
+        outfile.buffer = infile.buffer
         outfile._change_window(window)
         return outfile.buffer
 
 
+def sweep_window_decond(outname, decname, widths, dectypes=None,
+                        report=True, block=None):
+    """
+    Merge the bins of decname by each of the integer windows widths,
+    all from the cumulative sums over the bins of one pass of the data,
+    and write them to the groups <dectype>/<width> of outname
+
+    widths: integer windows, see _window_groups, where the even ones are
+            skipped for energy
+    dectypes: DecTypes swept, default to all those of decname
+    block: number of time lags read at a time,
+           default to use about 8 MB of scratch
+
+    The data are merged as window_decond does, with the same errors.
+
+    Return {dectype: widths written}
+    """
+    def cum_sum(data, axis):
+        """
+        Return the cumulative sums of data along axis, prepended by zero,
+        and those of the number of nan, which are summed as zero
+        """
+        def prepend_zero(cum):
+            shape = list(cum.shape)
+            shape[axis] = 1
+            return np.concatenate((np.zeros(shape), cum), axis=axis)
+
+        nan = np.isnan(data)
+        return (prepend_zero(np.cumsum(np.where(nan, 0, data), axis=axis)),
+                prepend_zero(np.cumsum(nan, axis=axis)))
+
+    def group_sum(cum, bounds, axis):
+        """
+        Return the sums over the groups [bounds[0], bounds[1]) along axis,
+        which are nan if any data of a group is nan
+        """
+        def diff(c):
+            return (np.take(c, bounds[1], axis=axis) -
+                    np.take(c, bounds[0], axis=axis))
+
+        sums, nan_count = cum
+        return np.where(diff(nan_count) > 0, np.nan, diff(sums))
+
+    def group_err(cum_var, bounds, axis):
+        # the sums of squares may be slightly negative by rounding
+        return np.sqrt(np.maximum(group_sum(cum_var, bounds, axis), 0))
+
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    swept = {}
+    with DecondFile(decname, lazy=True, cache=False) as infile, \
+            h5py.File(outname, 'w-') as outfile:
+        buf = infile.buffer
+        outfile['timeLags'] = buf.timeLags
+        outfile['timeLags'].attrs['unit'] = buf.timeLags_unit
+        outfile['fit'] = buf.fit
+        outfile['fit'].attrs['unit'] = buf.timeLags_unit
+
+        for dectype in (DecType if dectypes is None else dectypes):
+            decbuf = getattr(buf, dectype.value)
+            if decbuf is None:
+                if dectypes is None:
+                    continue
+                raise Error("{} does not have {} data".format(
+                    decname, dectype.value))
+
+            # [begin, end) of the bins of each group of each width
+            decBins = decbuf.decBins
+            paircount = decbuf.decPairCount
+            bounds = {}
+            for width in widths:
+                if dectype is DecType.energy and width % 2 == 0:
+                    continue
+                keep, starts = _window_groups(decBins, paircount, width,
+                                              dectype)
+                begins = keep.start + starts
+                bounds[width] = (begins, np.append(begins[1:], keep.stop))
+            if (report):
+                print("Merging {} bins by windows: {}".format(
+                    dectype.value, ' '.join(str(w) for w in bounds)))
+
+            if decbuf._has('decPairCount_sum'):
+                weight = decbuf.decPairCount_sum
+            else:
+                weight = paircount
+            cum_weight = cum_sum(weight, 1)
+            cum_bins = cum_sum(decBins, 0)
+            cum_paircount = cum_sum(paircount, 1)
+            cum_paircount_var = cum_sum(np.square(decbuf.decPairCount_err), 1)
+            cum_decD = cum_sum(decbuf.decD * weight, 2)
+            cum_decD_var = cum_sum(np.square(decbuf.decD_err * weight), 2)
+
+            num_time = buf.timeLags.size
+            names = ('decCorr', 'decDCesaro')
+            sum_weights = {}
+            out = {}
+            for width, bound in bounds.items():
+                group = outfile.create_group('{}/{}'.format(dectype.value,
+                                                            width))
+                sum_weight = group_sum(cum_weight, bound, 1)
+                sum_weights[width] = sum_weight[..., np.newaxis]
+                group['decBins'] = (group_sum(cum_bins, bound, 0) /
+                                    (bound[1] - bound[0]))
+                group['decBins'].attrs['unit'] = decbuf.decBins_unit
+                group['decPairCount'] = group_sum(cum_paircount, bound, 1)
+                group['decPairCount_err'] = group_err(cum_paircount_var,
+                                                      bound, 1)
+                group['decD'] = group_sum(cum_decD, bound, 2) / sum_weight
+                group['decD_err'] = (group_err(cum_decD_var, bound, 2) /
+                                     sum_weight)
+                group['decD'].attrs['unit'] = decbuf.decD_unit
+                for name in names:
+                    for suffix in ('', '_err'):
+                        out[width, name + suffix] = group.create_dataset(
+                                name + suffix,
+                                sum_weight.shape + (num_time,), np.float64)
+                    group[name].attrs['unit'] = getattr(decbuf,
+                                                        name + '_unit')
+
+            time_block = block
+            if time_block is None:
+                time_block = max(1, (1 << 20) // weight.size)
+            for t in range(0, num_time, time_block):
+                sel = np.s_[:, :, t:t+time_block]
+                for name in names:
+                    w = weight[..., np.newaxis]
+                    cum = cum_sum(decbuf._read(name, sel) * w, 1)
+                    cum_var = cum_sum(np.square(
+                        decbuf._read(name + '_err', sel) * w), 1)
+                    for width, bound in bounds.items():
+                        out[width, name][sel] = (group_sum(cum, bound, 1) /
+                                                 sum_weights[width])
+                        out[width, name + '_err'][sel] = (
+                                group_err(cum_var, bound, 1) /
+                                sum_weights[width])
+            swept[dectype] = list(bounds)
+
+    if (report):
+        print("Windows: {}".format(outname))
+    return swept
+
+
+def _fit_slopes(timeLags, fit_sel, data_cesaro, sig):
+    """
+    Return the slopes of data_cesaro over each range of fit_sel,
+    nan for the ranges where sig contains zero
+
+    Return [fit, data_cesaro.shape[:-1]]
+    """
+    try:
+        return fitlinear(timeLags, data_cesaro, sig, ranges=fit_sel)[1]
+    except ZeroStdError:
+        pass  # fit range by range to keep the others
+    slopes = np.full((len(fit_sel),) + data_cesaro.shape[:-1], np.nan)
+    for i, sel in enumerate(fit_sel):
+        try:
+            slopes[i] = fitlinear(timeLags[sel], data_cesaro[..., sel],
+                                  None if sig is None else sig[..., sel])[1]
+        except ZeroStdError:
+            pass
+    return slopes
+
+
+def _sample_slopes(jobs, num_total, report, span, fit_sel, sigs,
+                   rdcc_nbytes=None, cesaro_cache=None):
+    """
+    Reduce each corr sample to the slopes of its Cesaro data over the
+    ranges fit_sel of the time lags span, possibly in a worker process
+
+    jobs: list of (index, filename, sel, {dectype: sel_dec}),
+          see _accumulate_samples
+    sigs: {name: standard deviations of the Cesaro data over span}
+          for nD, nDTotal and <dectype>/decD, or None for unweighted fits
+
+    Return a list of {name: slopes} of each sample, which also include
+    <dectype>/decPairCount
+    """
+    slopes = []
+    for idx, sample, sel, dec_sels in jobs:
+        if (report):
+            print("Reading {0} of {1} corr files: {2}".format(
+                idx+1, num_total, sample))
+        with CorrFile(sample, lazy=True, rdcc_nbytes=rdcc_nbytes) as cf:
+            if cesaro_cache is not None:
+                cesaro_cache.load(cf, sel)
+            # nothing after the span is integrated
+            cf._shrink_buffer(_sub_sel(sel, np.s_[0:span.stop]), dec_sels)
+            cf._cal_cesaro()
+            buf = cf.buffer
+            timeLags = buf.timeLags[span]
+
+            def fit(b, data_name, name):
+                return _fit_slopes(
+                        timeLags, fit_sel,
+                        b._read(data_name + 'Cesaro', np.s_[..., span]),
+                        sigs[name])
+
+            sample_slopes = {'nD': fit(buf, 'nD', 'nD'),
+                             'nDTotal': fit(buf, 'nDTotal', 'nDTotal')}
+            for dectype in DecType:
+                decbuf = getattr(buf, dectype.value)
+                if decbuf is not None:
+                    sample_slopes[dectype.value + '/decD'] = fit(
+                            decbuf, 'decD', dectype.value + '/decD')
+                    sample_slopes[dectype.value + '/decPairCount'] = \
+                        np.asarray(decbuf.decPairCount, dtype=np.float64)
+            slopes.append(sample_slopes)
+    return slopes
+
+
+def _resample_slopes(counts, slopes):
+    """
+    Return the slopes of the resamples {name: [resample, ...]}
+
+    counts: [resample, sample] times each sample is drawn
+    slopes: {name: [sample, ...]} from _sample_slopes
+
+    Since the Cesaro data are fitted with fixed standard deviations,
+    the slope of the mean is the mean of the slopes, where decD is
+    weighted by decPairCount as the Cesaro data are.
+    """
+    results = {}
+    for name, data in slopes.items():
+        group, _, data_name = name.rpartition('/')
+        if data_name == 'decPairCount':
+            continue
+        if group:
+            weight = slopes[group + '/decPairCount'][:, np.newaxis]
+            total = np.tensordot(counts, np.where(weight > 0,
+                                                  weight * data, 0), axes=1)
+            sum_weight = np.tensordot(counts, weight, axes=1)
+        else:
+            total = np.tensordot(counts, data, axes=1)
+            sum_weight = np.sum(counts, axis=1).reshape(
+                    (-1,) + (1,) * (data.ndim - 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            results[name] = total / sum_weight
+    return results
+
+
+def resample_decond(outname, decname, samples=None, method='bootstrap',
+                    num_resample=1000, confidence=0.95, seed=None,
+                    slopename=None, report=True, num_proc=1,
+                    cesaro_cache=None, rdcc_nbytes=None):
+    """
+    Estimate the uncertainties of nD, nDTotal, decD and the quantity by
+    resampling the corr samples of decname, and write them to outname
+
+    samples: the corr files decname is built from
+    method: 'bootstrap' for num_resample resamples drawn with replacement,
+            reporting their standard deviation as *_err and the
+            confidence interval as *_lower and *_upper, or 'jackknife'
+            for the resamples leaving out one sample each, reporting
+            the jackknife error as *_err
+    seed: of the random resamples
+    slopename: an earlier output of resample_decond, whose slopes of the
+               samples are reused instead of reading the samples
+    num_proc: number of processes to read the samples and to resample
+
+    Each sample is read once and reduced to its Cesaro slopes over the
+    fit ranges of decname, fitted with the standard deviations of
+    decname. The slopes of all resamples are then their weighted means,
+    see _resample_slopes, and are kept in the samples group of outname.
+
+    Return a dict of the results, with 'fit'
+    """
+    if (report):
+        print("Reading decond file: {0}".format(decname))
+    with DecondFile(decname, lazy=True, cache=False,
+                    rdcc_nbytes=rdcc_nbytes) as f:
+        buf = f.buffer
+        fit = buf.fit
+        fit_sel = f.fit_sel
+        num_sample = int(buf.numSample)
+        decBins = {dectype: getattr(buf, dectype.value).decBins
+                   for dectype in DecType
+                   if getattr(buf, dectype.value) is not None}
+        units = {'fit': buf.fit_unit, 'nD': buf.nD_unit,
+                 'nDTotal': buf.nDTotal_unit}
+        for dectype in decBins:
+            decbuf = getattr(buf, dectype.value)
+            units[dectype.value + '/decD'] = decbuf.decD_unit
+            units[dectype.value + '/decBins'] = decbuf.decBins_unit
+
+        if slopename is not None:
+            if (report):
+                print("Reading sample slopes: {0}".format(slopename))
+            with h5py.File(slopename, 'r') as sf:
+                if (not np.array_equal(sf['fit'][...], fit) or
+                        any(not np.array_equal(sf[dectype.value +
+                                                  '/decBins'][...], bins)
+                            for dectype, bins in decBins.items())):
+                    raise Error("The fit or decBins of " + slopename +
+                                " differ from those of " + decname)
+                slopes = {}
+
+                def read(name, obj):
+                    if isinstance(obj, h5py.Dataset):
+                        slopes[name] = obj[...]
+                sf['samples'].visititems(read)
+        else:
+            if samples is None:
+                raise Error("Either samples or slopename is required")
+            if not isinstance(samples, list):
+                samples = [samples]
+            if len(samples) != num_sample:
+                raise Error("{} holds {} samples, but {} are given".format(
+                    decname, num_sample, len(samples)))
+
+            # only the time lags spanned by the fit ranges are read
+            span = np.s_[min(sel.start for sel in fit_sel):
+                         max(sel.stop for sel in fit_sel)]
+            span_fit_sel = [np.s_[sel.start - span.start:
+                                  sel.stop - span.start]
+                            for sel in fit_sel]
+
+            axes = [(buf.timeLags, decBins)]
+            axes += [_read_axes(sample) for sample in samples]
+            t_sels, dec_sels = _get_common_grid(axes)
+            if (t_sels[0].start != 0 or t_sels[0].stop < span.stop or
+                    any(sel != np.s_[0:decBins[dectype].size]
+                        for dectype, sel in dec_sels[0].items())):
+                raise Error("The samples do not cover the grid of " +
+                            decname)
+
+            def sig(b, data_name):
+                if num_sample == 1:
+                    return None
+                return _err_to_std(
+                        b._read(data_name + 'Cesaro_err', np.s_[..., span]),
+                        num_sample)
+
+            sigs = {'nD': sig(buf, 'nD'), 'nDTotal': sig(buf, 'nDTotal')}
+            for dectype in decBins:
+                sigs[dectype.value + '/decD'] = sig(
+                        getattr(buf, dectype.value), 'decD')
+
+            jobs = [list(zip(idx, [samples[i] for i in idx],
+                             [t_sels[i+1] for i in idx],
+                             [dec_sels[i+1] for i in idx]))
+                    for idx in np.array_split(np.arange(len(samples)),
+                                              min(num_proc, len(samples)))]
+            args = ([len(samples)] * len(jobs), [report] * len(jobs),
+                    [span] * len(jobs), [span_fit_sel] * len(jobs),
+                    [sigs] * len(jobs), [rdcc_nbytes] * len(jobs),
+                    [cesaro_cache] * len(jobs))
+            if num_proc > 1:
+                with ProcessPoolExecutor(num_proc) as executor:
+                    parts = list(executor.map(_sample_slopes, jobs, *args))
+            else:
+                parts = [_sample_slopes(jobs[0], *(a[0] for a in args))]
+            sample_slopes = [s for part in parts for s in part]
+            slopes = {name: np.stack([s[name] for s in sample_slopes])
+                      for name in sample_slopes[0]}
+
+    with DecondReader(decname) as reader:
+        nD2qnt = reader._nD_to_qnt_const()
+        zz = reader._zz()
+        units['qnt'] = units['qntTotal'] = np.string_(
+                reader.get_quantity()[4])
+
+    num_sample = slopes['nD'].shape[0]
+    if num_sample < 2:
+        raise Error("At least two samples are required to resample")
+    if method == 'bootstrap':
+        rng = np.random.default_rng(seed)
+        counts = rng.multinomial(num_sample, np.full(num_sample,
+                                                     1 / num_sample),
+                                 size=num_resample)
+    elif method == 'jackknife':
+        counts = 1 - np.eye(num_sample, dtype=int)
+    else:
+        raise Error("Unknown resampling method: {}".format(method))
+
+    def add_quantity(data):
+        data['qnt'] = data['nD'] * zz * nD2qnt
+        data['qntTotal'] = data['nDTotal'] * nD2qnt
+        return data
+
+    # each process resamples a block of the resamples at once
+    blocks = np.array_split(counts, min(num_proc, len(counts)))
+    if num_proc > 1:
+        with ProcessPoolExecutor(num_proc) as executor:
+            parts = list(executor.map(_resample_slopes, blocks,
+                                      [slopes] * len(blocks)))
+    else:
+        parts = [_resample_slopes(counts, slopes)]
+    resamples = add_quantity({name: np.concatenate([p[name] for p in parts])
+                              for name in parts[0]})
+    estimate = add_quantity(_resample_slopes(
+        np.ones((1, num_sample), dtype=int), slopes))
+
+    results = {'fit': fit}
+    for name, data in resamples.items():
+        results[name] = estimate[name][0]
+        if method == 'bootstrap':
+            results[name + '_err'] = np.std(data, axis=0, ddof=1)
+            results[name + '_lower'], results[name + '_upper'] = \
+                np.percentile(data, [50 * (1 - confidence),
+                                     50 * (1 + confidence)], axis=0)
+        else:
+            results[name + '_err'] = np.sqrt(
+                    (num_sample - 1) / num_sample *
+                    np.sum(np.square(data - np.mean(data, axis=0)), axis=0))
+
+    if (report):
+        print("{} {} resamples of {} samples".format(
+            len(counts), method, num_sample))
+        for i, fit_ in enumerate(fit):
+            print("Fit ({}): {} {}".format(units['fit'].decode(), *fit_))
+            print("nDTotal ({}): {} +/- {}".format(
+                units['nDTotal'].decode(), results['nDTotal'][i],
+                results['nDTotal_err'][i]))
+            print("qntTotal ({}): {} +/- {}".format(
+                units['qntTotal'].decode(), results['qntTotal'][i],
+                results['qntTotal_err'][i]))
+
+    with h5py.File(outname, 'w-') as outfile:
+        outfile.attrs['method'] = np.string_(method)
+        outfile.attrs['numResample'] = len(counts)
+        if method == 'bootstrap':
+            outfile.attrs['confidence'] = confidence
+        for dectype, bins in decBins.items():
+            outfile[dectype.value + '/decBins'] = bins
+        for name, data in results.items():
+            outfile[name] = data
+        for name, data in slopes.items():
+            outfile['samples/' + name] = data
+        for name, unit in units.items():
+            for suffix in ('', '_err', '_lower', '_upper'):
+                if name + suffix in outfile:
+                    outfile[name + suffix].attrs['unit'] = unit
+    if (report):
+        print("Resampled errors: {}".format(outname))
+
+    return results
+
+
+def compare_decond(decname, othername, report=True):
+    """
+    Return the largest deviations of othername from decname, such as
+    the same samples stored in another precision profile
+
+    Return {name: (max_abs, max_rel, num_nan)} of nD, nDTotal, and decD,
+    decCorr, decDCesaro and their errors of each dectype, where max_rel
+    is max_abs relative to the largest magnitude in decname, and num_nan
+    is the number of elements that are nan in only one of them
+
+    The data are read one fit or type at a time.
+    """
+    names = ['nD', 'nD_err', 'nDTotal', 'nDTotal_err']
+    deviations = {}
+    with h5py.File(decname, 'r') as f, h5py.File(othername, 'r') as other:
+        for dectype in DecType:
+            if dectype.value in f:
+                names += [dectype.value + '/' + name for name in (
+                    'decD', 'decD_err', 'decCorr', 'decCorr_err',
+                    'decDCesaro', 'decDCesaro_err')]
+        for name in names:
+            if name not in other or other[name].shape != f[name].shape:
+                raise Error("{} of {} and {} are not of the same "
+                            "shape".format(name, decname, othername))
+            max_abs = max_ref = 0.0
+            num_nan = 0
+            for i in range(f[name].shape[0]):
+                data = _read_dataset(f[name], np.s_[i:i+1])
+                other_data = _read_dataset(other[name], np.s_[i:i+1])
+                nan = np.isnan(data)
+                other_nan = np.isnan(other_data)
+                num_nan += np.count_nonzero(nan != other_nan)
+                valid = ~(nan | other_nan)
+                with np.errstate(invalid='ignore'):
+                    max_abs = max(max_abs, np.max(np.abs(data - other_data),
+                                                  initial=0, where=valid))
+                max_ref = max(max_ref, np.max(np.abs(data), initial=0,
+                                              where=valid))
+            deviations[name] = (max_abs,
+                                max_abs / max_ref if max_ref > 0 else 0.0,
+                                num_nan)
+
+    if (report):
+        print("{:<30} {:<24} {:<24} {:<}".format(
+            'Data', 'Max deviation', 'Max relative deviation', 'Nan diff'))
+        for name, (max_abs, max_rel, num_nan) in deviations.items():
+            print("{:<30} {:<24} {:<24} {:<}".format(
+                name, str(max_abs), str(max_rel), num_nan))
+
+    return deviations
+
+
 def report_decond(decname):
     print()
 
@@ -2004,3 +4752,158 @@ def report_decond(decname):
             print()
 
     print()
+
+
+def _read_axis_header(dataset):
+    """
+    Return begin, end, width, size of an evenly spaced axis dataset,
+    reading only its first two and last elements
+    """
+    return {'begin': float(dataset[0]), 'end': float(dataset[-1]),
+            'width': float(dataset[1] - dataset[0]), 'size': dataset.size}
+
+
+def _read_header(name):
+    """
+    Return the header of a corr or decond file as a dict of plain values,
+    reading only its attributes and small datasets
+    """
+    try:
+        with h5py.File(name, 'r') as f:
+            attrs = f.attrs
+            header = {
+                'file': name,
+                'type': attrs['type'].decode() if 'type' in attrs else '',
+                'version': (attrs['version'].decode()
+                            if 'version' in attrs else ''),
+                'quantity': (attrs[Quantity.key].decode()
+                             if Quantity.key in attrs else Quantity.ec),
+                'numMol': f['numMol'][...].tolist(),
+                'charge': f['charge'][...].tolist(),
+                'numSample': (int(f['numSample'][...])
+                              if 'numSample' in f else 1),
+                'timeLags': _read_axis_header(f['timeLags'])}
+            for dectype in DecType:
+                if dectype.value in f:
+                    header[dectype.value] = _read_axis_header(
+                            f[dectype.value]['decBins'])
+        return header
+    except (OSError, KeyError, IndexError) as e:
+        return {'file': name, 'error': str(e)}
+
+
+def _grid_key(axis):
+    """
+    Return the width and the offset in units of width of an axis header,
+    which are the same for axes sharing a common grid
+    """
+    width = float('{:.6g}'.format(axis['width']))
+    offset = round(np.mod(axis['begin'], axis['width']) / axis['width'], 6)
+    return width, offset % 1.0
+
+
+def _common_axis(axes):
+    """
+    Return the header of the intersection of axis headers on a common grid
+    """
+    width = axes[0]['width']
+    begin = max(axis['begin'] for axis in axes)
+    end = min(axis['end'] for axis in axes)
+    size = int(round((end - begin) / width)) + 1 if end >= begin else 0
+    return {'begin': begin, 'end': end, 'width': width, 'size': size}
+
+
+def inspect_files(names, num_proc=1):
+    """
+    Group corr or decond files that can be aggregated together
+
+    Files of a group have the same quantity, numMol, charge, major
+    version, and timeLags and decBins on common grids. Only the headers
+    are read, in num_proc processes.
+
+    Return groups, errors
+    groups: list of dicts with the files of each group and the grid
+            intersection they would produce
+    errors: list of {'file', 'error'} of the unreadable files
+    """
+    if num_proc > 1:
+        with ProcessPoolExecutor(num_proc) as executor:
+            headers = list(executor.map(
+                _read_header, names,
+                chunksize=max(1, len(names) // (num_proc * 4))))
+    else:
+        headers = [_read_header(name) for name in names]
+
+    groups = {}
+    errors = []
+    for header in headers:
+        if 'error' in header:
+            errors.append(header)
+            continue
+        key = (header['quantity'], tuple(header['numMol']),
+               tuple(header['charge']), header['version'].split('.')[0],
+               _grid_key(header['timeLags'])) + tuple(
+                       (dectype, _grid_key(header[dectype.value]))
+                       for dectype in DecType if dectype.value in header)
+        groups.setdefault(key, []).append(header)
+
+    results = []
+    for i, members in enumerate(groups.values()):
+        first = members[0]
+        group = {'group': i,
+                 'numFiles': len(members),
+                 'numSample': sum(h['numSample'] for h in members),
+                 'type': sorted({h['type'] for h in members}),
+                 'version': sorted({h['version'] for h in members}),
+                 'quantity': first['quantity'],
+                 'numMol': first['numMol'],
+                 'charge': first['charge'],
+                 'timeLags': _common_axis([h['timeLags'] for h in members])}
+        for dectype in DecType:
+            if dectype.value in first:
+                group[dectype.value] = _common_axis(
+                        [h[dectype.value] for h in members])
+        group['files'] = [h['file'] for h in members]
+        results.append(group)
+
+    return results, errors
+
+
+def report_inspect(names, form='json', num_proc=1, out=None):
+    """
+    Write the compatibility table of inspect_files to out, default stdout
+
+    form: 'json', or 'csv' with one row per group or unreadable file
+    """
+    if out is None:
+        out = sys.stdout
+    groups, errors = inspect_files(names, num_proc)
+
+    if form == 'json':
+        json.dump({'groups': groups, 'errors': errors}, out, indent=2)
+        out.write('\n')
+    elif form == 'csv':
+        axes = ['timeLags'] + [dectype.value for dectype in DecType]
+        fields = (['group', 'numFiles', 'numSample', 'type', 'version',
+                   'quantity', 'numMol', 'charge'] +
+                  ['{}_{}'.format(axis, item) for axis in axes
+                   for item in ('width', 'begin', 'end', 'size')] +
+                  ['files', 'error'])
+        writer = csv.DictWriter(out, fields)
+        writer.writeheader()
+        for group in groups:
+            row = {}
+            for key, value in group.items():
+                if isinstance(value, dict):
+                    for item, v in value.items():
+                        row['{}_{}'.format(key, item)] = v
+                elif isinstance(value, list):
+                    row[key] = ' '.join(str(v) for v in value)
+                else:
+                    row[key] = value
+            writer.writerow(row)
+        for error in errors:
+            writer.writerow({'files': error['file'],
+                             'error': error['error']})
+    else:
+        raise Error("Unknown form: {}".format(form))
@@ -1,8 +1,15 @@
 import numpy as np
 from .. import analyze as da
 from scipy import stats
+import scipy.integrate as integrate
+import scipy.interpolate as interpolate
 import os
 import os.path
+import shutil
+import io
+import contextlib
+import json
+import tracemalloc
 import h5py
 
 
@@ -25,6 +32,35 @@ def test_get_inner_sel():
     print("test_get_inner_sel: pass")
 
 
+def test_pair_type_index():
+    print("test_pair_type_index: starting...")
+    num_moltype = 4
+    index = da.pair_type_index(num_moltype)
+    assert(da.pair_type_index(num_moltype) is index)
+    charge = np.array([2, -1, 1, -2])
+    nummol = np.array([10, 20, 10, 5])
+    zz = index.zz(charge)
+    nummolpair = index.nummolpair(nummol)
+    data = np.random.rand(3, index.num_pairtype, 5)
+    moltype_data = np.zeros((3, num_moltype, 5))
+    for r in range(num_moltype):
+        assert(zz[r] == charge[r]**2)
+        assert(index.ww[r] == 1)
+        for c in range(r, num_moltype):
+            idx = da._pairtype_index(r, c, num_moltype)
+            assert(index.index[r, c] == index.index[c, r] == idx)
+            assert((index.moltype1[idx], index.moltype2[idx]) == (r, c))
+            assert(zz[num_moltype + idx] == charge[r] * charge[c])
+            assert(index.ww[num_moltype + idx] == (1 if r == c else 2))
+            assert(nummolpair[idx] == (nummol[r] * (nummol[c] - 1)
+                                       if r == c else nummol[r] * nummol[c]))
+            moltype_data[:, r] += data[:, idx]
+            if r != c:
+                moltype_data[:, c] += data[:, idx]
+    assert(np.allclose(index.to_moltype(data, axis=1), moltype_data))
+    print("test_pair_type_index: pass")
+
+
 def test_fitlinear():
     print("test_fitlinear: starting...")
     x = np.arange(10)
@@ -51,9 +87,61 @@ def test_fitlinear():
                                    (0., 0., 0.),
                                    (1., 1., 1.)))))
 
+    # many ranges at once agree with fitting range by range
+    x = np.linspace(0.1, 50, 200)
+    y = np.random.rand(3, 2, x.size).cumsum(axis=-1)
+    sig = 0.1 + np.random.rand(3, 2, x.size).cumsum(axis=-1)
+    ranges = [np.s_[0:200], np.s_[20:60], np.s_[150:200], np.s_[90:93]]
+    y[1, 1, 160] = np.nan
+    for s in (None, sig):
+        ret = da.fitlinear(x, y, s, ranges=ranges)
+        for i, r in enumerate(ranges):
+            ret_r = da.fitlinear(x[r], y[..., r],
+                                 None if s is None else s[..., r])
+            for v, v_r in zip(ret, ret_r):
+                np.testing.assert_allclose(
+                        v[i], v_r, rtol=1e-6,
+                        atol=1e-6 * np.nanmax(np.abs(v_r)))
+
     print("test_fitlinear: pass")
 
 
+def test_welford_accumulator():
+    print("test_welford_accumulator: starting...")
+    samples = np.random.rand(6, 3, 4, 5)
+    weights = np.random.rand(6, 3, 4) + 0.5
+
+    accum = da.WelfordAccumulator(samples[0].copy(), np.zeros((3, 4, 5)), 1)
+    for sample in samples[1:]:
+        accum.add(sample)
+    assert(np.allclose(accum.mean, np.mean(samples, axis=0)))
+    assert(np.allclose(accum.m2, np.var(samples, axis=0) * len(samples)))
+    assert(np.allclose(accum.err(), stats.sem(samples, axis=0)))
+
+    accum = da.WelfordAccumulator(samples[0].copy(), np.zeros((3, 4, 5)), 1,
+                                  weights[0])
+    for sample, weight in zip(samples[1:], weights[1:]):
+        accum.add(sample, weight)
+    mean = np.average(samples, axis=0, weights=weights[..., np.newaxis] *
+                      np.ones(samples.shape))
+    assert(np.allclose(accum.mean, mean))
+    assert(np.allclose(accum.m2, np.sum(weights[..., np.newaxis] *
+                                        (samples - mean)**2, axis=0)))
+    assert(np.allclose(accum.sum_weight, np.sum(weights, axis=0)))
+
+    # no temporaries of the data size are allocated
+    sample = np.random.rand(40, 50, 100)
+    weight = np.random.rand(40, 50)
+    accum = da.WelfordAccumulator(sample.copy(), np.zeros(sample.shape), 1,
+                                  weight)
+    tracemalloc.start()
+    accum.add(sample, weight)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert(peak < sample.nbytes / 8)
+    print("test_welford_accumulator: pass")
+
+
 def rand_c5(filename, nummoltype, timeLags=None, base_timeLags=None,
             r_decbins=None, base_r_decbins=None,
             e_decbins=None, base_e_decbins=None,
@@ -480,9 +568,489 @@ def test_extend_decond():
     print("test_extend_decond: pass")
 
 
+def assert_same_datasets(name1, name2):
+    with h5py.File(name1, 'r') as f1, h5py.File(name2, 'r') as f2:
+        def compare(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                np.testing.assert_allclose(obj[...], f2[name][...])
+        f1.visititems(compare)
+
+
+decond_slabs = ['decond_slabs_test.d5', 'decond_extend_slabs_test.d5',
+                'decond_zero_test.d5', 'decond_slabs_zero_test.d5']
+
+
+def test_slab_decond():
+    print("test_slab_decond: starting...")
+    for file in decond_slabs:
+        if os.path.exists(file):
+            os.remove(file)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+
+    # smallest slabs: one [time] row at a time
+    da.new_decond(decond_slabs[0], testfile, fit, max_memory=1)
+    assert_same_datasets(decondtest, decond_slabs[0])
+
+    try:
+        da.extend_decond(decond_slabs[1], decondtest, extend_file,
+                         max_memory=1000)
+    except da.FitRangeError:
+        print("  Extension failed: FitRangeError occurred\n"
+              "  Ignore the second part of this test")
+    else:
+        assert_same_datasets(decond_extend[0], decond_slabs[1])
+
+    # zero errors are warned once per dataset and fit range, not per slab
+    outs = []
+    for file, max_memory in zip(decond_slabs[2:], (None, 1)):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            da.new_decond(file, testfile, [[0, 2], [2, 4]],
+                          max_memory=max_memory, report=False)
+        outs.append(out.getvalue())
+    assert(outs[0].count("Warning!!") > 0)
+    assert(outs[0] == outs[1])
+    print("test_slab_decond: pass")
+
+
+decond_parallel = ['decond_parallel_test.d5',
+                   'decond_extend_parallel_test.d5']
+
+
+def test_parallel_decond():
+    print("test_parallel_decond: starting...")
+    for file in decond_parallel:
+        if os.path.exists(file):
+            os.remove(file)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+
+    da.new_decond(decond_parallel[0], testfile, fit, num_proc=2)
+    assert_same_datasets(decondtest, decond_parallel[0])
+
+    try:
+        da.extend_decond(decond_parallel[1], decondtest, extend_file,
+                         num_proc=2)
+    except da.FitRangeError:
+        print("  Extension failed: FitRangeError occurred\n"
+              "  Ignore the second part of this test")
+    else:
+        assert_same_datasets(decond_extend[0], decond_parallel[1])
+    print("test_parallel_decond: pass")
+
+
+decond_cache = ['decond_cache_test.d5', 'decond_cache_slabs_test.d5',
+                'decond_cache_parallel_test.d5',
+                'decond_cache_version_test.d5']
+cesaro_cache_dir = 'cesaro_cache_test'
+
+
+def test_cesaro_cache():
+    print("test_cesaro_cache: starting...")
+    x = np.linspace(0, 2, 50)
+    y = np.random.rand(3, 7, x.size)
+    cesaro = integrate.cumtrapz(integrate.cumtrapz(y, x, initial=0), x,
+                                initial=0)
+    assert(np.array_equal(da._cesaro_integrate(y, x), cesaro))
+    assert(np.array_equal(da._cesaro_integrate(y, x, block=2), cesaro))
+    da._cesaro_integrate(y, x, out=y, block=5)
+    assert(np.array_equal(y, cesaro))
+
+    for file in decond_cache:
+        if os.path.exists(file):
+            os.remove(file)
+    if os.path.exists(cesaro_cache_dir):
+        shutil.rmtree(cesaro_cache_dir)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+
+    cache = da.CesaroCache(cesaro_cache_dir)
+    da.new_decond(decond_cache[0], testfile, fit, cesaro_cache=cache)
+    assert_same_datasets(decondtest, decond_cache[0])
+    entries = [e for e in os.listdir(cesaro_cache_dir) if e.endswith('.h5')]
+    assert(len(entries) == len(testfile))
+
+    # from the cache
+    da.new_decond(decond_cache[1], testfile, fit, max_memory=1,
+                  cesaro_cache=cache)
+    assert_same_datasets(decondtest, decond_cache[1])
+    da.new_decond(decond_cache[2], testfile, fit, num_proc=2,
+                  cesaro_cache=cache)
+    assert_same_datasets(decondtest, decond_cache[2])
+
+    # entries of another version are integrated again
+    for entry in entries:
+        with h5py.File(os.path.join(cesaro_cache_dir, entry), 'r+') as f:
+            f.attrs['version'] = np.string_('0.0.0')
+            f['nDCesaro'][...] = 0
+    da.new_decond(decond_cache[3], testfile, fit, cesaro_cache=cache)
+    assert_same_datasets(decondtest, decond_cache[3])
+    for entry in entries:
+        with h5py.File(os.path.join(cesaro_cache_dir, entry), 'r') as f:
+            assert(f.attrs['version'] == np.string_(da.__version__))
+
+    # least recently used entries are removed, where the entries of
+    # the random samples are of different sizes
+    sizes = [os.path.getsize(os.path.join(cesaro_cache_dir, e))
+             for e in entries]
+    cache = da.CesaroCache(cesaro_cache_dir,
+                           max_size=sizes[0] + min(sizes[1:]) / 2)
+    os.remove(os.path.join(cesaro_cache_dir, entries[0]))
+    os.remove(decond_cache[0])
+    da.new_decond(decond_cache[0], testfile, fit, cesaro_cache=cache)
+    assert_same_datasets(decondtest, decond_cache[0])
+    assert(len([e for e in os.listdir(cesaro_cache_dir)
+                if e.endswith('.h5')]) == 1)
+    print("test_cesaro_cache: pass")
+
+
+decond_m2 = ['decond_m2_one_test.d5', 'decond_m2_test.d5',
+             'decond_m2_slabs_test.d5', 'decond_m2_old_test.d5',
+             'decond_m2_old_extend_test.d5']
+
+
+def test_m2_decond():
+    print("test_m2_decond: starting...")
+    for file in decond_m2:
+        if os.path.exists(file):
+            os.remove(file)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+        assert(f.attrs['formatRevision'] == da.DecondFile._format_revision)
+        for dectype in da.DecType:
+            assert(np.allclose(f[dectype.value + '/decPairCount_sum'],
+                               f['numSample'][...] *
+                               f[dectype.value + '/decPairCount'][...]))
+
+    # extending a single sample, whose errors are nan, loses nothing
+    da.new_decond(decond_m2[0], testfile[0], fit)
+    da.extend_decond(decond_m2[1], decond_m2[0], testfile[1:])
+    assert_same_datasets(decondtest, decond_m2[1])
+    da.extend_decond(decond_m2[2], decond_m2[0], testfile[1:],
+                     max_memory=1000)
+    assert_same_datasets(decondtest, decond_m2[2])
+
+    # files without m2 are still read and extended
+    shutil.copyfile(decondtest, decond_m2[3])
+    with h5py.File(decond_m2[3], 'r+') as f:
+        del f.attrs['formatRevision']
+        names = []
+        f.visit(names.append)
+        for name in names:
+            if name.endswith('_m2') or name.endswith('_sum'):
+                del f[name]
+    with da.DecondFile(decond_m2[3]) as f, \
+            da.DecondFile(decondtest) as f_ref:
+        assert(np.array_equal(f.buffer.nDCesaro_err,
+                              f_ref.buffer.nDCesaro_err, equal_nan=True))
+    try:
+        da.extend_decond(decond_m2[4], decond_m2[3], extend_file[0])
+    except da.FitRangeError:
+        print("  Extension failed: FitRangeError occurred\n"
+              "  Ignore the extension of the file without m2")
+    else:
+        with da.DecondFile(decond_m2[4]) as f, \
+                da.DecondFile(decondtest) as f_ref:
+            assert(f.buffer.numSample == f_ref.buffer.numSample + 1)
+            assert(f.attrs['formatRevision'] ==
+                   da.DecondFile._format_revision)
+
+    # newer revisions are refused
+    with h5py.File(decond_m2[3], 'r+') as f:
+        f.attrs['formatRevision'] = da.DecondFile._format_revision + 1
+    try:
+        da.DecondFile(decond_m2[3])
+    except da.Error:
+        pass
+    else:
+        raise AssertionError("newer format revision was accepted")
+    print("test_m2_decond: pass")
+
+
+decond_merge = ['decond_merge_part_test.d5', 'decond_merge_test.d5']
+
+
+def test_merge_decond():
+    print("test_merge_decond: starting...")
+    for file in decond_merge:
+        if os.path.exists(file):
+            os.remove(file)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+    max_timelag = np.inf
+    for file in extend_file + [decondtest]:
+        with h5py.File(file, 'r') as f:
+            max_timelag = min(max_timelag, f['timeLags'][-1])
+
+    if np.any(fit > max_timelag):
+        print("  Fit ranges are out of the common timeLags\n"
+              "  Ignore this test")
+    else:
+        da.new_decond(decond_merge[0], extend_file, fit)
+        da.merge_decond(decond_merge[1], [decondtest, decond_merge[0]])
+        assert_same_datasets(decond_extend[0], decond_merge[1])
+    print("test_merge_decond: pass")
+
+
+decond_limit = 'decond_limit_test.d5'
+
+
+def test_limit_decond():
+    print("test_limit_decond: starting...")
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+        timelags = f['timeLags'][...]
+    max_lag = timelags[np.searchsorted(timelags, np.max(fit))]
+    max_bin = {da.DecType.spatial: 0.05, da.DecType.energy: 0.3}
+
+    for kwarg in ({}, {'max_memory': 1000}, {'num_proc': 2}):
+        if os.path.exists(decond_limit):
+            os.remove(decond_limit)
+        da.new_decond(decond_limit, testfile, fit, max_lag=max_lag,
+                      max_bin=max_bin, **kwarg)
+
+        with h5py.File(decondtest, 'r') as f, \
+                h5py.File(decond_limit, 'r') as f_limit:
+            timelags = f_limit['timeLags'][...]
+            assert(np.all(timelags <= max_lag + 1e-6))
+            t_sel = da._get_inner_sel(f['timeLags'][...], timelags)[0]
+            assert(np.allclose(f['nD'][...], f_limit['nD'][...],
+                               equal_nan=True))
+            assert(np.allclose(f['nCorr'][:, t_sel], f_limit['nCorr'][...]))
+            for dectype in da.DecType:
+                group = f[dectype.value]
+                group_limit = f_limit[dectype.value]
+                decbins = group_limit['decBins'][...]
+                assert(np.all(np.abs(decbins) <= max_bin[dectype] + 1e-6))
+                sel = da._get_inner_sel(group['decBins'][...], decbins)[0]
+                assert(np.allclose(group['decD'][:, :, sel],
+                                   group_limit['decD'], equal_nan=True))
+                for name in ('decCorr', 'decCorr_err'):
+                    assert(np.allclose(group[name][:, sel, t_sel],
+                                       group_limit[name], equal_nan=True))
+    print("test_limit_decond: pass")
+
+
+block_file = ['corr_block{}_test.c5'.format(i) for i in range(8)]
+decond_block = ['decond_block_test.d5', 'decond_noblock_test.d5']
+
+
+def test_block_decond():
+    print("test_block_decond: starting...")
+    for file in block_file:
+        rand_c5(file, nummoltype)
+    for file in decond_block:
+        if os.path.exists(file):
+            os.remove(file)
+
+    fit = [[0.5, 4.0]]
+    block = da.new_decond(decond_block[0], block_file, fit,
+                          block_average=True)
+    noblock = da.new_decond(decond_block[1], block_file, fit)
+
+    # the same means and m2, and the errors of the first level
+    # are those of independent samples
+    assert(np.allclose(block.nDCesaro, noblock.nDCesaro))
+    assert(np.allclose(block.nDCesaro_m2, noblock.nDCesaro_m2))
+
+    def blocking_err(data):
+        errs = []
+        while len(data) > 1:
+            errs.append(np.std(data, axis=0, ddof=1) / np.sqrt(len(data)))
+            num = len(data) // 2 * 2
+            data = (data[0:num:2] + data[1:num:2]) / 2
+        errs = np.array(errs)
+        size = 2**np.arange(len(errs)).reshape(
+                (-1,) + (1,) * (errs.ndim - 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            optimal = size**3 > 2 * len(block_file) * (errs / errs[0])**4
+        err = errs[-1].copy()
+        for level in range(len(errs) - 1, -1, -1):
+            err[optimal[level]] = errs[level][optimal[level]]
+        return err
+
+    cfs = [da.CorrFile(file) for file in block_file]
+    for i, cf1 in enumerate(cfs):
+        for cf2 in cfs[i+1:]:
+            cf1._intersect_buffer(cf2)
+    for cf in cfs:
+        cf._cal_cesaro(dec=False)
+    for name in ('nCorr', 'nDCesaro', 'nDTotalCesaro'):
+        data = np.array([getattr(cf.buffer, name) for cf in cfs])
+        assert(np.allclose(getattr(block, name + '_err'), blocking_err(data),
+                           equal_nan=True))
+    spatial = [getattr(cf.buffer, da.DecType.spatial.value) for cf in cfs]
+    assert(np.allclose(
+        getattr(block, da.DecType.spatial.value).decPairCount_err,
+        blocking_err(np.array([buf.decPairCount for buf in spatial]))))
+    for cf in cfs:
+        cf.close()
+
+    # the fits are weighted by the block errors
+    with da.DecondFile(decond_block[0]) as f:
+        assert(np.allclose(f.buffer.nDCesaro_err, block.nDCesaro_err,
+                           equal_nan=True))
+        assert(np.allclose(f.buffer.nD_err, block.nD_err, equal_nan=True))
+    print("test_block_decond: pass")
+
+
+decond_append = ['decond_append_test.d5', 'decond_append_slab_test.d5']
+
+
+def test_append_decond():
+    print("test_append_decond: starting...")
+    for file, max_memory in zip(decond_append, (None, 1000)):
+        shutil.copyfile(decondtest, file)
+        try:
+            da.append_decond(file, extend_file, max_memory=max_memory)
+        except da.FitRangeError:
+            print("  Extension failed: FitRangeError occurred\n"
+                  "  Ignore this test")
+            assert_same_datasets(decondtest, file)
+            continue
+        assert_same_datasets(decond_extend[0], file)
+        with h5py.File(file, 'r') as f:
+            assert(da.CorrFile._journal_key not in f.attrs)
+            names = []
+            f.visit(names.append)
+            assert(not any(name.endswith(da.CorrFile._shadow_suffix)
+                           for name in names))
+    print("test_append_decond: pass")
+
+
+decond_append_size = 'decond_append_size_test.d5'
+
+
+def test_append_size_decond():
+    print("test_append_size_decond: starting...")
+    if os.path.exists(decond_append_size):
+        os.remove(decond_append_size)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+
+    # the space freed by each update is reused by the next one
+    da.new_decond(decond_append_size, testfile, fit)
+    sizes = []
+    for _ in range(8):
+        da.append_decond(decond_append_size, testfile)
+        sizes.append(os.path.getsize(decond_append_size))
+    assert(max(sizes) <= 1.25 * sizes[0])
+    print("test_append_size_decond: pass")
+
+
+decond_layout = 'decond_layout_test.d5'
+decond_layout_invalid = 'decond_layout_invalid_test.d5'
+
+
+def test_layout_decond():
+    print("test_layout_decond: starting...")
+    if os.path.exists(decond_layout):
+        os.remove(decond_layout)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+
+    da.new_decond(decond_layout, testfile, fit, chunks=(2, 16),
+                  compression='gzip', shuffle=True, rdcc_nbytes=2**20)
+    assert_same_datasets(decondtest, decond_layout)
+
+    with h5py.File(decond_layout, 'r') as f:
+        for dectype in da.DecType:
+            dset = f[dectype.value + '/decCorr']
+            assert(dset.chunks == (1, min(2, dset.shape[1]),
+                                   min(16, dset.shape[2])))
+            assert(dset.compression == 'gzip')
+            assert(dset.shuffle)
+        assert(f['timeLags'].chunks is None)
+
+    # invalid compression options are refused before creating the file
+    if os.path.exists(decond_layout_invalid):
+        os.remove(decond_layout_invalid)
+    for compression, level in (('lzf', 4), (None, 4), ('gzip', 10)):
+        try:
+            da.new_decond(decond_layout_invalid, testfile, fit,
+                          compression=compression, compression_opts=level)
+        except da.Error:
+            assert(not os.path.exists(decond_layout_invalid))
+        else:
+            assert(False)
+    print("test_layout_decond: pass")
+
+
+decond_precision = ['decond_float32_test.d5', 'decond_scaleoffset_test.d5',
+                    'decond_one_test.d5', 'decond_one_scaleoffset_test.d5',
+                    'decond_extend_float32_test.d5',
+                    'decond_extend_float64_test.d5']
+
+
+def test_precision_decond():
+    print("test_precision_decond: starting...")
+    for file in decond_precision:
+        if os.path.exists(file):
+            os.remove(file)
+
+    with h5py.File(decondtest, 'r') as f:
+        fit = f['fit'][...]
+    da.new_decond(decond_precision[0], testfile, fit, precision='float32')
+    da.new_decond(decond_precision[1], testfile, fit, precision=1e-5)
+
+    with h5py.File(decond_precision[0], 'r') as f:
+        for dectype in da.DecType:
+            group = f[dectype.value]
+            for name in ('decCorr', 'decCorr_err', 'decDCesaro_m2'):
+                assert(group[name].dtype == np.float32)
+            assert(group['decD'].dtype == np.float64)
+    with h5py.File(decond_precision[1], 'r') as f:
+        assert(f[da.DecType.spatial.value]['decCorr'].scaleoffset
+               is not None)
+
+    # the fits are computed in float64 before the data are stored
+    for file, rel_err in zip(decond_precision[:2], (1e-7, 1e-5)):
+        deviations = da.compare_decond(decondtest, file)
+        for name, (max_abs, max_rel, num_nan) in deviations.items():
+            assert(max_rel <= rel_err and num_nan == 0)
+            if name.endswith('D') or name.endswith('D_err'):
+                assert(max_abs == 0)
+
+    # read back as float64 with the nan
+    da.new_decond(decond_precision[2], testfile[0], fit)
+    da.new_decond(decond_precision[3], testfile[0], fit, precision=1e-5)
+    with da.DecondFile(decond_precision[3], lazy=True) as f:
+        decbuf = getattr(f.buffer, da.DecType.spatial.value)
+        assert(decbuf.decCorr.dtype == np.float64)
+        assert(np.all(np.isnan(decbuf.decCorr_err)))
+    deviations = da.compare_decond(decond_precision[2], decond_precision[3])
+    assert(all(num_nan == 0 for _, _, num_nan in deviations.values()))
+
+    # samples are added in float64, and the profile is kept in place
+    buf = da.extend_decond(decond_precision[4], decond_precision[0],
+                           testfile)
+    decbuf = getattr(buf, da.DecType.spatial.value)
+    assert(decbuf.decCorr.dtype == np.float64)
+    ref = da.extend_decond(decond_precision[5], decondtest, testfile)
+    assert(np.allclose(buf.nD, ref.nD, rtol=1e-5, equal_nan=True))
+    da.refit_decond(decond_precision[1], fit[:1])
+    with h5py.File(decond_precision[1], 'r') as f:
+        assert(f[da.DecType.spatial.value]['decCorr'].scaleoffset
+               is not None)
+        assert(np.allclose(f['fit'][...], fit[:1]))
+    print("test_precision_decond: pass")
+
+
 decond_fit = 'decond_changefit_test.d5'
 
 
+decond_fit_link = 'decond_changefit_link_test.d5'
+decond_fit_inplace = 'decond_changefit_inplace_test.d5'
+
+
 def test_fit_decond():
     print("test_fit_decond: starting...")
     if os.path.exists(decond_fit):
@@ -494,9 +1062,298 @@ def test_fit_decond():
                range(np.random.random_integers(max_numfit))]
 
     da.fit_decond(decond_fit, decondtest, fit)
+
+    # linked to decondtest
+    if os.path.exists(decond_fit_link):
+        os.remove(decond_fit_link)
+    da.fit_decond(decond_fit_link, decondtest, fit, link=True)
+    assert_same_datasets(decond_fit, decond_fit_link)
+    with h5py.File(decond_fit_link, 'r') as f:
+        assert(isinstance(f.get('nCorr', getlink=True), h5py.ExternalLink))
+        assert(not isinstance(f.get('nD', getlink=True), h5py.ExternalLink))
+
+    # in place
+    shutil.copyfile(decondtest, decond_fit_inplace)
+    da.refit_decond(decond_fit_inplace, fit)
+    assert_same_datasets(decond_fit, decond_fit_inplace)
     print("test_fit_decond: pass")
 
 
+decond_scan = 'decond_scan_test.d5'
+decond_scan_fit = 'decond_scan_fit_test.d5'
+decond_scan_out = 'decond_scan_out_test.h5'
+
+
+def test_scan_decond():
+    print("test_scan_decond: starting...")
+    for file in (decond_scan, decond_scan_fit, decond_scan_out):
+        if os.path.exists(file):
+            os.remove(file)
+    shutil.copyfile(decondtest, decond_scan)
+
+    with h5py.File(decondtest, 'r') as f:
+        timelags = f['timeLags'][...]
+    begin = (timelags[5], timelags[30])
+    end = (timelags[40], timelags[-1])
+    scan = da.scan_decond(decond_scan, begin, end, num=7, dec=True,
+                          outname=decond_scan_out)
+    assert(np.all(scan['begin'] >= begin[0]) and
+           np.all(scan['begin'] <= begin[1]))
+    assert(scan['plateau'].shape == scan['nDTotal'].shape)
+
+    # each window is the same as fitting it alone
+    i, j = 3, 4
+    fit = [[scan['begin'][i], scan['end'][j]]]
+    buf = da.fit_decond(decond_scan_fit, decondtest, fit)
+    assert(np.allclose(scan['nDTotal'][i, j], buf.nDTotal[0]))
+    assert(np.allclose(scan['nD'][i, j], buf.nD[0]))
+    assert(np.allclose(scan['nD_err'][i, j], buf.nD_err[0]))
+    for dectype in da.DecType:
+        decbuf = getattr(buf, dectype.value)
+        assert(np.allclose(scan[dectype.value + '/decD'][i, j],
+                           decbuf.decD[0], equal_nan=True))
+
+    with h5py.File(decond_scan_out, 'r') as f:
+        assert(np.array_equal(f['nDTotal'][...], scan['nDTotal'],
+                              equal_nan=True))
+
+    # the chosen window is written back in place
+    if scan['fit'] is not None:
+        da.scan_decond(decond_scan, begin, end, num=7, apply=True)
+        with h5py.File(decond_scan, 'r') as f:
+            assert(np.allclose(f['fit'][...], scan['fit']))
+    print("test_scan_decond: pass")
+
+
+decond_resample = ['decond_jackknife_test.h5', 'decond_bootstrap_test.h5',
+                   'decond_bootstrap_reuse_test.h5']
+
+
+def test_resample_decond():
+    print("test_resample_decond: starting...")
+    for file in decond_resample:
+        if os.path.exists(file):
+            os.remove(file)
+
+    jackknife = da.resample_decond(decond_resample[0], decondtest, testfile,
+                                   'jackknife')
+    with da.DecondFile(decondtest) as f:
+        buf = f.buffer
+        assert(np.allclose(jackknife['nD'], buf.nD, equal_nan=True))
+        assert(np.allclose(jackknife['nDTotal'], buf.nDTotal,
+                           equal_nan=True))
+        for dectype in da.DecType:
+            decbuf = getattr(buf, dectype.value)
+            assert(np.allclose(jackknife[dectype.value + '/decD'],
+                               decbuf.decD, equal_nan=True))
+
+    # the jackknife error of a mean is the standard error of the slopes
+    with h5py.File(decond_resample[0], 'r') as f:
+        slopes = f['samples/nD'][...]
+        assert(f.attrs['method'].decode() == 'jackknife')
+    assert(np.allclose(jackknife['nD_err'],
+                       np.std(slopes, axis=0, ddof=1) /
+                       np.sqrt(len(testfile)), equal_nan=True))
+
+    bootstrap = da.resample_decond(decond_resample[1], decondtest, testfile,
+                                   num_resample=50, seed=7, num_proc=2)
+    assert(not np.any(bootstrap['nDTotal_lower'] >
+                      bootstrap['nDTotal_upper']))
+    assert(np.allclose(bootstrap['qntTotal'] / bootstrap['nDTotal'],
+                       bootstrap['qntTotal_err'] / bootstrap['nDTotal_err'],
+                       equal_nan=True))
+
+    # the slopes of the samples are reused without reading them
+    reuse = da.resample_decond(decond_resample[2], decondtest,
+                               num_resample=50, seed=7,
+                               slopename=decond_resample[0])
+    for name, data in bootstrap.items():
+        assert(np.allclose(reuse[name], data, equal_nan=True))
+    print("test_resample_decond: pass")
+
+
+decond_window = ['decond_window_test.d5', 'decond_window_edges_test.d5',
+                 'decond_window_equal_test.d5']
+
+
+def test_window_decond():
+    print("test_window_decond: starting...")
+    for file in decond_window:
+        if os.path.exists(file):
+            os.remove(file)
+
+    binw = 2
+    window = {da.DecType.spatial: binw, da.DecType.energy: 3}
+    buf = da.window_decond(decond_window[0], decondtest, window,
+                           report=False)
+    with da.DecondFile(decondtest) as f:
+        ref = f.buffer
+        sd = ref.spatialDec
+        num_group = sd.decBins.size // binw
+        sel = np.s_[:, :num_group * binw]
+
+        def group(data):
+            return np.sum(np.reshape(
+                data[sel], data.shape[:1] + (num_group, binw) +
+                data.shape[2:]), axis=2)
+
+        weight = sd.decPairCount_sum
+        w = weight[..., np.newaxis]
+        sum_w = group(weight)[..., np.newaxis]
+        out = buf.spatialDec
+        assert(np.allclose(out.decBins, group(sd.decBins[np.newaxis])[0] /
+                           binw))
+        assert(np.allclose(out.decPairCount, group(sd.decPairCount)))
+        assert(np.allclose(out.decCorr, group(sd.decCorr * w) / sum_w))
+        assert(np.allclose(out.decDCesaro,
+                           group(sd.decDCesaro * w) / sum_w))
+        assert(np.allclose(out.decCorr_err, np.sqrt(group(
+            np.square(sd.decCorr_err * w))) / sum_w))
+        assert(np.allclose(out.decCorr_err, da._m2_to_err(
+            out.decCorr_m2, ref.numSample,
+            out.decPairCount_sum / ref.numSample)))
+        assert(np.allclose(out.decD, np.sum(np.reshape(
+            (sd.decD * weight)[..., :num_group * binw],
+            sd.decD.shape[:2] + (num_group, binw)), axis=3) /
+            group(weight), equal_nan=True))
+        assert(np.isclose(buf.energyDec.decBins, 0).any())
+
+        # the same groups by bin edges, merged one time lag at a time
+        dr = sd.decBins[1] - sd.decBins[0]
+        edges = sd.decBins[0] + dr * (binw * np.arange(num_group + 1) - 0.5)
+        with da.DecondFile(decondtest, lazy=True) as infile, \
+                da.DecondFile(decond_window[1], 'w-') as outfile:
+            outfile.buffer = infile.buffer
+            outfile._change_window({da.DecType.spatial: edges}, block=1)
+        with h5py.File(decond_window[0], 'r') as f0, \
+                h5py.File(decond_window[1], 'r') as f1:
+            for name in ('decBins', 'decCorr', 'decCorr_err', 'decDCesaro',
+                         'decD', 'decD_err', 'decPairCount_sum'):
+                name = 'spatialDec/' + name
+                np.testing.assert_allclose(f0[name][...], f1[name][...])
+
+    buf = da.window_decond(decond_window[2], decondtest,
+                           {da.DecType.spatial: ('equal', 2)}, report=False)
+    assert(buf.spatialDec.decBins.size == 2)
+    assert(np.isclose(np.sum(buf.spatialDec.decPairCount),
+                      np.sum(sd.decPairCount)))
+    print("test_window_decond: pass")
+
+
+decond_sweep = 'decond_sweep_test.d5'
+decond_sweep_window = 'decond_sweep_window_test.d5'
+
+
+def test_sweep_window_decond():
+    print("test_sweep_window_decond: starting...")
+    for file in (decond_sweep, decond_sweep_window):
+        if os.path.exists(file):
+            os.remove(file)
+
+    swept = da.sweep_window_decond(decond_sweep, decondtest, range(1, 5),
+                                   report=False, block=7)
+    assert(swept[da.DecType.spatial] == [1, 2, 3, 4])
+    assert(swept[da.DecType.energy] == [1, 3])
+
+    names = ('decBins', 'decPairCount', 'decCorr', 'decCorr_err',
+             'decDCesaro', 'decDCesaro_err', 'decD', 'decD_err')
+    with h5py.File(decond_sweep, 'r') as f, \
+            h5py.File(decondtest, 'r') as f_ref:
+        for dectype in da.DecType:
+            for name in names:
+                np.testing.assert_allclose(
+                        f['{}/1/{}'.format(dectype.value, name)][...],
+                        f_ref['{}/{}'.format(dectype.value, name)][...])
+
+    for spatial, energy in ((3, 3), (4, 1)):
+        if os.path.exists(decond_sweep_window):
+            os.remove(decond_sweep_window)
+        window = {da.DecType.spatial: spatial, da.DecType.energy: energy}
+        da.window_decond(decond_sweep_window, decondtest, window,
+                         report=False)
+        with h5py.File(decond_sweep, 'r') as f, \
+                h5py.File(decond_sweep_window, 'r') as f_ref:
+            for dectype in da.DecType:
+                for name in names:
+                    np.testing.assert_allclose(
+                            f['{}/{}/{}'.format(dectype.value,
+                                                window[dectype], name)][...],
+                            f_ref['{}/{}'.format(dectype.value, name)][...],
+                            atol=1e-12)
+    print("test_sweep_window_decond: pass")
+
+
+def test_lazy_buffer():
+    print("test_lazy_buffer: starting...")
+    with da.DecondFile(decondtest) as f, \
+            da.DecondFile(decondtest, lazy=True) as f_lazy:
+        for dectype in da.DecType:
+            buf = getattr(f.buffer, dectype.value)
+            lazy_buf = getattr(f_lazy.buffer, dectype.value)
+            assert('decCorr' not in vars(lazy_buf))
+            assert(np.array_equal(buf.decCorr, lazy_buf.decCorr,
+                                  equal_nan=True))
+            assert('decCorr' in vars(lazy_buf))
+            assert(np.array_equal(buf.decDCesaro_err,
+                                  lazy_buf.decDCesaro_err, equal_nan=True))
+        assert(np.array_equal(f.buffer.nCorr, f_lazy.buffer.nCorr))
+
+    with da.DecondFile(decondtest, lazy=True, cache=False) as f_lazy:
+        f_lazy.buffer.nDCesaro
+        assert('nDCesaro' not in vars(f_lazy.buffer))
+    print("test_lazy_buffer: pass")
+
+
+def test_read_dataset():
+    print("test_read_dataset: starting...")
+    with h5py.File(decondtest, 'r') as f, \
+            h5py.File(decond_layout, 'r') as f_chunked:
+        for dectype in da.DecType:
+            name = dectype.value + '/decCorr'
+            data = da._read_dataset(f[name])
+            assert(isinstance(data, np.memmap))
+            assert(not data.flags.writeable)
+            assert(np.array_equal(data, f[name][...], equal_nan=True))
+
+            sel = np.s_[:, 1:3, ::2]
+            assert(np.array_equal(da._read_dataset(f[name], sel, 'c'),
+                                  f[name][sel], equal_nan=True))
+
+            data = da._read_dataset(f_chunked[name])
+            assert(not isinstance(data, np.memmap))
+            assert(np.array_equal(data, f_chunked[name][...],
+                                  equal_nan=True))
+    print("test_read_dataset: pass")
+
+
+def test_inspect_files():
+    print("test_inspect_files: starting...")
+    names = testfile + extend_file + [decondtest, 'nonexistent_test.c5']
+    groups, errors = da.inspect_files(names, num_proc=2)
+    assert([e['file'] for e in errors] == ['nonexistent_test.c5'])
+    assert(sorted(f for g in groups for f in g['files']) ==
+           sorted(names[:-1]))
+
+    for group in groups:
+        axes = [da._read_axes(f) for f in group['files']]
+        timelags = axes[0][0][da._get_common_sels([a[0] for a in axes])[0]]
+        assert(group['timeLags']['size'] == timelags.size)
+        assert(np.isclose(group['timeLags']['begin'], timelags[0]))
+        assert(np.isclose(group['timeLags']['end'], timelags[-1]))
+        for dectype in da.DecType:
+            decbins = axes[0][1][dectype][da._get_common_sels(
+                    [a[1][dectype] for a in axes])[0]]
+            assert(group[dectype.value]['size'] == decbins.size)
+
+    out = io.StringIO()
+    da.report_inspect(names, out=out)
+    assert(json.loads(out.getvalue())['groups'] == groups)
+    out = io.StringIO()
+    da.report_inspect(names, 'csv', out=out)
+    assert(len(out.getvalue().splitlines()) == len(groups) + 2)
+    print("test_inspect_files: pass")
+
+
 def test_get_rdf():
     print("test_get_rdf: starting...")
     da.get_rdf(decondtest)
@@ -513,6 +1370,49 @@ def test_get_decD():
     print("test_get_decD: starting...")
     da.get_decD(decondtest, da.DecType.spatial)
     da.get_decD(decondtest, da.DecType.energy)
+
+    # thresholding and smoothing, against a loop over the curves
+    for dectype in da.DecType:
+        weight = da.get_normalize_paircount(decondtest, dectype)
+        threshold = np.percentile(weight, 30)
+        decD_full, _, _, decBins_full = da.get_decD(decondtest, dectype)[:4]
+        decD, _, _, decBins = da.get_decD(decondtest, dectype, weight,
+                                          threshold)[:4]
+        padded = da.get_decD(decondtest, dectype, weight, threshold,
+                             padded=True)
+        decD_pad, idx = padded[0], padded[-1]
+        smooth_D, _, _, smooth_bins = da.get_decD(
+                decondtest, dectype, weight, threshold, smooth='linear',
+                num_smooth_point=50)[:4]
+        for i, DD in enumerate(decD_full):
+            for j, D in enumerate(DD):
+                first = next(k for k, w in enumerate(weight[j])
+                             if w >= threshold)
+                assert(idx[j] == first)
+                assert(np.array_equal(decD[i][j], D[first:],
+                                      equal_nan=True))
+                assert(np.array_equal(decBins[i][j], decBins_full[first:]))
+                assert(np.all(decD_pad.mask[i, j] ==
+                              (np.arange(D.size) < first)))
+                assert(np.array_equal(decD_pad.data[i, j], D,
+                                      equal_nan=True))
+                valid = ~np.isnan(D[first:])
+                if np.count_nonzero(valid) < 2:
+                    assert(np.all(np.isnan(smooth_D[i][j])))
+                    continue
+                bins = decBins_full[first:][valid]
+                interp = interpolate.interp1d(bins, D[first:][valid],
+                                              kind='linear')
+                x = np.linspace(bins[0], bins[-1], 50)
+                assert(np.allclose(smooth_bins[i][j], x))
+                assert(np.allclose(smooth_D[i][j], interp(x)))
+
+        deccorr = da.get_deccorr(decondtest, dectype, weight, threshold)[0]
+        deccorr_pad = da.get_deccorr(decondtest, dectype, weight, threshold,
+                                     padded=True)[0]
+        for j, decc in enumerate(deccorr):
+            assert(np.array_equal(decc, deccorr_pad[j, idx[j]:].data))
+            assert(np.all(deccorr_pad.mask[j, :idx[j]]))
     print("test_get_decD: pass")
 
 
@@ -523,4 +1423,83 @@ def test_get_ec_dec():
         da.get_ec_dec_energy(decondtest)
     except da.NotImplementedError:
         print("  NotImplementedError caught")
+
+    # stacked over the parameters, the same as one at a time
+    seps = [True, False, 'end']
+    thresholds = np.array([0, 0.05, 0.2])
+    ec_I, _, ec_IL = da.get_ec_dec_energy(decondtest, seps, thresholds)[:3]
+    assert(ec_IL.shape[:2] == (len(seps), thresholds.size))
+    for i, sep in enumerate(seps):
+        for j, threshold in enumerate(thresholds):
+            one_I, _, one_IL = da.get_ec_dec_energy(decondtest, sep,
+                                                    threshold)[:3]
+            assert(np.allclose(ec_I[i, j], one_I, equal_nan=True))
+            assert(np.allclose(ec_IL[i, j], one_IL, equal_nan=True))
+    ec_I = da.get_ec_dec_energy(decondtest, threshold=thresholds)[0]
+    assert(ec_I.shape[0] == thresholds.size)
     print("test_get_ec_dec: pass")
+
+
+def test_get_decqnt_sd():
+    print("test_get_decqnt_sd: starting...")
+    with da.DecondReader(decondtest) as reader:
+        decBins = reader.get_decbins(da.DecType.spatial)[0]
+        bw = (decBins[1] - decBins[0]) / da.const.nano
+
+        # stacked over sep_r, the same as one at a time
+        sep_r = np.array([1.5, 2.5, 3.5]) * bw
+        decqnt, _, bins, _, _, _, local, nonlocal_ = reader.get_decqnt2_sd(
+                True, sep_r)
+        assert(np.array_equal(bins, decBins))
+        for i, r in enumerate(sep_r):
+            one = reader.get_decqnt2_sd(True, r)
+            num_bin = one[0].shape[-1]
+            assert(np.all(decqnt.mask[i, ..., num_bin:]))
+            assert(np.allclose(decqnt.data[i, ..., :num_bin], one[0],
+                               equal_nan=True))
+            assert(np.allclose(local[i], one[6], equal_nan=True))
+            assert(np.allclose(nonlocal_[i], one[7], equal_nan=True))
+
+        # stacked over the reference windows
+        refs = np.array([[2.5], [4.5]]) * bw
+        avewidths = np.array([1, 2]) * bw
+        decqnt, _, _, _, _, _, local, nonlocal_ = reader.get_decqnt_sd(
+                True, refs, avewidths)
+        assert(decqnt.shape[:2] == (2, 2))
+        for i, ref in enumerate(refs[:, 0]):
+            for j, avewidth in enumerate(avewidths):
+                one = reader.get_decqnt_sd(True, ref, avewidth)
+                assert(np.allclose(decqnt[i, j], one[0], equal_nan=True))
+                assert(np.allclose(local[i, j], one[6], equal_nan=True))
+                assert(np.allclose(nonlocal_[i, j], one[7], equal_nan=True))
+                # the mean of decD over the window
+                decD = reader.get_decD(da.DecType.spatial)[0]
+                ref_idx, width_idx = int(ref / bw), int(avewidth / bw)
+                decD_nonlocal = np.mean(
+                        decD[..., ref_idx - width_idx:ref_idx + width_idx],
+                        axis=-1)
+                decD_nonlocal /= da.const.nano**2 / da.const.pico
+                assert(np.allclose(reader._decqnt_sd(
+                    decD_nonlocal, da._nummolpair(reader._read('numMol')))[2],
+                    one[7], equal_nan=True))
+    print("test_get_decqnt_sd: pass")
+
+
+def test_decond_reader():
+    print("test_decond_reader: starting...")
+    with da.DecondReader(decondtest) as reader:
+        for dectype in da.DecType:
+            decD = reader.get_decD(dectype)[0]
+            decD_ref = da.get_decD(decondtest, dectype)[0]
+            assert(np.array_equal(decD, decD_ref, equal_nan=True))
+
+            # the returned copy can be changed without touching the cache
+            decD *= 2
+            decD = reader.get_decD(dectype)[0]
+            assert(np.array_equal(decD, decD_ref, equal_nan=True))
+
+        D, D_err = reader.get_D()[0:2]
+        D_ref, D_err_ref = da.get_D(decondtest)[0:2]
+        assert(np.array_equal(D, D_ref, equal_nan=True))
+        assert(np.array_equal(D_err, D_err_ref, equal_nan=True))
+    print("test_decond_reader: pass")
@@ -5,11 +5,33 @@ import numpy as np
 
 np.seterr(all='raise')
 at.test_get_inner_sel()
+at.test_pair_type_index()
 at.test_fitlinear()
+at.test_welford_accumulator()
 at.test_new_decond()
 at.test_extend_decond()
+at.test_slab_decond()
+at.test_parallel_decond()
+at.test_cesaro_cache()
+at.test_m2_decond()
+at.test_merge_decond()
+at.test_limit_decond()
+at.test_block_decond()
+at.test_append_decond()
+at.test_append_size_decond()
+at.test_layout_decond()
+at.test_precision_decond()
 at.test_fit_decond()
+at.test_scan_decond()
+at.test_resample_decond()
+at.test_window_decond()
+at.test_sweep_window_decond()
+at.test_lazy_buffer()
+at.test_read_dataset()
+at.test_inspect_files()
 at.test_get_rdf()
 at.test_get_D()
 at.test_get_decD()
 at.test_get_ec_dec()
+at.test_get_decqnt_sd()
+at.test_decond_reader()